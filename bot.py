@@ -4,6 +4,9 @@ from pyrogram import Client, filters
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from config import Config
 from database import Database
+from utils.process import supervisor
+from utils.jobs import job_runner
+from utils.transfer import session_pool, prepared_uploads, can_upload_parallel, upload_file
 from handlers import start, help_command, admin, media, settings, encode, subtitle, extract, merge, rename, photo_handler, unzip, stop
 
 # Setup logging
@@ -31,14 +34,52 @@ class Bot(Client):
         me = await self.get_me()
         self.username = me.username
         logger.info(f"{me.first_name} Started ✅")
+        await self.db.create_indexes()
+        await self.db.load_bot_settings()
+        self.db.watch_bot_settings()
+        # Pick up jobs interrupted by the last restart
+        await job_runner.resume(self)
         
+    async def save_file(self, path, file_id=None, file_part=0, progress=None, progress_args=()):
+        # Every reply_video/reply_document goes through here; big outputs are
+        # sent as parallel parts. Re-sends of single parts (file_id set) don't.
+        if file_id is None and isinstance(path, str) and path in prepared_uploads:
+            # Already uploaded while it was being encoded
+            return prepared_uploads.pop(path)
+        if file_id is None and can_upload_parallel(path):
+            try:
+                return await upload_file(self, path, progress, progress_args)
+            except Exception as e:
+                logger.warning(f"Parallel upload failed ({e}), falling back to a single stream")
+        return await super().save_file(path, file_id, file_part, progress, progress_args)
+
     async def stop(self, *args):
+        # Don't leave orphaned jobs or ffmpeg processes behind
+        await job_runner.shutdown()
+        await supervisor.terminate_all()
+        if self.db.bot_settings_watcher:
+            self.db.bot_settings_watcher.cancel()
+        await session_pool.stop()
         await super().stop()
         logger.info("Bot Stopped 🛑")
 
 # Initialize bot
 bot = Bot()
 
+# Heavy handlers run as background jobs so pyrogram workers are freed at once
+job_runner.register("encode", encode.encode_video)
+job_runner.register("encode_all", encode.encode_all_qualities)
+job_runner.register("compress", encode.compress_video)
+job_runner.register("merge", merge.merge_start)
+job_runner.register("soft_subtitle", subtitle.embed_soft_subtitle)
+job_runner.register("remove_subtitle", subtitle.remove_subtitle)
+job_runner.register("extract_subtitle", extract.extract_subtitle)
+job_runner.register("extract_audio", extract.extract_audio)
+job_runner.register("extract_thumbnail", extract.extract_thumbnail)
+job_runner.register("mediainfo", media.get_media_info)
+job_runner.register("rename", rename.rename_file)
+job_runner.register("unzip", unzip.unzip_file)
+
 # Register handlers
 @bot.on_message(filters.command("start") & (filters.private | filters.group))
 async def start_handler(client, message):
@@ -93,15 +134,19 @@ async def upload_handler(client, message):
 # Encoding commands
 @bot.on_message(filters.command(["144p", "240p", "360p", "480p", "720p", "1080p", "2160p"]) & (filters.private | filters.group))
 async def encode_handler(client, message):
-    await encode.encode_video(client, message)
+    job_runner.submit(client, message, "encode", f"Encode {message.command[0]}")
+
+@bot.on_message(filters.command("process") & filters.private)
+async def process_handler(client, message):
+    job_runner.submit(client, message, "encode", "Render queued edits")
 
 @bot.on_message(filters.command("all") & (filters.private | filters.group))
 async def encode_all_handler(client, message):
-    await encode.encode_all_qualities(client, message)
+    job_runner.submit(client, message, "encode_all", "Encode all qualities")
 
 @bot.on_message(filters.command("compress") & (filters.private | filters.group))
 async def compress_handler(client, message):
-    await encode.compress_video(client, message)
+    job_runner.submit(client, message, "compress", "Compress video")
 
 # Video editing commands
 @bot.on_message(filters.command("cut") & filters.private)
@@ -116,6 +161,21 @@ async def crop_handler(client, message):
 async def merge_handler(client, message):
     await merge.merge_videos(client, message)
 
+@bot.on_message(filters.command("merge_start") & filters.private)
+async def merge_start_handler(client, message):
+    # The queue only lives in memory, the job keeps the message ids
+    queue = merge.merge_queue.get(message.from_user.id, [])
+    message.command = ["merge_start"] + [str(video["message_id"]) for video in queue]
+    job_runner.submit(client, message, "merge", "Merge videos")
+
+@bot.on_message(filters.command("merge_clear") & filters.private)
+async def merge_clear_handler(client, message):
+    await merge.merge_clear(client, message)
+
+@bot.on_message(filters.command("merge_list") & filters.private)
+async def merge_list_handler(client, message):
+    await merge.merge_list(client, message)
+
 # Subtitle commands
 @bot.on_message(filters.command("sub") & filters.private)
 async def soft_sub_handler(client, message):
@@ -127,11 +187,11 @@ async def hard_sub_handler(client, message):
 
 @bot.on_message(filters.command("rsub") & filters.private)
 async def remove_sub_handler(client, message):
-    await subtitle.remove_subtitle(client, message)
+    job_runner.submit(client, message, "remove_subtitle", "Remove subtitles")
 
 @bot.on_message(filters.command("extract_sub") & filters.private)
 async def extract_sub_handler(client, message):
-    await extract.extract_subtitle(client, message)
+    job_runner.submit(client, message, "extract_subtitle", "Extract subtitles")
 
 # Audio commands
 @bot.on_message(filters.command("addaudio") & filters.private)
@@ -144,16 +204,16 @@ async def remove_audio_handler(client, message):
 
 @bot.on_message(filters.command("extract_audio") & filters.private)
 async def extract_audio_handler(client, message):
-    await extract.extract_audio(client, message)
+    job_runner.submit(client, message, "extract_audio", "Extract audio")
 
 # Extract commands
 @bot.on_message(filters.command("extract_thumb") & filters.private)
 async def extract_thumb_handler(client, message):
-    await extract.extract_thumbnail(client, message)
+    job_runner.submit(client, message, "extract_thumbnail", "Extract thumbnail")
 
 @bot.on_message(filters.command("mediainfo") & filters.private)
 async def mediainfo_handler(client, message):
-    await media.get_media_info(client, message)
+    job_runner.submit(client, message, "mediainfo", "Media info")
 
 # Admin commands
 @bot.on_message(filters.command("restart") & filters.private & filters.user(Config.ADMINS))
@@ -184,6 +244,10 @@ async def preset_handler(client, message):
 async def crf_handler(client, message):
     await admin.set_crf(client, message)
 
+@bot.on_message(filters.command("ratecontrol") & filters.private & filters.user(Config.ADMINS))
+async def ratecontrol_handler(client, message):
+    await admin.set_rate_profile(client, message)
+
 # Force subscribe commands
 @bot.on_message(filters.command("addchnl") & filters.private & filters.user(Config.ADMINS))
 async def add_channel_handler(client, message):
@@ -263,6 +327,10 @@ async def get_startpic_handler(client, message):
 # Media handler
 @bot.on_message((filters.video | filters.document) & (filters.private | filters.group))
 async def media_handler(client, message):
+    # A file sent after /sub or /hsub is the subtitle for that video
+    if message.document and message.from_user and message.from_user.id in subtitle.pending_subtitles:
+        await subtitle.process_subtitle_file(client, message)
+        return
     await media.handle_media(client, message)
 
 # Photo handler for thumbnails
@@ -273,12 +341,12 @@ async def photo_msg_handler(client, message):
 # Rename command
 @bot.on_message(filters.command("rename") & (filters.private | filters.group))
 async def rename_handler(client, message):
-    await rename.rename_file(client, message)
+    job_runner.submit(client, message, "rename", "Rename")
 
 # Unzip command
 @bot.on_message(filters.command("unzip") & (filters.private | filters.group))
 async def unzip_handler(client, message):
-    await unzip.unzip_file(client, message)
+    job_runner.submit(client, message, "unzip", "Unzip")
 
 # Stop command (handle both /stop and /stop<task_id>)
 @bot.on_message(filters.regex(r'^/stop'))
@@ -293,7 +361,7 @@ async def tasks_handler(client, message):
 # Callback query handler
 @bot.on_callback_query()
 async def callback_handler(client, callback_query):
-    from handlers.callbacks import handle_callback
+    from handlers.callback import handle_callback
     await handle_callback(client, callback_query)
 
 if __name__ == "__main__":
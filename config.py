@@ -20,6 +20,21 @@ class Config:
     DOWNLOAD_DIR = os.environ.get("DOWNLOAD_DIR", "./downloads")
     WORKERS = int(os.environ.get("WORKERS", "4"))
     
+    # Downloaded sources are cached by file_unique_id and evicted LRU past this size
+    SOURCE_CACHE_DIR = os.environ.get("SOURCE_CACHE_DIR", os.path.join(DOWNLOAD_DIR, "cache"))
+    SOURCE_CACHE_SIZE = int(os.environ.get("SOURCE_CACHE_SIZE", "10737418240"))  # 10GB
+    
+    # Parallel transfers: MTProto sessions per DC (1 = pyrogram's single stream)
+    TRANSFER_SESSIONS = int(os.environ.get("TRANSFER_SESSIONS", "4"))
+    PARALLEL_DOWNLOAD_MIN_SIZE = int(os.environ.get("PARALLEL_DOWNLOAD_MIN_SIZE", "20971520"))  # 20MB
+    UPLOAD_PARTS_IN_FLIGHT = int(os.environ.get("UPLOAD_PARTS_IN_FLIGHT", "8"))  # x 512KB of memory
+    
+    # Start encoding faststart MP4/MKV sources while they are still downloading
+    OVERLAP_DOWNLOAD = os.environ.get("OVERLAP_DOWNLOAD", "on").lower() == "on"
+    
+    # Write fragmented MP4 and upload it while it is being encoded
+    STREAM_UPLOAD = os.environ.get("STREAM_UPLOAD", "off").lower() == "on"
+    
     # Encoding settings
     DEFAULT_PRESET = os.environ.get("DEFAULT_PRESET", "medium")
     DEFAULT_CODEC = os.environ.get("DEFAULT_CODEC", "libx264")
@@ -30,8 +45,29 @@ class Config:
     MAX_FILE_SIZE = int(os.environ.get("MAX_FILE_SIZE", "2147483648"))  # 2GB default
     MAX_FILE_SIZE_PREMIUM = int(os.environ.get("MAX_FILE_SIZE_PREMIUM", "4294967296"))  # 4GB
     
+    # Segmented parallel encoding for long inputs
+    SEGMENTED_ENCODING = os.environ.get("SEGMENTED_ENCODING", "off").lower() == "on"
+    SEGMENT_SECONDS = int(os.environ.get("SEGMENT_SECONDS", "60"))
+    SEGMENT_WORKERS = int(os.environ.get("SEGMENT_WORKERS", "0"))  # 0 = auto
+    
+    # Content-adaptive CRF: sample encodes pick the highest CRF meeting the SSIM floor
+    ADAPTIVE_CRF = os.environ.get("ADAPTIVE_CRF", "off").lower() == "on"
+    ADAPTIVE_CRF_MIN_SSIM = float(os.environ.get("ADAPTIVE_CRF_MIN_SSIM", "0.97"))
+    ADAPTIVE_CRF_SAMPLES = int(os.environ.get("ADAPTIVE_CRF_SAMPLES", "3"))
+    ADAPTIVE_CRF_SAMPLE_SECONDS = int(os.environ.get("ADAPTIVE_CRF_SAMPLE_SECONDS", "4"))
+    
+    # Process limits (seconds, 0 = no limit)
+    FFMPEG_TIMEOUT = int(os.environ.get("FFMPEG_TIMEOUT", "21600"))  # 6 hours
+    FFPROBE_TIMEOUT = int(os.environ.get("FFPROBE_TIMEOUT", "60"))
+    
     # Queue settings
     MAX_CONCURRENT_TASKS = int(os.environ.get("MAX_CONCURRENT_TASKS", "2"))
+    MAX_TASKS_PER_USER = int(os.environ.get("MAX_TASKS_PER_USER", "1"))
+    MAX_TASKS_PER_USER_PREMIUM = int(os.environ.get("MAX_TASKS_PER_USER_PREMIUM", "2"))
+    
+    # Status message edit budget
+    STATUS_EDIT_INTERVAL = float(os.environ.get("STATUS_EDIT_INTERVAL", "3"))  # seconds per chat
+    STATUS_EDITS_PER_SECOND = float(os.environ.get("STATUS_EDITS_PER_SECOND", "20"))  # all chats
     
     # Force subscribe settings
     FORCE_SUB_CHANNELS = []
@@ -97,7 +133,7 @@ Use /help to see all available commands!
 **Encoding:**
 /144p, /240p, /360p, /480p, /720p, /1080p, /2160p - Convert to specific resolution
 /all - Encode in all qualities
-/compress - Compress video
+/compress - Compress video to a target size
 
 **Editing:**
 /cut - Trim video by time
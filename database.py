@@ -1,9 +1,33 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import OperationFailure
+from collections import OrderedDict
 from datetime import datetime, timedelta
+import time
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Per-user settings are cached in memory; setters invalidate their entry
+USER_SETTINGS_TTL = 300
+USER_SETTINGS_CACHE_SIZE = 1024
+
+# Backoff between bot settings change stream reconnects, in seconds
+SETTINGS_WATCH_MIN_DELAY = 1
+SETTINGS_WATCH_MAX_DELAY = 60
+# OperationFailure code when the server isn't a replica set
+CHANGE_STREAMS_UNSUPPORTED = 40573
+
+# Values used when a user never changed a setting
+USER_SETTING_DEFAULTS = {
+    "thumbnail": None,
+    "watermark": None,
+    "media_type": "video",
+    "spoiler": False,
+    "upload_mode": "default"
+}
+
 class Database:
     def __init__(self, uri):
         self.client = AsyncIOMotorClient(uri)
@@ -13,6 +37,27 @@ class Database:
         self.queue = self.db.queue
         self.premium = self.db.premium
         self.fsub_channels = self.db.fsub_channels
+        self.results = self.db.results
+        self.settings_cache = OrderedDict()
+        self.bot_settings = None
+        self.bot_settings_watcher = None
+
+    async def create_indexes(self):
+        """Create the indexes hot queries rely on (no-op when they exist)"""
+        indexes = [
+            (self.queue, [("status", ASCENDING), ("added_time", ASCENDING)], {}),
+            # Finished jobs are kept a week for throughput stats
+            (self.queue, [("finished_time", ASCENDING)], {"expireAfterSeconds": 7 * 24 * 3600}),
+            (self.users, [("user_id", ASCENDING)], {"unique": True}),
+            # The bot_settings document has no user_id
+            (self.settings, [("user_id", ASCENDING)], {"unique": True, "sparse": True}),
+            (self.premium, [("user_id", ASCENDING)], {"unique": True})
+        ]
+        for collection, keys, options in indexes:
+            try:
+                await collection.create_index(keys, **options)
+            except Exception as e:
+                logger.error(f"Error creating index {keys} on {collection.name}: {e}")
         
     # User operations
     async def add_user(self, user_id):
@@ -57,80 +102,72 @@ class Database:
         )
         
     # Settings operations
+    async def get_user_settings(self, user_id):
+        """Get all of a user's settings in one round trip, defaults filled in"""
+        cached = self.settings_cache.get(user_id)
+        if cached and cached[0] > time.monotonic():
+            self.settings_cache.move_to_end(user_id)
+            return dict(cached[1])
+        
+        data = await self.settings.find_one({"user_id": user_id}) or {}
+        settings = {key: data.get(key, default) for key, default in USER_SETTING_DEFAULTS.items()}
+        
+        self.settings_cache[user_id] = (time.monotonic() + USER_SETTINGS_TTL, settings)
+        self.settings_cache.move_to_end(user_id)
+        while len(self.settings_cache) > USER_SETTINGS_CACHE_SIZE:
+            self.settings_cache.popitem(last=False)
+        return dict(settings)
+        
+    async def _update_user_settings(self, user_id, update, upsert=True):
+        """Write a user's settings and drop their cached copy"""
+        await self.settings.update_one({"user_id": user_id}, update, upsert=upsert)
+        self.settings_cache.pop(user_id, None)
+        
     async def set_thumbnail(self, user_id, file_id):
         """Save user's thumbnail"""
-        await self.settings.update_one(
-            {"user_id": user_id},
-            {"$set": {"thumbnail": file_id}},
-            upsert=True
-        )
+        await self._update_user_settings(user_id, {"$set": {"thumbnail": file_id}})
         
     async def get_thumbnail(self, user_id):
         """Get user's thumbnail"""
-        data = await self.settings.find_one({"user_id": user_id})
-        return data.get("thumbnail") if data else None
+        return (await self.get_user_settings(user_id))["thumbnail"]
         
     async def delete_thumbnail(self, user_id):
         """Delete user's thumbnail"""
-        await self.settings.update_one(
-            {"user_id": user_id},
-            {"$unset": {"thumbnail": ""}}
-        )
+        await self._update_user_settings(user_id, {"$unset": {"thumbnail": ""}}, upsert=False)
         
     async def set_watermark(self, user_id, watermark_text):
         """Save user's watermark text"""
-        await self.settings.update_one(
-            {"user_id": user_id},
-            {"$set": {"watermark": watermark_text}},
-            upsert=True
-        )
+        await self._update_user_settings(user_id, {"$set": {"watermark": watermark_text}})
         
     async def get_watermark(self, user_id):
         """Get user's watermark"""
-        data = await self.settings.find_one({"user_id": user_id})
-        return data.get("watermark") if data else None
+        return (await self.get_user_settings(user_id))["watermark"]
         
     async def set_media_type(self, user_id, media_type):
         """Set preferred media type (video/document)"""
-        await self.settings.update_one(
-            {"user_id": user_id},
-            {"$set": {"media_type": media_type}},
-            upsert=True
-        )
+        await self._update_user_settings(user_id, {"$set": {"media_type": media_type}})
         
     async def get_media_type(self, user_id):
         """Get user's preferred media type"""
-        data = await self.settings.find_one({"user_id": user_id})
-        return data.get("media_type", "video") if data else "video"
+        return (await self.get_user_settings(user_id))["media_type"]
         
     async def toggle_spoiler(self, user_id):
         """Toggle spoiler mode"""
-        data = await self.settings.find_one({"user_id": user_id})
-        current = data.get("spoiler", False) if data else False
-        await self.settings.update_one(
-            {"user_id": user_id},
-            {"$set": {"spoiler": not current}},
-            upsert=True
-        )
+        current = await self.get_spoiler(user_id)
+        await self._update_user_settings(user_id, {"$set": {"spoiler": not current}})
         return not current
         
     async def get_spoiler(self, user_id):
         """Get spoiler setting"""
-        data = await self.settings.find_one({"user_id": user_id})
-        return data.get("spoiler", False) if data else False
+        return (await self.get_user_settings(user_id))["spoiler"]
         
     async def set_upload_mode(self, user_id, mode):
         """Set upload mode"""
-        await self.settings.update_one(
-            {"user_id": user_id},
-            {"$set": {"upload_mode": mode}},
-            upsert=True
-        )
+        await self._update_user_settings(user_id, {"$set": {"upload_mode": mode}})
         
     async def get_upload_mode(self, user_id):
         """Get upload mode"""
-        data = await self.settings.find_one({"user_id": user_id})
-        return data.get("upload_mode", "default") if data else "default"
+        return (await self.get_user_settings(user_id))["upload_mode"]
         
     # Queue operations
     async def add_to_queue(self, user_id, task_data):
@@ -144,27 +181,11 @@ class Database:
         result = await self.queue.insert_one(task)
         return str(result.inserted_id)
         
-    async def get_queue_position(self, task_id):
-        """Get position in queue"""
-        tasks = await self.queue.find({"status": "pending"}).sort("added_time", 1).to_list(length=None)
-        for i, task in enumerate(tasks, 1):
-            if str(task["_id"]) == task_id:
-                return i
-        return 0
-        
     async def get_total_queue(self):
         """Get total queue count"""
         count = await self.queue.count_documents({"status": "pending"})
         return count
         
-    async def update_queue_status(self, task_id, status):
-        """Update queue task status"""
-        from bson.objectid import ObjectId
-        await self.queue.update_one(
-            {"_id": ObjectId(task_id)},
-            {"$set": {"status": status}}
-        )
-        
     async def clear_queue(self):
         """Clear all pending queue tasks"""
         await self.queue.delete_many({"status": "pending"})
@@ -176,6 +197,81 @@ class Database:
             sort=[("added_time", 1)]
         )
         return task
+
+    async def get_queue_stats(self, window=3600):
+        """Queue depth per lane, oldest waiting job and recent throughput"""
+        now = datetime.now()
+        lanes = await self.queue.aggregate([
+            {"$match": {"status": "pending"}},
+            {"$group": {"_id": {"$ifNull": ["$premium", False]}, "count": {"$sum": 1}}}
+        ]).to_list(length=None)
+        depth = {bool(lane["_id"]): lane["count"] for lane in lanes}
+        
+        oldest = await self.queue.find_one(
+            {"status": "pending"},
+            {"added_time": 1},
+            sort=[("added_time", 1)]
+        )
+        running = await self.queue.count_documents({"status": "running"})
+        finished = await self.queue.count_documents({
+            "status": "done",
+            "finished_time": {"$gte": now - timedelta(seconds=window)}
+        })
+        
+        return {
+            "pending_premium": depth.get(True, 0),
+            "pending_free": depth.get(False, 0),
+            "running": running,
+            "oldest_age": (now - oldest["added_time"]).total_seconds() if oldest else 0,
+            "finished": finished,
+            "window": window
+        }
+        
+    # Background job operations
+    async def save_job(self, job):
+        """Insert or replace a background job record"""
+        await self.queue.replace_one({"_id": job["_id"]}, job, upsert=True)
+
+    async def finish_job(self, task_id, status, error=None):
+        """Mark a background job as done, failed or cancelled"""
+        update = {"status": status, "finished_time": datetime.now()}
+        if error:
+            update["error"] = error
+        await self.queue.update_one({"_id": task_id}, {"$set": update})
+
+    async def get_unfinished_jobs(self):
+        """Jobs that were queued or running when the bot stopped, oldest first"""
+        return await self.queue.find(
+            {"status": {"$in": ["pending", "running"]}}
+        ).sort("added_time", 1).to_list(length=None)
+
+    # Result cache operations
+    async def get_cached_result(self, job_hash):
+        """Get the uploaded output of a previous identical job"""
+        return await self.results.find_one_and_update(
+            {"_id": job_hash},
+            {"$inc": {"hits": 1}, "$set": {"last_used": datetime.now()}}
+        )
+        
+    async def save_cached_result(self, job_hash, file_id, media_type):
+        """Remember the uploaded output of a job"""
+        await self.results.update_one(
+            {"_id": job_hash},
+            {
+                "$set": {
+                    "file_id": file_id,
+                    "media_type": media_type,
+                    "created": datetime.now(),
+                    "last_used": datetime.now()
+                },
+                "$setOnInsert": {"hits": 0}
+            },
+            upsert=True
+        )
+        
+    async def delete_cached_result(self, job_hash):
+        """Forget a cached output whose file_id no longer works"""
+        await self.results.delete_one({"_id": job_hash})
         
     # Premium users operations
     async def add_premium_user(self, user_id, days):
@@ -225,15 +321,60 @@ class Database:
         return [ch["channel_id"] for ch in channels]
         
     # Admin settings
+    # Bot-wide settings are read from an in-memory snapshot; it is loaded at
+    # startup and refreshed by set_bot_setting and, on replica sets, by a
+    # change stream so edits made elsewhere show up too.
+    async def load_bot_settings(self):
+        """Load the bot settings snapshot"""
+        self.bot_settings = await self.settings.find_one({"_id": "bot_settings"}) or {}
+        
+    def watch_bot_settings(self):
+        """Start following bot settings changes in the background"""
+        if not self.bot_settings_watcher:
+            self.bot_settings_watcher = asyncio.create_task(self._watch_bot_settings())
+        
+    async def _watch_bot_settings(self):
+        delay = SETTINGS_WATCH_MIN_DELAY
+        reconnect = False
+        while True:
+            try:
+                async with self.settings.watch(
+                    [{"$match": {"documentKey._id": "bot_settings"}}],
+                    full_document="updateLookup"
+                ) as stream:
+                    if reconnect:
+                        # Changes made while the stream was down were missed
+                        await self.load_bot_settings()
+                    delay = SETTINGS_WATCH_MIN_DELAY
+                    async for change in stream:
+                        self.bot_settings = change.get("fullDocument") or {}
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    # Standalone servers have no change streams; setters keep
+                    # the snapshot current on their own
+                    logger.info(f"Bot settings change stream unavailable: {e}")
+                    return
+                logger.warning(f"Bot settings change stream failed, retrying in {delay}s: {e}")
+            except Exception as e:
+                logger.warning(f"Bot settings change stream failed, retrying in {delay}s: {e}")
+            reconnect = True
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, SETTINGS_WATCH_MAX_DELAY)
+        
     async def set_bot_setting(self, key, value):
         """Set bot setting"""
-        await self.settings.update_one(
+        data = await self.settings.find_one_and_update(
             {"_id": "bot_settings"},
             {"$set": {key: value}},
-            upsert=True
+            upsert=True,
+            return_document=ReturnDocument.AFTER
         )
+        self.bot_settings = data or {}
         
     async def get_bot_setting(self, key, default=None):
         """Get bot setting"""
-        data = await self.settings.find_one({"_id": "bot_settings"})
-        return data.get(key, default) if data else default
+        if self.bot_settings is None:
+            await self.load_bot_settings()
+        return self.bot_settings.get(key, default)
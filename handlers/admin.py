@@ -3,7 +3,14 @@ from pyrogram.types import Message
 import subprocess
 import os
 import sys
+import re
 import logging
+from utils.helpers import human_readable_size, format_time
+from utils.rate_control import RateProfile, DEFAULT_RATE_PROFILE, rate_profiles
+from utils.source_cache import source_cache
+from utils.scheduler import scheduler
+from utils.status import status_updater
+from utils.ffmpeg_progress import encode_metrics
 
 logger = logging.getLogger(__name__)
 
@@ -17,17 +24,39 @@ async def restart_bot(client: Client, message: Message):
 
 async def check_queue(client: Client, message: Message):
     """Check queue status"""
-    total = await client.db.get_total_queue()
+    jobs = scheduler.stats()
+    cache = source_cache.stats()
+    queue = await client.db.get_queue_stats()
+    edits = status_updater.stats()
+    encodes = encode_metrics.stats()
     await message.reply_text(
         f"📊 **Queue Status**\n\n"
-        f"**Total tasks:** {total}\n"
-        f"**Status:** {'Active' if total > 0 else 'Empty'}"
+        f"**Running:** {jobs['running']}/{jobs['max_concurrent']}\n"
+        f"**Waiting:** {jobs['waiting']} (💎 {jobs['waiting_premium']} premium, {jobs['waiting_free']} free)\n"
+        f"**Status:** {'Active' if jobs['running'] or jobs['waiting'] else 'Empty'}\n\n"
+        f"🗂 **Job Queue**\n"
+        f"**Queued:** 💎 {queue['pending_premium']} premium, {queue['pending_free']} free\n"
+        f"**Oldest Waiting:** {format_time(queue['oldest_age']) if queue['oldest_age'] else '-'}\n"
+        f"**Finished (last hour):** {queue['finished']}\n\n"
+        f"💾 **Source Cache**\n"
+        f"**Files:** {cache['files']} ({cache['in_use']} in use)\n"
+        f"**Size:** {human_readable_size(cache['bytes'])} / {human_readable_size(cache['max_bytes'])}\n"
+        f"**Hits/Misses:** {cache['hits']}/{cache['misses']} ({cache['hit_rate']:.1f}%)\n"
+        f"**Evictions:** {cache['evictions']}\n\n"
+        f"✏️ **Status Edits**\n"
+        f"**Sent:** {edits['sent']} ({edits['skipped']} coalesced, {edits['pending']} pending)\n"
+        f"**FloodWaits:** {edits['flood_waits']}\n\n"
+        f"🎞 **Encoding**\n"
+        f"**FFmpeg Runs:** {encodes['runs']} ({format_time(encodes['encoded_seconds'])} of video)\n"
+        f"**Average Speed:** {encodes['average_speed']:.2f}x\n"
+        f"**Dup/Drop Frames:** {encodes['dup_frames']}/{encodes['drop_frames']}"
     )
 
 async def clear_queue(client: Client, message: Message):
     """Clear all queue tasks"""
     await client.db.clear_queue()
-    await message.reply_text("✅ **Queue cleared successfully!**")
+    dropped = scheduler.clear_waiting()
+    await message.reply_text(f"✅ **Queue cleared successfully!**\n\n**Waiting tasks dropped:** {dropped}")
 
 async def set_audio_bitrate(client: Client, message: Message):
     """Set audio bitrate"""
@@ -127,6 +156,64 @@ async def set_crf(client: Client, message: Message):
     except:
         await message.reply_text("❌ Invalid CRF value!")
 
+async def set_rate_profile(client: Client, message: Message):
+    """Select or edit the rate control profile"""
+    custom = dict(await client.db.get_bot_setting("rate_profiles", {}))
+    profiles = rate_profiles(custom)
+    current = await client.db.get_bot_setting("rate_profile", DEFAULT_RATE_PROFILE)
+    args = message.command[1:]
+    
+    if not args:
+        ladder = profiles.get(current) or profiles[DEFAULT_RATE_PROFILE]
+        renditions = "\n".join(f"• {height}p: {profile.describe()}" for height, profile in sorted(ladder.items()))
+        await message.reply_text(
+            f"📶 **Current Rate Profile:** {current}\n\n"
+            f"{renditions}\n\n"
+            f"**Available profiles:** {', '.join(sorted(profiles))}\n\n"
+            f"**Usage:**\n"
+            f"`/ratecontrol <name>` - Select a profile\n"
+            f"`/ratecontrol <name> <height> <crf|auto> <maxrate> <bufsize> <gop>` - Set one rendition\n"
+            f"`/ratecontrol <name> reset` - Drop your changes to a profile\n\n"
+            f"**Example:** `/ratecontrol mobile 720 24 2M 4M 2`\n"
+            f"`auto` uses the /crf setting, gop is in seconds"
+        )
+        return
+    
+    name = args[0].lower()
+    if not re.match(r"^[a-z0-9_-]+$", name):
+        await message.reply_text("❌ Profile names may only use letters, digits, - and _")
+        return
+    
+    if len(args) == 1:
+        if name not in profiles:
+            await message.reply_text(f"❌ Unknown profile! Use: {', '.join(sorted(profiles))}")
+            return
+        await client.db.set_bot_setting("rate_profile", name)
+        await message.reply_text(f"✅ **Rate profile set to:** {name}")
+    elif len(args) == 2 and args[1].lower() == "reset":
+        custom.pop(name, None)
+        await client.db.set_bot_setting("rate_profiles", custom)
+        if name == current and name not in rate_profiles(custom):
+            await client.db.set_bot_setting("rate_profile", DEFAULT_RATE_PROFILE)
+        await message.reply_text(f"✅ **Profile {name} reset**")
+    elif len(args) == 6:
+        try:
+            height = int(args[1].lower().rstrip("p"))
+            crf = None if args[2].lower() == "auto" else int(args[2])
+            profile = RateProfile(crf, args[3], args[4], float(args[5]))
+            profile.validate()
+        except ValueError as e:
+            await message.reply_text(f"❌ **Invalid rate profile:** {e}")
+            return
+        
+        renditions = dict(custom.get(name, {}))
+        renditions[str(height)] = profile.to_doc()
+        custom[name] = renditions
+        await client.db.set_bot_setting("rate_profiles", custom)
+        await message.reply_text(f"✅ **{name} {height}p set to:** {profile.describe()}")
+    else:
+        await message.reply_text("❌ Invalid arguments! Send /ratecontrol for usage.")
+
 async def add_fsub_channel(client: Client, message: Message):
     """Add force subscribe channel"""
     if len(message.command) < 2:
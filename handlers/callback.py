@@ -1,6 +1,8 @@
 from pyrogram import Client
 from pyrogram.types import CallbackQuery
 from config import Config
+from utils.jobs import job_runner
+from utils.pipeline import edit_pipelines, pipeline_text, CropStep, CROP_RATIOS
 import logging
 
 logger = logging.getLogger(__name__)
@@ -73,11 +75,26 @@ Send a video to start processing!
         elif data.startswith("encode_"):
             quality = data.replace("encode_", "")
             await callback_query.answer(f"🎬 Encoding to {quality}...")
-            # Import here to avoid circular imports
-            from handlers import encode
             # Create a fake message object for encoding
             callback_query.message.command = [quality]
-            await encode.encode_video(client, callback_query.message)
+            job_runner.submit(
+                client,
+                callback_query.message,
+                "encode",
+                f"Encode {quality}",
+                user=callback_query.from_user
+            )
+        
+        # Crop ratio picked for a video (crop_<video message id>_<ratio>)
+        elif data.startswith("crop_"):
+            _, video_id, ratio = data.split("_", 2)
+            video = await client.get_messages(callback_query.message.chat.id, int(video_id))
+            if not video or video.empty or not (video.video or video.document) or ratio not in CROP_RATIOS:
+                await callback_query.answer("❌ Video not found, reply to it with /crop <ratio>", show_alert=True)
+                return
+            pipeline = edit_pipelines.add(callback_query.from_user.id, video, CropStep(ratio))
+            await callback_query.message.edit_text(pipeline_text(pipeline))
+            await callback_query.answer(f"📐 Crop {ratio} added")
         
         # Compress callback
         elif data == "compress":
@@ -1,32 +1,167 @@
 from pyrogram import Client
 from pyrogram.types import Message, User
+from pyrogram.errors import BadRequest
 import os
 import time
+from config import Config
 from utils.ffmpeg import FFmpegEncoder
-from utils.progress import sync_progress_callback
-from utils.helpers import human_readable_size, format_time
+from utils.ffmpeg_command import FFmpegCommand, CommandError
+from utils.fast_encoder import FastEncoder
+from utils.planner import plan_encode, size_budget, retarget_bitrate, MIN_VIDEO_BITRATE
+from utils.rate_control import RateProfile, DEFAULT_RATE_PROFILE, load_rate_ladder, rendition_profile
+from utils.adaptive_crf import choose_crf
+from utils.pipeline import edit_pipelines, ScaleStep, WatermarkStep
+from utils.ffmpeg_progress import ProgressSnapshot
+from utils.progress import transfer_progress
+from utils.transfer import prepared_uploads, upload_while_writing
+from utils.source_cache import source_cache
+from utils.helpers import human_readable_size, format_time, format_progress_bar, get_output_path, get_job_hash, parse_size
+from utils.scheduler import scheduler, acquire_slot
+from utils.jobs import job_runner, set_stage, resumed_artifact
+from utils.status import status_updater
 import logging
 
 logger = logging.getLogger(__name__)
 
 # Resolution configurations
+# Rate control per height comes from the selected profile, see utils.rate_control
 RESOLUTIONS = {
-    "144p": {"height": 144, "bitrate": "128k"},
-    "240p": {"height": 240, "bitrate": "256k"},
-    "360p": {"height": 360, "bitrate": "512k"},
-    "480p": {"height": 480, "bitrate": "1M"},
-    "720p": {"height": 720, "bitrate": "2M"},
-    "1080p": {"height": 1080, "bitrate": "4M"},
-    "2160p": {"height": 2160, "bitrate": "8M"}
+    "144p": {"height": 144},
+    "240p": {"height": 240},
+    "360p": {"height": 360},
+    "480p": {"height": 480},
+    "720p": {"height": 720},
+    "1080p": {"height": 1080},
+    "2160p": {"height": 2160}
 }
 
+# Qualities produced by /all
+ALL_QUALITIES = ["144p", "240p", "360p", "480p", "720p", "1080p"]
+
+# /compress accepts outputs up to this far below the target size
+COMPRESS_TOLERANCE = 0.05
+
+# Re-encodes allowed when a /compress result misses the target
+COMPRESS_RETRIES = 1
+
+async def upload_output(client: Client, message: Message, user_id: int, output_path: str, caption: str, status: Message):
+    """Upload an encoded file using the user's media preferences"""
+    user_settings = await client.db.get_user_settings(user_id)
+    thumbnail = user_settings["thumbnail"]
+    media_type = user_settings["media_type"]
+    spoiler = user_settings["spoiler"]
+    
+    if media_type == "document":
+        return await message.reply_document(
+            document=output_path,
+            caption=caption,
+            thumb=thumbnail,
+            progress=transfer_progress(status, "Uploading")
+        )
+    else:
+        return await message.reply_video(
+            video=output_path,
+            caption=caption,
+            thumb=thumbnail,
+            has_spoiler=spoiler,
+            supports_streaming=True,
+            progress=transfer_progress(status, "Uploading")
+        )
+
+def build_encode_command(quality: str, settings: dict, rate: RateProfile = None, pipeline=None) -> FFmpegCommand:
+    """
+    The ffmpeg command a job will run, with placeholder paths
+    
+    Validated before the download so impossible settings fail at once,
+    and hashed into the job's cache key.
+    """
+    resolution = RESOLUTIONS.get(quality)
+    options = {
+        "codec": settings["codec"],
+        "preset": settings["preset"],
+        "crf": settings["crf"],
+        "audio_bitrate": settings["audio_bitrate"],
+        "rate": rate
+    }
+    if pipeline:
+        command = pipeline.compile("source", "output.mp4", **options)
+    else:
+        command = FFmpegEncoder.encode_command(
+            "source",
+            "output.mp4",
+            height=resolution["height"],
+            watermark_text=settings["watermark"],
+            **options
+        )
+    return command.validate()
+
+def encode_job_hash(replied: Message, quality: str, settings: dict, edits: list = None, command: FFmpegCommand = None) -> str:
+    """Cache key for encoding a source to a quality with the given settings"""
+    media = replied.video or replied.document
+    params = {"op": "encode", "quality": quality}
+    params.update(settings)
+    if edits:
+        params["edits"] = edits
+    if command:
+        params["command"] = command.canonical()
+    return get_job_hash(media.file_unique_id, params)
+
+async def send_cached_output(client: Client, message: Message, user_id: int, job_hash: str, caption: str) -> bool:
+    """Resend a previously uploaded identical result, returns False on a miss"""
+    cached = await client.db.get_cached_result(job_hash)
+    if not cached:
+        return False
+    
+    try:
+        if cached["media_type"] == "document":
+            await message.reply_document(document=cached["file_id"], caption=caption)
+        else:
+            user_settings = await client.db.get_user_settings(user_id)
+            await message.reply_video(
+                video=cached["file_id"],
+                caption=caption,
+                has_spoiler=user_settings["spoiler"],
+                supports_streaming=True
+            )
+        return True
+    except BadRequest as e:
+        # The file_id is dead (expired reference, deleted media, ...)
+        logger.warning(f"Dropping cached result {job_hash}: {e}")
+        await client.db.delete_cached_result(job_hash)
+    except Exception as e:
+        logger.error(f"Error sending cached result {job_hash}: {e}")
+    return False
+
+async def save_output(client: Client, job_hash: str, sent: Message):
+    """Remember an uploaded result so identical jobs can reuse its file_id"""
+    if not sent:
+        return
+    media = sent.video or sent.document
+    if media:
+        await client.db.save_cached_result(job_hash, media.file_id, "document" if sent.document else "video")
+
+async def get_encode_settings(client: Client, user_id: int) -> dict:
+    """Settings that determine the encoded output"""
+    user_settings = await client.db.get_user_settings(user_id)
+    return {
+        "codec": await client.db.get_bot_setting("codec", "libx264"),
+        "preset": await client.db.get_bot_setting("preset", "medium"),
+        "crf": await client.db.get_bot_setting("crf", 23),
+        "audio_bitrate": await client.db.get_bot_setting("audio_bitrate", "128k"),
+        "rate_profile": await client.db.get_bot_setting("rate_profile", DEFAULT_RATE_PROFILE),
+        "adaptive_crf": Config.ADAPTIVE_CRF_MIN_SSIM if Config.ADAPTIVE_CRF else None,
+        "watermark": user_settings["watermark"],
+        "media_type": user_settings["media_type"],
+        "thumbnail": user_settings["thumbnail"]
+    }
+
 async def encode_video(client: Client, message: Message, from_user: User = None):
-    """Encode video to specific quality"""
+    """Encode video to specific quality, or render queued edits with /process"""
     user = from_user or message.from_user
     user_id = user.id
     command = message.command[0].replace("/", "")
     
-    if command not in RESOLUTIONS:
+    if command not in RESOLUTIONS and command != "process":
         await message.reply_text("❌ Invalid quality!")
         return
     
@@ -44,6 +179,15 @@ async def encode_video(client: Client, message: Message, from_user: User = None)
         await message.reply_text("❌ Please reply to a video file!")
         return
     
+    # Edits queued with /cut, /crop, /hsub are rendered in the same encode
+    pipeline = edit_pipelines.get(user_id, replied)
+    if command == "process" and not pipeline:
+        await message.reply_text(
+            "⚠️ **No edits queued for this video!**\n\n"
+            "Queue edits with /cut, /crop or /hsub first."
+        )
+        return
+    
     # Check file size
     is_premium = await client.db.is_premium_user(user_id)
     max_size = 4294967296 if is_premium else 2147483648  # 4GB for premium, 2GB for free
@@ -59,99 +203,261 @@ async def encode_video(client: Client, message: Message, from_user: User = None)
         )
         return
     
+    # Get encoding and user settings
+    settings = await get_encode_settings(client, user_id)
+    resolution = RESOLUTIONS.get(command)
+    quality = command if resolution else "Original"
+    codec = settings["codec"]
+    preset = settings["preset"]
+    crf = settings["crf"]
+    audio_bitrate = settings["audio_bitrate"]
+    watermark = settings["watermark"]
+    
+    # Source-size renders (/process) have no rendition to cap, plain CRF
+    rate = None
+    if resolution:
+        ladder = await load_rate_ladder(client.db, settings["rate_profile"])
+        rate = rendition_profile(ladder, resolution["height"])
+    
+    if pipeline:
+        pipeline = pipeline.with_steps(
+            ScaleStep(resolution["height"]) if resolution else None,
+            WatermarkStep(watermark) if watermark else None
+        )
+    
+    # Catch impossible settings before anything is downloaded
+    try:
+        ffmpeg_command = build_encode_command(command, settings, rate, pipeline)
+    except CommandError as e:
+        await message.reply_text(f"❌ **Invalid encode settings:** {e}")
+        return
+    
+    # Identical job already done: resend the earlier upload
+    job_hash = encode_job_hash(replied, command, settings, pipeline.key() if pipeline else None, ffmpeg_command)
+    cached_caption = (
+        f"📹 **Video Encoded**\n\n"
+        f"**Quality:** {quality}\n"
+        f"**Time:** Instant (cached)\n"
+        f"**Codec:** {codec.upper()}\n"
+        f"**Preset:** {preset}"
+    )
+    if pipeline:
+        cached_caption += f"\n\n**Edits:**\n{pipeline.describe()}"
+    if await send_cached_output(client, message, user_id, job_hash, cached_caption):
+        if pipeline:
+            edit_pipelines.clear(user_id)
+        return
+    
     # Send processing message
     status = await message.reply_text("📥 **Downloading video...**")
+    source = None
+    output_path = None
+    ticket = None
     
     try:
-        # Download video
+        # Wait for a free slot before downloading
+        ticket = await acquire_slot(client, user_id, status, premium=is_premium)
+        
+        # Download video, faststart sources are encoded while they arrive
         start_time = time.time()
-        download_path = await replied.download(
-            file_name=f"./downloads/{user_id}/",
-            progress=sync_progress_callback,
-            progress_args=(status, start_time, "Downloading")
+        source = source_cache.start(
+            replied,
+            progress=transfer_progress(status, "Downloading")
         )
+        output_path = get_output_path(user_id, source.path, f"_{command}.mp4")
         
-        # Get encoding settings
-        resolution = RESOLUTIONS[command]
-        codec = await client.db.get_bot_setting("codec", "libx264")
-        preset = await client.db.get_bot_setting("preset", "medium")
-        crf = await client.db.get_bot_setting("crf", 23)
-        audio_bitrate = await client.db.get_bot_setting("audio_bitrate", "128k")
+        media = replied.video or replied.document
+        duration = replied.video.duration if replied.video and replied.video.duration else 0
+        plan = None
+        crf_choice = None
         
-        # Get user settings
-        watermark = await client.db.get_watermark(user_id)
+        encoding_title = f"Encoding to {command}"
+        encoding_start = time.time()
         
-        # Encode video
-        await status.edit_text(f"🔄 **Encoding to {command}...**\n\nThis may take a while...")
+        if pipeline:
+            await pipeline.prepare(os.path.dirname(output_path))
         
-        output_path = download_path.rsplit(".", 1)[0] + f"_{command}.mp4"
+        async def encoding_progress(snapshot: ProgressSnapshot):
+            status_updater.update(
+                status,
+                f"🔄 **{encoding_title}...**\n\n"
+                f"{format_progress_bar(snapshot.percentage)}\n\n"
+                f"**Speed:** {snapshot.speed:.2f}x\n"
+                f"**Elapsed:** {format_time(time.time() - encoding_start)}\n"
+                f"**ETA:** {format_time(snapshot.eta)}"
+            )
         
-        encoder = FFmpegEncoder()
-        success = await encoder.encode_video(
-            input_file=download_path,
-            output_file=output_path,
-            height=resolution["height"],
-            video_bitrate=resolution["bitrate"],
-            audio_bitrate=audio_bitrate,
-            codec=codec,
-            preset=preset,
-            crf=crf,
-            watermark_text=watermark
-        )
+        async def render(input_file, input_stream):
+            nonlocal encoding_title, encoding_start
+            # One decode and one encode for every queued edit
+            await set_stage("encoding", source=source.path)
+            encoding_title = f"Rendering {len(pipeline.steps)} edits in one pass"
+            encoding_start = time.time()
+            await status_updater.edit(
+                status,
+                f"🔄 **{encoding_title}...**\n\n{pipeline.describe()}"
+            )
+            
+            async def run():
+                return await pipeline.render(
+                    input_file,
+                    output_path,
+                    input_stream=input_stream,
+                    progress_callback=encoding_progress,
+                    duration=duration,
+                    codec=codec,
+                    preset=preset,
+                    crf=crf,
+                    audio_bitrate=audio_bitrate,
+                    rate=rate,
+                    fragmented=Config.STREAM_UPLOAD
+                )
+            
+            if Config.STREAM_UPLOAD:
+                return await upload_while_writing(client, output_path, run)
+            return await run()
+        
+        async def encode(input_file, input_stream):
+            nonlocal plan, crf_choice, duration, encoding_title, encoding_start
+            if pipeline:
+                return await render(input_file, input_stream)
+            await set_stage("encoding", source=source.path)
+            encoder = FFmpegEncoder()
+            
+            # Probe once and skip the encode when it would change nothing
+            info = await encoder.get_video_info(input_file, input_stream=input_stream)
+            plan = plan_encode(
+                info,
+                resolution["height"],
+                rate.maxrate,
+                codec,
+                watermark,
+                file_size=media.file_size,
+                duration=duration
+            )
+            segmented = Config.SEGMENTED_ENCODING and not plan.remux and not input_stream
+            # Documents carry no duration, the probe above has it
+            duration = duration or float((info or {}).get("format", {}).get("duration", 0) or 0)
+            
+            # Pick the CRF this content needs from a few sample encodes
+            video_crf, video_rate = crf, rate
+            if Config.ADAPTIVE_CRF and not plan.remux and not input_stream:
+                await status_updater.edit(status, "🔬 **Analysing content to pick the CRF...**")
+                base_crf = rate.crf if rate.crf is not None else crf
+                crf_choice = await choose_crf(
+                    input_file,
+                    output_path + ".samples",
+                    duration or await encoder.get_duration(input_file),
+                    resolution["height"],
+                    codec,
+                    preset,
+                    base_crf,
+                    rate
+                )
+                if crf_choice:
+                    video_crf, video_rate = crf_choice.crf, rate.with_crf(crf_choice.crf)
+            
+            if plan.remux:
+                encoding_title = f"Remuxing to {command}"
+                await status_updater.edit(status, f"⚡ **{encoding_title}...**\n\n{plan.reason.capitalize()}.")
+            else:
+                await status_updater.edit(status, f"🔄 **{encoding_title}...**\n\nThis may take a while...")
+            encoding_start = time.time()
+            
+            async def run():
+                if plan.remux:
+                    return await encoder.remux_video(
+                        input_file=input_file,
+                        output_file=output_path,
+                        copy_audio=plan.copy_audio,
+                        audio_bitrate=audio_bitrate,
+                        input_stream=input_stream,
+                        fragmented=Config.STREAM_UPLOAD,
+                        progress_callback=encoding_progress,
+                        duration=duration
+                    )
+                if segmented:
+                    # Long inputs are split at keyframes and encoded on all cores
+                    return await FastEncoder.encode_video_segmented(
+                        input_file=input_file,
+                        output_file=output_path,
+                        height=resolution["height"],
+                        rate=video_rate,
+                        audio_bitrate=audio_bitrate,
+                        codec=codec,
+                        preset=preset,
+                        crf=video_crf,
+                        watermark_text=watermark,
+                        progress_callback=lambda snapshot, *_: encoding_progress(snapshot),
+                        status_msg=status,
+                        duration=duration
+                    )
+                return await encoder.encode_video(
+                    input_file=input_file,
+                    output_file=output_path,
+                    height=resolution["height"],
+                    rate=video_rate,
+                    audio_bitrate=audio_bitrate,
+                    codec=codec,
+                    preset=preset,
+                    crf=video_crf,
+                    watermark_text=watermark,
+                    input_stream=input_stream,
+                    fragmented=Config.STREAM_UPLOAD,
+                    progress_callback=encoding_progress,
+                    duration=duration
+                )
+            
+            if Config.STREAM_UPLOAD and not segmented:
+                # Parts go up while ffmpeg writes, the upload below only sends the message
+                return await upload_while_writing(client, output_path, run)
+            return await run()
+        
+        if resumed_artifact("uploading", "output") == output_path:
+            # Encoded before a restart, only the upload is left
+            success = True
+        elif (Config.SEGMENTED_ENCODING or Config.ADAPTIVE_CRF) and not pipeline:
+            # Segments and CRF samples are cut by seeking, which needs the complete file
+            success = await encode(await source.wait(), None)
+        else:
+            success = await source.consume(encode)
         
         if not success:
-            await status.edit_text("❌ Encoding failed!")
+            await status_updater.edit(status, "❌ Encoding failed!")
             return
         
         # Get output file info
         output_size = os.path.getsize(output_path)
         encoding_time = time.time() - start_time
         
-        # Get thumbnail
-        thumbnail = await client.db.get_thumbnail(user_id)
-        
-        # Get media type preference
-        media_type = await client.db.get_media_type(user_id)
-        spoiler = await client.db.get_spoiler(user_id)
-        
         # Upload video
-        await status.edit_text(f"📤 **Uploading {command} video...**")
+        await status_updater.edit(status, f"📤 **Uploading {quality} video...**")
+        await set_stage("uploading", output=output_path)
         
         caption = (
             f"📹 **Video Encoded**\n\n"
-            f"**Quality:** {command}\n"
+            f"**Quality:** {quality}\n"
             f"**Size:** {human_readable_size(output_size)}\n"
             f"**Time:** {format_time(encoding_time)}\n"
             f"**Codec:** {codec.upper()}\n"
             f"**Preset:** {preset}"
         )
+        if plan:
+            caption += f"\n**Mode:** {plan.summary}"
+        if crf_choice:
+            caption += f"\n**CRF:** {crf_choice.summary}"
+        if pipeline:
+            caption += f"\n\n**Edits:**\n{pipeline.describe()}"
         
-        start_time = time.time()
-        
-        if media_type == "document":
-            await message.reply_document(
-                document=output_path,
-                caption=caption,
-                thumb=thumbnail,
-                progress=sync_progress_callback,
-                progress_args=(status, start_time, "Uploading")
-            )
-        else:
-            await message.reply_video(
-                video=output_path,
-                caption=caption,
-                thumb=thumbnail,
-                has_spoiler=spoiler,
-                supports_streaming=True,
-                progress=sync_progress_callback,
-                progress_args=(status, start_time, "Uploading")
-            )
+        sent = await upload_output(client, message, user_id, output_path, caption, status)
+        await save_output(client, job_hash, sent)
+        if pipeline:
+            edit_pipelines.clear(user_id)
         
         await status.delete()
         
         # Cleanup
         try:
-            os.remove(download_path)
             os.remove(output_path)
         except:
             pass
@@ -161,19 +467,27 @@ async def encode_video(client: Client, message: Message, from_user: User = None)
         
     except Exception as e:
         logger.error(f"Encoding error: {e}")
-        await status.edit_text(f"❌ **Error:** {str(e)}")
+        await status_updater.edit(status, f"❌ **Error:** {str(e)}")
+    finally:
+        if ticket:
+            scheduler.release(ticket)
+        if source:
+            await source.close()
+        if output_path:
+            prepared_uploads.pop(output_path, None)
+        if pipeline:
+            pipeline.cleanup()
 
 async def encode_all_qualities(client: Client, message: Message):
     """Encode video in all qualities"""
-    await message.reply_text(
-        "🎬 **Encode All Qualities**\n\n"
-        "This will encode your video in all available qualities:\n"
-        "144p, 240p, 360p, 480p, 720p, 1080p\n\n"
-        "⚠️ This process takes a long time!\n\n"
-        "Reply to a video to start."
-    )
-    
     if not message.reply_to_message:
+        await message.reply_text(
+            "🎬 **Encode All Qualities**\n\n"
+            "This will encode your video in all available qualities:\n"
+            f"{', '.join(ALL_QUALITIES)}\n\n"
+            "⚠️ This process takes a long time!\n\n"
+            "Reply to a video to start."
+        )
         return
     
     replied = message.reply_to_message
@@ -193,68 +507,445 @@ async def encode_all_qualities(client: Client, message: Message):
         )
         return
     
-    status = await message.reply_text("📥 **Starting batch encoding...**")
+    # Get encoding and user settings
+    settings = await get_encode_settings(client, user_id)
+    codec = settings["codec"]
+    preset = settings["preset"]
+    crf = settings["crf"]
+    audio_bitrate = settings["audio_bitrate"]
+    watermark = settings["watermark"]
+    
+    ladder = await load_rate_ladder(client.db, settings["rate_profile"])
     
-    qualities = ["144p", "240p", "360p", "480p", "720p", "1080p"]
-    completed = 0
+    # Skip renditions taller than the source, upscaling only wastes time
+    source_height = replied.video.height if replied.video and replied.video.height else 0
+    qualities = [
+        q for q in ALL_QUALITIES
+        if not source_height or RESOLUTIONS[q]["height"] <= source_height
+    ] or ALL_QUALITIES[:1]
     
+    # Resend renditions that were already encoded with these settings
+    cached = 0
+    pending = []
     for quality in qualities:
         try:
-            await status.edit_text(f"🔄 **Encoding {quality}... ({completed + 1}/{len(qualities)})**")
+            ffmpeg_command = build_encode_command(
+                quality, settings, rendition_profile(ladder, RESOLUTIONS[quality]["height"])
+            )
+        except CommandError as e:
+            await message.reply_text(f"❌ **Invalid encode settings:** {e}")
+            return
+        job_hash = encode_job_hash(replied, quality, settings, command=ffmpeg_command)
+        cached_caption = (
+            f"📹 **Video Encoded**\n\n"
+            f"**Quality:** {quality}\n"
+            f"**Time:** Instant (cached)\n"
+            f"**Codec:** {codec.upper()}\n"
+            f"**Preset:** {preset}"
+        )
+        if await send_cached_output(client, message, user_id, job_hash, cached_caption):
+            cached += 1
+        else:
+            pending.append((quality, job_hash))
+    
+    if not pending:
+        await message.reply_text(f"✅ **Batch encoding completed!**\n\nAll {cached} qualities were already encoded.")
+        return
+    
+    status = await message.reply_text("📥 **Downloading video...**")
+    source = None
+    outputs = []
+    ticket = None
+    
+    try:
+        # Wait for a free slot before downloading
+        ticket = await acquire_slot(client, user_id, status, premium=is_premium)
+        
+        # Download once for every rendition
+        source = source_cache.start(
+            replied,
+            progress=transfer_progress(status, "Downloading")
+        )
+        
+        encoder = FFmpegEncoder()
+        duration = replied.video.duration if replied.video and replied.video.duration else 0
+        
+        # Documents carry no dimensions, probe the file instead
+        if not source_height or not duration:
+            download_path = await source.wait()
+        if not source_height:
+            _, source_height = await encoder.get_resolution(download_path)
+            pending = [
+                (q, h) for q, h in pending
+                if not source_height or RESOLUTIONS[q]["height"] <= source_height
+            ] or pending[:1]
+        if not duration:
+            duration = await encoder.get_duration(download_path)
+        qualities = [q for q, _ in pending]
+        
+        renditions = [
+            {
+                "quality": q,
+                "job_hash": h,
+                "height": RESOLUTIONS[q]["height"],
+                "rate": rendition_profile(ladder, RESOLUTIONS[q]["height"]),
+                "output_file": get_output_path(user_id, source.path, f"_{q}.mp4")
+            }
+            for q, h in pending
+        ]
+        outputs = [r["output_file"] for r in renditions]
+        
+        encoding_start = time.time()
+        
+        async def encoding_progress(snapshot: ProgressSnapshot):
+            status_updater.update(
+                status,
+                f"🔄 **Encoding {len(renditions)} qualities in one pass...**\n\n"
+                f"{format_progress_bar(snapshot.percentage)}\n\n"
+                f"**Qualities:** {', '.join(qualities)}\n"
+                f"**Speed:** {snapshot.speed:.2f}x\n"
+                f"**Elapsed:** {format_time(time.time() - encoding_start)}\n"
+                f"**ETA:** {format_time(snapshot.eta)}"
+            )
+        
+        async def encode(input_file, input_stream):
+            await status_updater.edit(
+                status,
+                f"🔄 **Encoding {len(renditions)} qualities in one pass...**\n\n"
+                f"**Qualities:** {', '.join(qualities)}"
+            )
+            await set_stage("encoding", source=source.path)
+            nonlocal finished, crf_choice
+            
+            # One analysis at the top rendition, every rendition moves by the same CRF delta
+            if Config.ADAPTIVE_CRF and not input_stream:
+                await status_updater.edit(status, "🔬 **Analysing content to pick the CRF...**")
+                top = max(renditions, key=lambda r: r["height"])
+                base_crf = top["rate"].crf if top["rate"].crf is not None else crf
+                crf_choice = await choose_crf(
+                    input_file,
+                    top["output_file"] + ".samples",
+                    duration,
+                    top["height"],
+                    codec,
+                    preset,
+                    base_crf,
+                    top["rate"]
+                )
+                if crf_choice:
+                    delta = crf_choice.crf - base_crf
+                    for rendition in renditions:
+                        rendition_crf = rendition["rate"].crf if rendition["rate"].crf is not None else crf
+                        rendition["rate"] = rendition["rate"].with_crf(min(max(rendition_crf + delta, 0), 51))
+                    await status_updater.edit(
+                        status,
+                        f"🔄 **Encoding {len(renditions)} qualities in one pass...**\n\n"
+                        f"**Qualities:** {', '.join(qualities)}"
+                    )
+            
+            finished = await encoder.encode_ladder(
+                input_file=input_file,
+                renditions=renditions,
+                audio_bitrate=audio_bitrate,
+                codec=codec,
+                preset=preset,
+                crf=crf,
+                watermark_text=watermark,
+                progress_callback=encoding_progress,
+                duration=duration,
+                input_stream=input_stream
+            )
+            return bool(finished)
+        
+        crf_choice = None
+        # Encoded before a restart, only the uploads are left. Renditions
+        # uploaded then were resent from the cache above, and one that
+        # failed then was never recorded, so neither blocks the rest.
+        reused = resumed_artifact("uploading", "outputs") or []
+        finished = [output_path for output_path in outputs if output_path in reused]
+        if not finished and Config.ADAPTIVE_CRF:
+            # CRF samples are cut by seeking, which needs the complete file
+            await encode(await source.wait(), None)
+        elif not finished:
+            # Sources with Telegram metadata are encoded while they download
+            await source.consume(encode)
+        
+        if not finished:
+            await status_updater.edit(status, "❌ Encoding failed!")
+            return
+        
+        encoding_time = time.time() - encoding_start
+        await set_stage("uploading", outputs=finished)
+        
+        # Upload each rendition as soon as the encode is done
+        completed = 0
+        for rendition in renditions:
+            output_path = rendition["output_file"]
+            if output_path not in finished:
+                continue
             
-            # Create temporary message for encoding
-            temp_msg = await message.reply_to_message.reply_text(f"/{quality}")
-            temp_msg.command = [quality]
-            temp_msg.reply_to_message = message.reply_to_message
+            await status_updater.edit(
+                status,
+                f"📤 **Uploading {rendition['quality']}... ({completed + 1}/{len(finished)})**"
+            )
             
-            await encode_video(client, temp_msg, from_user=message.from_user)
-            await temp_msg.delete()
+            caption = (
+                f"📹 **Video Encoded**\n\n"
+                f"**Quality:** {rendition['quality']}\n"
+                f"**Size:** {human_readable_size(os.path.getsize(output_path))}\n"
+                f"**Time:** {format_time(encoding_time)}\n"
+                f"**Codec:** {codec.upper()}\n"
+                f"**Preset:** {preset}"
+            )
+            if crf_choice:
+                caption += f"\n**CRF:** {rendition['rate'].crf} adaptive (SSIM floor {Config.ADAPTIVE_CRF_MIN_SSIM})"
             
-            completed += 1
+            try:
+                sent = await upload_output(client, message, user_id, output_path, caption, status)
+                await save_output(client, rendition["job_hash"], sent)
+                completed += 1
+            except Exception as e:
+                logger.error(f"Error uploading {rendition['quality']}: {e}")
             
-        except Exception as e:
-            logger.error(f"Error encoding {quality}: {e}")
-            continue
-    
-    await status.edit_text(f"✅ **Batch encoding completed!**\n\nEncoded {completed}/{len(qualities)} qualities.")
+            try:
+                os.remove(output_path)
+            except:
+                pass
+        
+        await status_updater.edit(
+            status,
+            f"✅ **Batch encoding completed!**\n\n"
+            f"Encoded {completed}/{len(renditions)} qualities."
+            + (f"\n{cached} more were already encoded." if cached else "")
+        )
+        
+        # Update stats
+        await client.db.increment_encoding_count(user_id)
+        
+    except Exception as e:
+        logger.error(f"Batch encoding error: {e}")
+        await status_updater.edit(status, f"❌ **Error:** {str(e)}")
+    finally:
+        if ticket:
+            scheduler.release(ticket)
+        # Interrupted by a shutdown: keep the renditions for the resumed job
+        if not job_runner.shutting_down:
+            for output_path in outputs:
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+        if source:
+            await source.close()
 
-async def compress_video(client: Client, message: Message):
-    """Compress video"""
-    await message.reply_text(
-        "🗜️ **Video Compression**\n\n"
-        "Reply to a video with:\n"
-        "`/compress <percentage>`\n\n"
-        "**Example:**\n"
-        "`/compress 50` - Reduce size by 50%\n"
-        "`/compress 75` - Reduce size by 75%\n\n"
-        "⚠️ Higher compression = lower quality"
-    )
+async def compress_video(client: Client, message: Message, from_user: User = None):
+    """Compress a video to fit a target size"""
+    user = from_user or message.from_user
+    user_id = user.id
+    args = message.command or []
+    replied = message.reply_to_message
     
-    if not message.reply_to_message:
+    if not replied or not (replied.video or replied.document) or len(args) < 2:
+        await message.reply_text(
+            "🗜️ **Video Compression**\n\n"
+            "Reply to a video with:\n"
+            "`/compress <size>` or `/compress <percentage>%`\n\n"
+            "**Example:**\n"
+            "`/compress 50MB` - Fit the video into 50 MB\n"
+            "`/compress 1.5GB` - Fit the video into 1.5 GB\n"
+            "`/compress 60%` - Reduce size by 60%\n\n"
+            "⚠️ Smaller size = lower quality"
+        )
         return
     
-    if len(message.command) < 2:
-        await message.reply_text("❌ Please specify compression percentage!\n\nExample: `/compress 50`")
-        return
+    media = replied.video or replied.document
+    file_size = media.file_size
     
-    try:
-        compression = int(message.command[1])
+    # "60%" (or a bare 10-90) shrinks by a percentage, anything else is a size
+    value = args[1].strip()
+    if value.endswith("%") or value.isdigit():
+        try:
+            compression = int(value.rstrip("%"))
+        except ValueError:
+            compression = 0
         if compression < 10 or compression > 90:
             await message.reply_text("❌ Compression must be between 10-90%")
             return
-    except:
-        await message.reply_text("❌ Invalid compression value!")
+        target_size = file_size * (100 - compression) // 100
+    else:
+        target_size = parse_size(value)
+        if not target_size:
+            await message.reply_text("❌ Invalid size!\n\nExample: `/compress 50MB`")
+            return
+    
+    if target_size >= file_size:
+        await message.reply_text(
+            f"✅ The video is already {human_readable_size(file_size)}, "
+            f"no need to compress it to {human_readable_size(target_size)}."
+        )
+        return
+    
+    is_premium = await client.db.is_premium_user(user_id)
+    max_size = 4294967296 if is_premium else 2147483648  # 4GB for premium, 2GB for free
+    if file_size > max_size:
+        await message.reply_text(
+            f"❌ File size too large!\n\n"
+            f"**Your limit:** {human_readable_size(max_size)}\n"
+            f"**File size:** {human_readable_size(file_size)}\n\n"
+            "💎 Upgrade to premium for higher limits!"
+        )
         return
     
-    # Calculate CRF based on compression
-    crf = int(18 + (compression / 100) * 33)  # Scale from 18-51
+    settings = await get_encode_settings(client, user_id)
+    codec = settings["codec"]
+    preset = settings["preset"]
+    audio_bitrate = settings["audio_bitrate"]
+    watermark = settings["watermark"]
     
-    await message.reply_text(
-        f"🗜️ **Compressing video...**\n\n"
-        f"**Compression:** {compression}%\n"
-        f"**CRF Value:** {crf}\n\n"
-        "Please wait..."
+    # Reject impossible targets before downloading, when the duration is known
+    duration = replied.video.duration if replied.video and replied.video.duration else 0
+    if duration and size_budget(target_size, duration, audio_bitrate) < MIN_VIDEO_BITRATE:
+        await message.reply_text(
+            f"❌ **{human_readable_size(target_size)} is too small for a {format_time(duration)} video!**"
+        )
+        return
+    
+    # Only what shapes the two-pass output; CRF and rate profiles aren't used
+    job_hash = get_job_hash(media.file_unique_id, {
+        "op": "compress",
+        "target_size": target_size,
+        "codec": codec,
+        "preset": preset,
+        "audio_bitrate": audio_bitrate,
+        "watermark": watermark
+    })
+    cached_caption = (
+        f"🗜️ **Video Compressed**\n\n"
+        f"**Target:** {human_readable_size(target_size)}\n"
+        f"**Time:** Instant (cached)\n"
+        f"**Codec:** {codec.upper()}"
     )
+    if await send_cached_output(client, message, user_id, job_hash, cached_caption):
+        return
     
-    # Use encode_video function with custom CRF
-    # Implementation similar to encode_video but with custom CRF
+    status = await message.reply_text("📥 **Downloading video...**")
+    source = None
+    ticket = None
+    
+    try:
+        ticket = await acquire_slot(client, user_id, status, premium=is_premium)
+        
+        start_time = time.time()
+        source = source_cache.start(
+            replied,
+            progress=transfer_progress(status, "Downloading")
+        )
+        # Both passes read the whole input, so wait for the complete file
+        input_file = await source.wait()
+        output_path = get_output_path(user_id, source.path, "_compressed.mp4")
+        encoder = FFmpegEncoder()
+        
+        if not duration:
+            duration = await encoder.get_duration(input_file)
+        if not duration:
+            await status_updater.edit(status, "❌ Could not read the video duration!")
+            return
+        
+        video_bitrate = size_budget(target_size, duration, audio_bitrate)
+        if video_bitrate < MIN_VIDEO_BITRATE:
+            await status_updater.edit(
+                status,
+                f"❌ **{human_readable_size(target_size)} is too small for a {format_time(duration)} video!**"
+            )
+            return
+        
+        attempts = 0
+        if resumed_artifact("uploading", "output") == output_path:
+            # Encoded before a restart, only the upload is left
+            output_size = os.path.getsize(output_path)
+        else:
+            await set_stage("encoding", source=source.path)
+            encoding_start = time.time()
+            
+            async def encoding_progress(number: int, count: int, snapshot: ProgressSnapshot):
+                status_updater.update(
+                    status,
+                    f"🗜️ **Compressing to {human_readable_size(target_size)}...**\n\n"
+                    f"**Pass:** {number}/{count}\n"
+                    f"{format_progress_bar(snapshot.percentage)}\n\n"
+                    f"**Speed:** {snapshot.speed:.2f}x\n"
+                    f"**Elapsed:** {format_time(time.time() - encoding_start)}"
+                )
+            
+            # One correction when the first encode misses the target
+            while True:
+                attempts += 1
+                await status_updater.edit(
+                    status,
+                    f"🗜️ **Compressing to {human_readable_size(target_size)}...**\n\n"
+                    f"**Video bitrate:** {video_bitrate // 1000} kbps"
+                    + ("\n**Second attempt**, the first one missed the target" if attempts > 1 else "")
+                )
+                success = await encoder.encode_to_size(
+                    input_file=input_file,
+                    output_file=output_path,
+                    video_bitrate=video_bitrate,
+                    audio_bitrate=audio_bitrate,
+                    codec=codec,
+                    preset=preset,
+                    watermark_text=watermark,
+                    progress_callback=encoding_progress,
+                    duration=duration
+                )
+                if not success:
+                    await status_updater.edit(status, "❌ Compression failed!")
+                    return
+                
+                output_size = os.path.getsize(output_path)
+                hit = target_size * (1 - COMPRESS_TOLERANCE) <= output_size <= target_size
+                if hit or attempts > COMPRESS_RETRIES:
+                    break
+                # Aim for the middle of the accepted range
+                video_bitrate = retarget_bitrate(
+                    video_bitrate,
+                    output_size,
+                    int(target_size * (1 - COMPRESS_TOLERANCE / 2)),
+                    duration
+                )
+                if video_bitrate < MIN_VIDEO_BITRATE:
+                    break
+        
+        await status_updater.edit(status, "📤 **Uploading compressed video...**")
+        await set_stage("uploading", output=output_path)
+        
+        caption = (
+            f"🗜️ **Video Compressed**\n\n"
+            f"**Target:** {human_readable_size(target_size)}\n"
+            f"**Size:** {human_readable_size(output_size)} "
+            f"(was {human_readable_size(file_size)})\n"
+            f"**Time:** {format_time(time.time() - start_time)}\n"
+            f"**Codec:** {codec.upper()}"
+        )
+        if attempts > 1:
+            caption += f"\n**Attempts:** {attempts}"
+        if output_size > target_size:
+            caption += "\n\n⚠️ Slightly over the target, try a smaller size."
+        
+        sent = await upload_output(client, message, user_id, output_path, caption, status)
+        await save_output(client, job_hash, sent)
+        await status.delete()
+        
+        # Cleanup
+        try:
+            os.remove(output_path)
+        except:
+            pass
+        
+        await client.db.increment_encoding_count(user_id)
+        
+    except Exception as e:
+        logger.error(f"Compression error: {e}")
+        await status_updater.edit(status, f"❌ **Error:** {str(e)}")
+    finally:
+        if ticket:
+            scheduler.release(ticket)
+        if source:
+            await source.close()
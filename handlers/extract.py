@@ -1,7 +1,9 @@
 from pyrogram import Client
 from pyrogram.types import Message
 from utils.ffmpeg import FFmpegEncoder
-from utils.helpers import human_readable_size
+from utils.helpers import human_readable_size, get_output_path
+from utils.source_cache import source_cache
+from utils.scheduler import scheduler, acquire_slot
 import logging
 import os
 
@@ -30,14 +32,19 @@ async def extract_audio(client: Client, message: Message):
     
     user_id = message.from_user.id
     status = await message.reply_text("🎵 **Extracting audio...**")
+    video_path = None
+    ticket = None
     
     try:
+        # Wait for a free slot before downloading
+        ticket = await acquire_slot(client, user_id, status)
+        
         # Download video
         await status.edit_text("📥 **Downloading video...**")
-        video_path = await replied.download(file_name=f"./downloads/{user_id}/")
+        video_path = await source_cache.acquire(replied)
         
         # Set output path
-        output_path = video_path.rsplit(".", 1)[0] + ".mp3"
+        output_path = get_output_path(user_id, video_path, ".mp3")
         
         # Extract audio using FFmpeg
         await status.edit_text("🔄 **Extracting audio track...**")
@@ -63,14 +70,17 @@ async def extract_audio(client: Client, message: Message):
         await status.delete()
         
         # Cleanup
-        if os.path.exists(video_path):
-            os.remove(video_path)
         if os.path.exists(output_path):
             os.remove(output_path)
             
     except Exception as e:
         logger.error(f"Error extracting audio: {e}")
         await status.edit_text(f"❌ **Error:** {str(e)}")
+    finally:
+        if ticket:
+            scheduler.release(ticket)
+        if video_path:
+            source_cache.release(replied)
 
 async def extract_subtitle(client: Client, message: Message):
     """Extract subtitle from video"""
@@ -95,13 +105,18 @@ async def extract_subtitle(client: Client, message: Message):
     
     user_id = message.from_user.id
     status = await message.reply_text("📝 **Extracting subtitle...**")
+    video_path = None
+    ticket = None
     
     try:
+        # Wait for a free slot before downloading
+        ticket = await acquire_slot(client, user_id, status)
+        
         # Download video
         await status.edit_text("📥 **Downloading video...**")
-        video_path = await replied.download(file_name=f"./downloads/{user_id}/")
+        video_path = await source_cache.acquire(replied)
         
-        output_path = video_path.rsplit(".", 1)[0] + ".srt"
+        output_path = get_output_path(user_id, video_path, ".srt")
         
         # Extract subtitle using FFmpeg
         await status.edit_text("🔄 **Extracting subtitle track...**")
@@ -117,10 +132,6 @@ async def extract_subtitle(client: Client, message: Message):
                 "• Subtitles are hard-coded (burned-in)\n"
                 "• Subtitle format not supported"
             )
-            
-            # Cleanup
-            if os.path.exists(video_path):
-                os.remove(video_path)
             return
         
         # Upload subtitle file
@@ -135,14 +146,17 @@ async def extract_subtitle(client: Client, message: Message):
         await status.delete()
         
         # Cleanup
-        if os.path.exists(video_path):
-            os.remove(video_path)
         if os.path.exists(output_path):
             os.remove(output_path)
             
     except Exception as e:
         logger.error(f"Error extracting subtitle: {e}")
         await status.edit_text(f"❌ **Error:** {str(e)}")
+    finally:
+        if ticket:
+            scheduler.release(ticket)
+        if video_path:
+            source_cache.release(replied)
 
 async def extract_thumbnail(client: Client, message: Message):
     """Extract thumbnail/screenshot from video"""
@@ -176,13 +190,18 @@ async def extract_thumbnail(client: Client, message: Message):
     
     user_id = message.from_user.id
     status = await message.reply_text(f"📸 **Extracting thumbnail at {timestamp}...**")
+    video_path = None
+    ticket = None
     
     try:
+        # Wait for a free slot before downloading
+        ticket = await acquire_slot(client, user_id, status)
+        
         # Download video
         await status.edit_text("📥 **Downloading video...**")
-        video_path = await replied.download(file_name=f"./downloads/{user_id}/")
+        video_path = await source_cache.acquire(replied)
         
-        output_path = video_path.rsplit(".", 1)[0] + "_thumb.jpg"
+        output_path = get_output_path(user_id, video_path, "_thumb.jpg")
         
         # Extract thumbnail using FFmpeg
         await status.edit_text("🔄 **Capturing screenshot...**")
@@ -211,14 +230,17 @@ async def extract_thumbnail(client: Client, message: Message):
         await status.delete()
         
         # Cleanup
-        if os.path.exists(video_path):
-            os.remove(video_path)
         if os.path.exists(output_path):
             os.remove(output_path)
             
     except Exception as e:
         logger.error(f"Error extracting thumbnail: {e}")
         await status.edit_text(f"❌ **Error:** {str(e)}")
+    finally:
+        if ticket:
+            scheduler.release(ticket)
+        if video_path:
+            source_cache.release(replied)
 
 async def extract_all(client: Client, message: Message):
     """Extract everything from video (audio, subtitles, thumbnail)"""
@@ -241,31 +263,35 @@ async def extract_all(client: Client, message: Message):
     
     user_id = message.from_user.id
     status = await message.reply_text("📦 **Extracting all components...**")
+    video_path = None
+    ticket = None
     
     try:
+        # Wait for a free slot before downloading
+        ticket = await acquire_slot(client, user_id, status)
+        
         # Download video
         await status.edit_text("📥 **Downloading video...**")
-        video_path = await replied.download(file_name=f"./downloads/{user_id}/")
+        video_path = await source_cache.acquire(replied)
         
         encoder = FFmpegEncoder()
-        base_name = video_path.rsplit(".", 1)[0]
         extracted = []
         
         # Extract audio
         await status.edit_text("🎵 **Extracting audio...**")
-        audio_path = base_name + ".mp3"
+        audio_path = get_output_path(user_id, video_path, ".mp3")
         if await encoder.extract_audio(video_path, audio_path, format="mp3"):
             extracted.append(("audio", audio_path))
         
         # Extract subtitle
         await status.edit_text("📝 **Extracting subtitles...**")
-        subtitle_path = base_name + ".srt"
+        subtitle_path = get_output_path(user_id, video_path, ".srt")
         if await encoder.extract_subtitle(video_path, subtitle_path):
             extracted.append(("subtitle", subtitle_path))
         
         # Extract thumbnail
         await status.edit_text("📸 **Extracting thumbnail...**")
-        thumb_path = base_name + "_thumb.jpg"
+        thumb_path = get_output_path(user_id, video_path, "_thumb.jpg")
         if await encoder.extract_thumbnail(video_path, thumb_path, "00:00:01"):
             extracted.append(("thumbnail", thumb_path))
         
@@ -292,11 +318,12 @@ async def extract_all(client: Client, message: Message):
                 logger.error(f"Error uploading {item_type}: {e}")
         
         await status.edit_text(f"✅ **Extracted {len(extracted)} components successfully!**")
-        
-        # Cleanup
-        if os.path.exists(video_path):
-            os.remove(video_path)
             
     except Exception as e:
         logger.error(f"Error in extract_all: {e}")
         await status.edit_text(f"❌ **Error:** {str(e)}")
+    finally:
+        if ticket:
+            scheduler.release(ticket)
+        if video_path:
+            source_cache.release(replied)
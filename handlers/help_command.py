@@ -49,7 +49,7 @@ async def show_encoding_help(client: Client, callback_query):
 
 **Other Commands:**
 /all - Encode in all qualities (Premium)
-/compress <percentage> - Compress video
+/compress <size> - Fit a video into e.g. 50MB (or <percentage>%)
 
 **Usage:**
 Reply to a video with the quality command.
@@ -74,6 +74,7 @@ async def show_editing_help(client: Client, callback_query):
 
 /cut - Trim video by time
 /crop - Change video aspect ratio
+/process - Render queued edits
 /merge - Merge multiple videos
 /addwatermark - Add logo watermark
 
@@ -84,13 +85,16 @@ Reply to video: `/cut 00:00:10 00:01:30`
 This trims from 10 seconds to 1 minute 30 seconds
 
 **Crop Video:**
-Use /crop and select aspect ratio:
+Reply with `/crop 16:9`, or use /crop and select aspect ratio:
 • 16:9 - Widescreen
 • 9:16 - Vertical (Stories)
 • 1:1 - Square (Instagram)
 • 4:3 - Classic TV
 • 21:9 - Cinematic
 
+**Combining Edits:**
+/cut, /crop and /hsub are queued on the video and rendered together in a single encode by /process, or by a quality like /720p (your watermark is added too)
+
 **Merge Videos:**
 1. Send multiple videos
 2. Use /merge command
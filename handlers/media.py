@@ -1,7 +1,10 @@
 from pyrogram import Client
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 from utils.ffmpeg import FFmpegEncoder
+from utils.source_cache import source_cache
 from utils.helpers import human_readable_size, format_time, parse_time
+from utils.scheduler import scheduler, acquire_slot
+from utils.pipeline import edit_pipelines, pipeline_text, TrimStep, CropStep, CROP_RATIOS
 import logging
 import os
 import time
@@ -103,6 +106,12 @@ async def trim_video(client: Client, message: Message):
         )
         return
     
+    replied = message.reply_to_message
+    
+    if not (replied.video or replied.document):
+        await message.reply_text("❌ **Please reply to a video!**")
+        return
+    
     if len(message.command) < 3:
         await message.reply_text(
             "❌ **Invalid format!**\n\n"
@@ -122,12 +131,9 @@ async def trim_video(client: Client, message: Message):
         await message.reply_text("❌ **Start time must be before end time!**")
         return
     
-    await message.reply_text(
-        f"✂️ **Trimming video...**\n\n"
-        f"**From:** {start_time}\n"
-        f"**To:** {end_time}\n\n"
-        f"Please wait..."
-    )
+    # Rendered with the other queued edits by the next encode of this video
+    pipeline = edit_pipelines.add(message.from_user.id, replied, TrimStep(start_seconds, end_seconds))
+    await message.reply_text(pipeline_text(pipeline))
 
 async def crop_video(client: Client, message: Message):
     """Crop video to different aspect ratio"""
@@ -165,18 +171,22 @@ async def crop_video(client: Client, message: Message):
         await message.reply_text("❌ **Please reply to a video!**")
         return
     
+    if len(message.command) > 1:
+        ratio = message.command[1]
+        if ratio not in CROP_RATIOS:
+            await message.reply_text(f"❌ **Unknown aspect ratio!**\n\nUse one of: {', '.join(CROP_RATIOS)}")
+            return
+        pipeline = edit_pipelines.add(message.from_user.id, replied, CropStep(ratio))
+        await message.reply_text(pipeline_text(pipeline))
+        return
+    
+    # The keyboard isn't a reply in private chats, so carry the video's id
     buttons = [
         [
-            InlineKeyboardButton("16:9", callback_data="crop_16:9"),
-            InlineKeyboardButton("9:16", callback_data="crop_9:16")
-        ],
-        [
-            InlineKeyboardButton("1:1", callback_data="crop_1:1"),
-            InlineKeyboardButton("4:3", callback_data="crop_4:3")
-        ],
-        [
-            InlineKeyboardButton("21:9", callback_data="crop_21:9")
+            InlineKeyboardButton(ratio, callback_data=f"crop_{replied.id}_{ratio}")
+            for ratio in row
         ]
+        for row in (["16:9", "9:16"], ["1:1", "4:3"], ["21:9"])
     ]
     
     await message.reply_text(
@@ -255,10 +265,15 @@ async def get_media_info(client: Client, message: Message):
         return
     
     status = await message.reply_text("📊 **Fetching media information...**")
+    file_path = None
+    ticket = None
     
     try:
-        # Download file temporarily
-        file_path = await replied.download()
+        # Wait for a free slot before downloading
+        ticket = await acquire_slot(client, message.from_user.id, status)
+        
+        # Download file (cached for follow-up commands on the same file)
+        file_path = await source_cache.acquire(replied)
         
         # Get video info using FFmpeg
         encoder = FFmpegEncoder()
@@ -309,11 +324,12 @@ async def get_media_info(client: Client, message: Message):
         info_text += f"• Format: {format_info.get('format_name', 'Unknown').upper()}"
         
         await status.edit_text(info_text)
-        
-        # Cleanup
-        if os.path.exists(file_path):
-            os.remove(file_path)
             
     except Exception as e:
         logger.error(f"Error getting media info: {e}")
         await status.edit_text(f"❌ **Error:** {str(e)}")
+    finally:
+        if ticket:
+            scheduler.release(ticket)
+        if file_path:
+            source_cache.release(replied)
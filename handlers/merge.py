@@ -2,6 +2,7 @@ from pyrogram import Client
 from pyrogram.types import Message
 from utils.ffmpeg import FFmpegEncoder
 from utils.helpers import human_readable_size, format_time
+from utils.scheduler import scheduler, acquire_slot
 import logging
 import os
 import time
@@ -68,8 +69,16 @@ async def merge_start(client: Client, message: Message):
     """Start merging queued videos"""
     user_id = message.from_user.id
     
+    # The queue is carried in the command (/merge_start <message ids>) so
+    # a job resumed after a restart still knows its videos
+    video_ids = [int(i) for i in message.command[1:]]
+    videos = [
+        video for video in await client.get_messages(message.chat.id, video_ids)
+        if video and not video.empty and (video.video or video.document)
+    ] if video_ids else []
+    
     # Check if user has videos in queue
-    if user_id not in merge_queue or len(merge_queue[user_id]) < 2:
+    if len(videos) < 2:
         await message.reply_text(
             "❌ **Not enough videos in queue!**\n\n"
             "You need at least 2 videos to merge.\n"
@@ -77,7 +86,6 @@ async def merge_start(client: Client, message: Message):
         )
         return
     
-    videos = merge_queue[user_id]
     video_count = len(videos)
     
     status = await message.reply_text(
@@ -86,7 +94,12 @@ async def merge_start(client: Client, message: Message):
         f"**This may take a while...**"
     )
     
+    ticket = None
+    
     try:
+        # Wait for a free slot before downloading
+        ticket = await acquire_slot(client, user_id, status)
+        
         download_dir = f"./downloads/{user_id}/merge/"
         os.makedirs(download_dir, exist_ok=True)
         
@@ -97,12 +110,12 @@ async def merge_start(client: Client, message: Message):
             await status.edit_text(
                 f"📥 **Downloading videos...**\n\n"
                 f"**Progress:** {idx}/{video_count}\n"
-                f"**Current:** {video['file_name']}"
+                f"**Current:** {(video.video or video.document).file_name}"
             )
             
             try:
                 file_path = await client.download_media(
-                    video['file_id'],
+                    video,
                     file_name=f"{download_dir}video_{idx:03d}.mp4"
                 )
                 downloaded_files.append(file_path)
@@ -127,9 +140,10 @@ async def merge_start(client: Client, message: Message):
         output_size = os.path.getsize(output_path)
         
         # Get user settings
-        media_type = await client.db.get_media_type(user_id)
-        thumbnail = await client.db.get_thumbnail(user_id)
-        spoiler = await client.db.get_spoiler(user_id)
+        user_settings = await client.db.get_user_settings(user_id)
+        thumbnail = user_settings["thumbnail"]
+        media_type = user_settings["media_type"]
+        spoiler = user_settings["spoiler"]
         
         # Upload merged video
         await status.edit_text("📤 **Uploading merged video...**")
@@ -176,6 +190,9 @@ async def merge_start(client: Client, message: Message):
     except Exception as e:
         logger.error(f"Error merging videos: {e}")
         await status.edit_text(f"❌ **Error:** {str(e)}")
+    finally:
+        if ticket:
+            scheduler.release(ticket)
 
 async def merge_clear(client: Client, message: Message):
     """Clear merge queue"""
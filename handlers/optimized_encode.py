@@ -2,22 +2,28 @@ from pyrogram import Client
 from pyrogram.types import Message
 import os
 import time
+from config import Config
 from utils.fast_encoder import FastEncoder
 from utils.enhanced_progress import EnhancedProgress
-from utils.helpers import human_readable_size, format_time
+from utils.progress import transfer_progress
+from utils.rate_control import DEFAULT_RATE_PROFILE, load_rate_ladder, rendition_profile
+from utils.source_cache import source_cache
+from utils.helpers import human_readable_size, format_time, get_output_path
+from utils.scheduler import scheduler, acquire_slot
+from utils.status import status_updater
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Resolution configurations
+# Resolution configurations, rate control comes from the selected profile
 RESOLUTIONS = {
-    "144p": {"height": 144, "bitrate": "128k"},
-    "240p": {"height": 240, "bitrate": "256k"},
-    "360p": {"height": 360, "bitrate": "512k"},
-    "480p": {"height": 480, "bitrate": "1M"},
-    "720p": {"height": 720, "bitrate": "2M"},
-    "1080p": {"height": 1080, "bitrate": "4M"},
-    "2160p": {"height": 2160, "bitrate": "8M"}
+    "144p": {"height": 144},
+    "240p": {"height": 240},
+    "360p": {"height": 360},
+    "480p": {"height": 480},
+    "720p": {"height": 720},
+    "1080p": {"height": 1080},
+    "2160p": {"height": 2160}
 }
 
 async def fast_encode_video(client: Client, message: Message):
@@ -74,18 +80,20 @@ async def fast_encode_video(client: Client, message: Message):
         f"**▸ Preparing to download...**"
     )
     
+    download_path = None
+    ticket = None
+    
     try:
-        # Create download directory
-        download_dir = f"./downloads/{user_id}/"
-        os.makedirs(download_dir, exist_ok=True)
+        # Wait for a free slot before downloading
+        ticket = await acquire_slot(client, user_id, status, premium=is_premium)
         
         # Download video with enhanced progress
         start_time = time.time()
         progress_tracker = EnhancedProgress(total_size=file_size)
         
-        download_path = await replied.download(
-            file_name=download_dir,
-            progress=lambda c, t: progress_tracker.download_progress(c, t, status, "Downloading")
+        download_path = await source_cache.acquire(
+            replied,
+            progress=transfer_progress(status, render=progress_tracker.download_text)
         )
         
         download_time = time.time() - start_time
@@ -96,12 +104,16 @@ async def fast_encode_video(client: Client, message: Message):
         preset = await client.db.get_bot_setting("preset", "faster")  # Changed to faster
         crf = await client.db.get_bot_setting("crf", 23)
         audio_bitrate = await client.db.get_bot_setting("audio_bitrate", "128k")
+        rate_profile = await client.db.get_bot_setting("rate_profile", DEFAULT_RATE_PROFILE)
+        rate = rendition_profile(await load_rate_ladder(client.db, rate_profile), resolution["height"])
         
         # Get user settings
-        watermark = await client.db.get_watermark(user_id)
+        user_settings = await client.db.get_user_settings(user_id)
+        watermark = user_settings["watermark"]
         
         # Encode video with progress
-        await status.edit_text(
+        await status_updater.edit(
+            status,
             f"**▸ File:** `{file_name[:35]}...`\n\n"
             f"**▸ Status:** `Encoding`\n"
             f"[░░░░░░░░░░░░░░░░░░░░] 0.00%\n\n"
@@ -109,16 +121,17 @@ async def fast_encode_video(client: Client, message: Message):
             f"**▸ Quality:** {command}"
         )
         
-        output_path = download_path.rsplit(".", 1)[0] + f"_{command}.mp4"
+        output_path = get_output_path(user_id, download_path, f"_{command}.mp4")
         
         encoder = FastEncoder()
         encoding_start = time.time()
         
-        success = await encoder.encode_video_fast(
+        encode = encoder.encode_video_segmented if Config.SEGMENTED_ENCODING else encoder.encode_video_fast
+        success = await encode(
             input_file=download_path,
             output_file=output_path,
             height=resolution["height"],
-            video_bitrate=resolution["bitrate"],
+            rate=rate,
             audio_bitrate=audio_bitrate,
             codec=codec,
             preset=preset,
@@ -126,11 +139,12 @@ async def fast_encode_video(client: Client, message: Message):
             watermark_text=watermark,
             progress_callback=EnhancedProgress().encoding_progress,
             status_msg=status,
-            file_name=file_name
+            file_name=file_name,
+            duration=replied.video.duration if replied.video and replied.video.duration else 0
         )
         
         if not success:
-            await status.edit_text("❌ Encoding failed!")
+            await status_updater.edit(status, "❌ Encoding failed!")
             return
         
         encoding_time = time.time() - encoding_start
@@ -139,12 +153,13 @@ async def fast_encode_video(client: Client, message: Message):
         output_size = os.path.getsize(output_path)
         
         # Get user preferences
-        thumbnail = await client.db.get_thumbnail(user_id)
-        media_type = await client.db.get_media_type(user_id)
-        spoiler = await client.db.get_spoiler(user_id)
+        thumbnail = user_settings["thumbnail"]
+        media_type = user_settings["media_type"]
+        spoiler = user_settings["spoiler"]
         
         # Upload video with progress
-        await status.edit_text(
+        await status_updater.edit(
+            status,
             f"**▸ File:** `{file_name[:35]}...`\n\n"
             f"**▸ Status:** `Uploading`\n"
             f"[░░░░░░░░░░░░░░░░░░░░] 0.00%\n\n"
@@ -173,7 +188,7 @@ async def fast_encode_video(client: Client, message: Message):
                 document=output_path,
                 caption=caption,
                 thumb=thumbnail,
-                progress=lambda c, t: upload_progress.upload_progress(c, t, status, file_name)
+                progress=transfer_progress(status, render=upload_progress.upload_text, render_args=(file_name,))
             )
         else:
             await message.reply_video(
@@ -182,14 +197,13 @@ async def fast_encode_video(client: Client, message: Message):
                 thumb=thumbnail,
                 has_spoiler=spoiler,
                 supports_streaming=True,
-                progress=lambda c, t: upload_progress.upload_progress(c, t, status, file_name)
+                progress=transfer_progress(status, render=upload_progress.upload_text, render_args=(file_name,))
             )
         
         await status.delete()
         
         # Cleanup
         try:
-            os.remove(download_path)
             os.remove(output_path)
         except:
             pass
@@ -199,4 +213,9 @@ async def fast_encode_video(client: Client, message: Message):
         
     except Exception as e:
         logger.error(f"Encoding error: {e}")
-        await status.edit_text(f"❌ **Error:** {str(e)}")
+        await status_updater.edit(status, f"❌ **Error:** {str(e)}")
+    finally:
+        if ticket:
+            scheduler.release(ticket)
+        if download_path:
+            source_cache.release(replied)
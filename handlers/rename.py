@@ -2,8 +2,13 @@ from pyrogram import Client
 from pyrogram.types import Message
 from utils.helpers import human_readable_size, clean_filename
 from utils.enhanced_progress import EnhancedProgress
+from utils.progress import transfer_progress
+from utils.source_cache import source_cache
+from utils.scheduler import scheduler, acquire_slot
+from utils.status import status_updater
 import logging
 import os
+import shutil
 import time
 
 logger = logging.getLogger(__name__)
@@ -83,7 +88,13 @@ async def rename_file(client: Client, message: Message):
         f"**Status:** Downloading..."
     )
     
+    old_path = None
+    ticket = None
+    
     try:
+        # Wait for a free slot before downloading
+        ticket = await acquire_slot(client, user_id, status)
+        
         download_dir = f"./downloads/{user_id}/"
         os.makedirs(download_dir, exist_ok=True)
         
@@ -91,22 +102,29 @@ async def rename_file(client: Client, message: Message):
         start_time = time.time()
         progress_tracker = EnhancedProgress(total_size=file_size)
         
-        old_path = await replied.download(
-            file_name=download_dir,
-            progress=lambda c, t: progress_tracker.download_progress(c, t, status, "Downloading")
+        old_path = await source_cache.acquire(
+            replied,
+            progress=transfer_progress(status, render=progress_tracker.download_text)
         )
         
-        # Rename file
+        # Link the cached file under the new name (copy across filesystems)
         new_path = os.path.join(download_dir, new_name)
-        os.rename(old_path, new_path)
+        if os.path.exists(new_path):
+            os.remove(new_path)
+        try:
+            os.link(old_path, new_path)
+        except OSError:
+            shutil.copyfile(old_path, new_path)
         
         # Get user settings
-        thumbnail = await client.db.get_thumbnail(user_id)
-        media_type = await client.db.get_media_type(user_id)
-        spoiler = await client.db.get_spoiler(user_id)
+        user_settings = await client.db.get_user_settings(user_id)
+        thumbnail = user_settings["thumbnail"]
+        media_type = user_settings["media_type"]
+        spoiler = user_settings["spoiler"]
         
         # Upload with new name
-        await status.edit_text(
+        await status_updater.edit(
+            status,
             f"📝 **Uploading...**\n\n"
             f"**Name:** `{new_name}`\n"
             f"**Size:** {human_readable_size(file_size)}"
@@ -126,7 +144,7 @@ async def rename_file(client: Client, message: Message):
                 document=new_path,
                 caption=caption,
                 thumb=thumbnail,
-                progress=lambda c, t: upload_progress.upload_progress(c, t, status, new_name)
+                progress=transfer_progress(status, render=upload_progress.upload_text, render_args=(new_name,))
             )
         else:
             await message.reply_video(
@@ -135,7 +153,7 @@ async def rename_file(client: Client, message: Message):
                 thumb=thumbnail,
                 has_spoiler=spoiler,
                 supports_streaming=True,
-                progress=lambda c, t: upload_progress.upload_progress(c, t, status, new_name)
+                progress=transfer_progress(status, render=upload_progress.upload_text, render_args=(new_name,))
             )
         
         await status.delete()
@@ -146,7 +164,12 @@ async def rename_file(client: Client, message: Message):
             
     except Exception as e:
         logger.error(f"Rename error: {e}")
-        await status.edit_text(f"❌ **Error:** {str(e)}")
+        await status_updater.edit(status, f"❌ **Error:** {str(e)}")
+    finally:
+        if ticket:
+            scheduler.release(ticket)
+        if old_path:
+            source_cache.release(replied)
 
 async def auto_rename(client: Client, message: Message):
     """Auto-rename with pattern"""
@@ -1,6 +1,6 @@
 from pyrogram import Client
 from pyrogram.types import Message
-from utils.progress_display import cancel_task, get_user_tasks
+from utils.jobs import job_runner
 from utils.helpers import format_time
 import time
 import logging
@@ -41,7 +41,7 @@ async def stop_task(client: Client, message: Message):
     
     # Try to cancel the task
     try:
-        success = cancel_task(user_id, task_id)
+        success = job_runner.cancel(user_id, task_id)
         
         if success:
             await message.reply_text(
@@ -76,7 +76,7 @@ async def list_tasks(client: Client, message: Message):
     user_id = message.from_user.id
     
     try:
-        tasks = get_user_tasks(user_id)
+        tasks = job_runner.user_jobs(user_id)
         
         if not tasks:
             await message.reply_text(
@@ -99,6 +99,11 @@ async def list_tasks(client: Client, message: Message):
             if hasattr(task, 'task_type'):
                 text += f"   📝 Type: {task.task_type}\n"
             
+            # Live encode progress reported by ffmpeg
+            progress = getattr(task, 'progress', None)
+            if progress:
+                text += f"   📊 {progress.percentage:.1f}% at {progress.speed:.2f}x, ETA {format_time(progress.eta)}\n"
+            
             text += "\n"
         
         text += "\n**To stop a task:** Tap on the task ID above or use `/stop<task_id>`"
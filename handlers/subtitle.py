@@ -1,11 +1,16 @@
 from pyrogram import Client
 from pyrogram.types import Message
 from utils.ffmpeg import FFmpegEncoder
-from utils.helpers import is_subtitle_file, human_readable_size
-from utils.progress import sync_progress_callback
+from utils.helpers import is_subtitle_file, human_readable_size, get_output_path
+from utils.progress import transfer_progress
+from utils.transfer import download_media
+from utils.source_cache import source_cache
+from utils.scheduler import scheduler, acquire_slot
+from utils.jobs import job_runner
+from utils.status import status_updater
+from utils.pipeline import edit_pipelines, pipeline_text, SubtitleStep
 import logging
 import os
-import time
 
 logger = logging.getLogger(__name__)
 
@@ -92,7 +97,7 @@ async def add_hard_subtitle(client: Client, message: Message):
     await message.reply_text(
         "📝 **Send subtitle file now**\n\n"
         "Send a subtitle file to burn into the video.\n\n"
-        "⚠️ **Note:** This process takes longer as subtitles are rendered into video."
+        "It is rendered together with your other edits by /process or a quality command like /720p."
     )
 
 async def process_subtitle_file(client: Client, message: Message):
@@ -121,34 +126,60 @@ async def process_subtitle_file(client: Client, message: Message):
     video_message = pending_data['video_message']
     subtitle_type = pending_data['type']
     
-    status = await message.reply_text(
-        f"📝 **Processing {'hard' if subtitle_type == 'hard' else 'soft'} subtitle...**"
-    )
+    if subtitle_type == 'hard':
+        # Burned in with the other queued edits by the next encode of the video
+        del pending_subtitles[user_id]
+        pipeline = edit_pipelines.add(user_id, video_message, SubtitleStep(message))
+        await message.reply_text(pipeline_text(pipeline))
+        return
+    
+    # Soft subtitles are muxed in a background job; the video's id goes in
+    # the command so a job resumed after a restart can fetch it again
+    del pending_subtitles[user_id]
+    message.command = ["sub", str(video_message.id)]
+    job_runner.submit(client, message, "soft_subtitle", "Add soft subtitle")
+
+async def embed_soft_subtitle(client: Client, message: Message):
+    """Mux the subtitle file in message into the video named by its command"""
+    user_id = message.from_user.id
+    filename = message.document.file_name
+    
+    video_message = await client.get_messages(message.chat.id, int(message.command[1]))
+    if not video_message or video_message.empty or not (video_message.video or video_message.document):
+        await message.reply_text("❌ **The video is no longer available!**")
+        return
+    
+    status = await message.reply_text("📝 **Processing soft subtitle...**")
+    
+    video_path = None
+    ticket = None
     
     try:
+        # Wait for a free slot before downloading
+        ticket = await acquire_slot(client, user_id, status)
+        
         download_dir = f"./downloads/{user_id}/"
         os.makedirs(download_dir, exist_ok=True)
         
         # Download video
-        await status.edit_text("📥 **Downloading video...**")
-        start_time = time.time()
+        await status_updater.edit(status, "📥 **Downloading video...**")
         
-        video_path = await video_message.download(
-            file_name=download_dir,
-            progress=sync_progress_callback,
-            progress_args=(status, start_time, "Downloading video")
+        video_path = await source_cache.acquire(
+            video_message,
+            progress=transfer_progress(status, "Downloading video")
         )
         
         # Download subtitle
-        await status.edit_text("📥 **Downloading subtitle...**")
-        subtitle_path = await message.download(file_name=download_dir)
+        await status_updater.edit(status, "📥 **Downloading subtitle...**")
+        subtitle_path = await download_media(message, file_name=download_dir)
         
         # Process subtitle
-        output_path = video_path.rsplit(".", 1)[0] + f"_with_sub.mp4"
+        output_path = get_output_path(user_id, video_path, "_with_sub.mp4")
         
-        await status.edit_text(
-            f"🔄 **Adding {'hard' if subtitle_type == 'hard' else 'soft'} subtitle...**\n\n"
-            f"This may take a while..."
+        await status_updater.edit(
+            status,
+            "🔄 **Adding soft subtitle...**\n\n"
+            "This may take a while..."
         )
         
         encoder = FFmpegEncoder()
@@ -156,39 +187,37 @@ async def process_subtitle_file(client: Client, message: Message):
             video_path,
             subtitle_path,
             output_path,
-            hard_sub=(subtitle_type == 'hard')
+            hard_sub=False
         )
         
         if not success:
-            await status.edit_text("❌ **Failed to add subtitle!**")
+            await status_updater.edit(status, "❌ **Failed to add subtitle!**")
             return
         
         # Get output file info
         output_size = os.path.getsize(output_path)
         
         # Get user settings
-        media_type = await client.db.get_media_type(user_id)
-        thumbnail = await client.db.get_thumbnail(user_id)
-        spoiler = await client.db.get_spoiler(user_id)
+        user_settings = await client.db.get_user_settings(user_id)
+        thumbnail = user_settings["thumbnail"]
+        media_type = user_settings["media_type"]
+        spoiler = user_settings["spoiler"]
         
         # Upload result
-        await status.edit_text("📤 **Uploading...**")
+        await status_updater.edit(status, "📤 **Uploading...**")
         
         caption = (
-            f"✅ **{'Hard' if subtitle_type == 'hard' else 'Soft'} subtitle added!**\n\n"
+            "✅ **Soft subtitle added!**\n\n"
             f"**Size:** {human_readable_size(output_size)}\n"
             f"**Subtitle:** {filename}"
         )
         
-        start_time = time.time()
-        
         if media_type == "document":
             await message.reply_document(
                 document=output_path,
                 caption=caption,
                 thumb=thumbnail,
-                progress=sync_progress_callback,
-                progress_args=(status, start_time, "Uploading")
+                progress=transfer_progress(status, "Uploading")
             )
         else:
             await message.reply_video(
@@ -197,33 +226,28 @@ async def process_subtitle_file(client: Client, message: Message):
                 thumb=thumbnail,
                 has_spoiler=spoiler,
                 supports_streaming=True,
-                progress=sync_progress_callback,
-                progress_args=(status, start_time, "Uploading")
+                progress=transfer_progress(status, "Uploading")
             )
         
         await status.delete()
         
         # Cleanup
-        if os.path.exists(video_path):
-            os.remove(video_path)
         if os.path.exists(subtitle_path):
             os.remove(subtitle_path)
         if os.path.exists(output_path):
             os.remove(output_path)
         
-        # Clear pending operation
-        del pending_subtitles[user_id]
-        
         # Update stats
         await client.db.increment_encoding_count(user_id)
         
     except Exception as e:
         logger.error(f"Error processing subtitle: {e}")
-        await status.edit_text(f"❌ **Error:** {str(e)}")
-        
-        # Clear pending operation
-        if user_id in pending_subtitles:
-            del pending_subtitles[user_id]
+        await status_updater.edit(status, f"❌ **Error:** {str(e)}")
+    finally:
+        if ticket:
+            scheduler.release(ticket)
+        if video_path:
+            source_cache.release(video_message)
 
 async def remove_subtitle(client: Client, message: Message):
     """Remove all subtitles from video"""
@@ -247,56 +271,55 @@ async def remove_subtitle(client: Client, message: Message):
     user_id = message.from_user.id
     status = await message.reply_text("🗑️ **Removing subtitles...**")
     
+    video_path = None
+    ticket = None
+    
     try:
-        download_dir = f"./downloads/{user_id}/"
-        os.makedirs(download_dir, exist_ok=True)
+        # Wait for a free slot before downloading
+        ticket = await acquire_slot(client, user_id, status)
         
         # Download video
-        await status.edit_text("📥 **Downloading video...**")
-        start_time = time.time()
+        await status_updater.edit(status, "📥 **Downloading video...**")
         
-        video_path = await replied.download(
-            file_name=download_dir,
-            progress=sync_progress_callback,
-            progress_args=(status, start_time, "Downloading")
+        video_path = await source_cache.acquire(
+            replied,
+            progress=transfer_progress(status, "Downloading")
         )
         
-        output_path = video_path.rsplit(".", 1)[0] + "_no_sub.mp4"
+        output_path = get_output_path(user_id, video_path, "_no_sub.mp4")
         
         # Remove subtitles using FFmpeg
-        await status.edit_text("🔄 **Processing...**")
+        await status_updater.edit(status, "🔄 **Processing...**")
         encoder = FFmpegEncoder()
         success = await encoder.remove_subtitle(video_path, output_path)
         
         if not success:
-            await status.edit_text("❌ **Failed to remove subtitles!**")
+            await status_updater.edit(status, "❌ **Failed to remove subtitles!**")
             return
         
         # Get output file info
         output_size = os.path.getsize(output_path)
         
         # Get user settings
-        media_type = await client.db.get_media_type(user_id)
-        thumbnail = await client.db.get_thumbnail(user_id)
-        spoiler = await client.db.get_spoiler(user_id)
+        user_settings = await client.db.get_user_settings(user_id)
+        thumbnail = user_settings["thumbnail"]
+        media_type = user_settings["media_type"]
+        spoiler = user_settings["spoiler"]
         
         # Upload result
-        await status.edit_text("📤 **Uploading...**")
+        await status_updater.edit(status, "📤 **Uploading...**")
         
         caption = (
             f"✅ **Subtitles removed successfully!**\n\n"
             f"**Size:** {human_readable_size(output_size)}"
         )
         
-        start_time = time.time()
-        
         if media_type == "document":
             await message.reply_document(
                 document=output_path,
                 caption=caption,
                 thumb=thumbnail,
-                progress=sync_progress_callback,
-                progress_args=(status, start_time, "Uploading")
+                progress=transfer_progress(status, "Uploading")
             )
         else:
             await message.reply_video(
@@ -305,15 +328,12 @@ async def remove_subtitle(client: Client, message: Message):
                 thumb=thumbnail,
                 has_spoiler=spoiler,
                 supports_streaming=True,
-                progress=sync_progress_callback,
-                progress_args=(status, start_time, "Uploading")
+                progress=transfer_progress(status, "Uploading")
             )
         
         await status.delete()
         
         # Cleanup
-        if os.path.exists(video_path):
-            os.remove(video_path)
         if os.path.exists(output_path):
             os.remove(output_path)
         
@@ -322,7 +342,12 @@ async def remove_subtitle(client: Client, message: Message):
             
     except Exception as e:
         logger.error(f"Error removing subtitles: {e}")
-        await status.edit_text(f"❌ **Error:** {str(e)}")
+        await status_updater.edit(status, f"❌ **Error:** {str(e)}")
+    finally:
+        if ticket:
+            scheduler.release(ticket)
+        if video_path:
+            source_cache.release(replied)
 
 async def extract_subtitle(client: Client, message: Message):
     """Extract subtitle from video"""
@@ -347,40 +372,38 @@ async def extract_subtitle(client: Client, message: Message):
     user_id = message.from_user.id
     status = await message.reply_text("📤 **Extracting subtitle...**")
     
+    video_path = None
+    ticket = None
+    
     try:
-        download_dir = f"./downloads/{user_id}/"
-        os.makedirs(download_dir, exist_ok=True)
+        # Wait for a free slot before downloading
+        ticket = await acquire_slot(client, user_id, status)
         
         # Download video
-        await status.edit_text("📥 **Downloading video...**")
-        start_time = time.time()
+        await status_updater.edit(status, "📥 **Downloading video...**")
         
-        video_path = await replied.download(
-            file_name=download_dir,
-            progress=sync_progress_callback,
-            progress_args=(status, start_time, "Downloading")
+        video_path = await source_cache.acquire(
+            replied,
+            progress=transfer_progress(status, "Downloading")
         )
         
-        output_path = video_path.rsplit(".", 1)[0] + ".srt"
+        output_path = get_output_path(user_id, video_path, ".srt")
         
         # Extract subtitle using FFmpeg
-        await status.edit_text("🔄 **Extracting...**")
+        await status_updater.edit(status, "🔄 **Extracting...**")
         encoder = FFmpegEncoder()
         success = await encoder.extract_subtitle(video_path, output_path)
         
         if not success:
-            await status.edit_text(
+            await status_updater.edit(
+                status,
                 "❌ **No subtitles found in video!**\n\n"
                 "The video doesn't contain any embedded subtitle tracks."
             )
-            
-            # Cleanup
-            if os.path.exists(video_path):
-                os.remove(video_path)
             return
         
         # Upload subtitle file
-        await status.edit_text("📤 **Uploading subtitle...**")
+        await status_updater.edit(status, "📤 **Uploading subtitle...**")
         file_size = os.path.getsize(output_path)
         
         await message.reply_document(
@@ -391,11 +414,14 @@ async def extract_subtitle(client: Client, message: Message):
         await status.delete()
         
         # Cleanup
-        if os.path.exists(video_path):
-            os.remove(video_path)
         if os.path.exists(output_path):
             os.remove(output_path)
             
     except Exception as e:
         logger.error(f"Error extracting subtitle: {e}")
-        await status.edit_text(f"❌ **Error:** {str(e)}")
+        await status_updater.edit(status, f"❌ **Error:** {str(e)}")
+    finally:
+        if ticket:
+            scheduler.release(ticket)
+        if video_path:
+            source_cache.release(replied)
@@ -16,6 +16,10 @@ except ImportError:
 
 from utils.helpers import human_readable_size
 from utils.enhanced_progress import EnhancedProgress
+from utils.progress import transfer_progress
+from utils.transfer import download_media
+from utils.scheduler import scheduler, acquire_slot
+from utils.status import status_updater
 import logging
 
 logger = logging.getLogger(__name__)
@@ -90,14 +94,20 @@ async def unzip_file(client: Client, message: Message):
         f"**Status:** Downloading..."
     )
     
+    ticket = None
+    
     try:
+        # Wait for a free slot before downloading
+        ticket = await acquire_slot(client, user_id, status)
+        
         download_dir = f"./downloads/{user_id}/"
         extract_dir = f"./downloads/{user_id}/extracted/"
         os.makedirs(download_dir, exist_ok=True)
         os.makedirs(extract_dir, exist_ok=True)
         
         # Download file
-        await status.edit_text(
+        await status_updater.edit(
+            status,
             f"📦 **Extracting Archive**\n\n"
             f"**File:** `{file_name}`\n"
             f"[●●●○○○○○○○] Downloading...\n\n"
@@ -105,13 +115,15 @@ async def unzip_file(client: Client, message: Message):
         )
         
         progress = EnhancedProgress(total_size=file_size)
-        archive_path = await replied.download(
+        archive_path = await download_media(
+            replied,
             file_name=download_dir,
-            progress=lambda c, t: progress.download_progress(c, t, status, "Downloading")
+            progress=transfer_progress(status, render=progress.download_text)
         )
         
         # Extract based on format
-        await status.edit_text(
+        await status_updater.edit(
+            status,
             f"📦 **Extracting Archive**\n\n"
             f"**File:** `{file_name}`\n"
             f"[●●●●●●●○○○] Extracting...\n\n"
@@ -145,7 +157,7 @@ async def unzip_file(client: Client, message: Message):
                 extracted_files = tar_ref.getnames()
         
         if not extracted_files:
-            await status.edit_text("❌ **No files found in archive!**")
+            await status_updater.edit(status, "❌ **No files found in archive!**")
             return
         
         # Get extracted file sizes
@@ -158,13 +170,27 @@ async def unzip_file(client: Client, message: Message):
                 file_count += 1
         
         # Send extracted files
-        await status.edit_text(
+        await status_updater.edit(
+            status,
             f"📦 **Extraction Complete!**\n\n"
             f"**Files extracted:** {file_count}\n"
             f"**Total size:** {human_readable_size(total_size)}\n\n"
             f"**Uploading files...**"
         )
         
+        # Get user settings once for every extracted file
+        user_settings = await client.db.get_user_settings(user_id)
+        media_type = user_settings["media_type"]
+        
+        # Download thumbnail if exists
+        thumb_path = None
+        if user_settings["thumbnail"]:
+            try:
+                thumb_path = f"{download_dir}thumb.jpg"
+                await client.download_media(user_settings["thumbnail"], file_name=thumb_path)
+            except:
+                thumb_path = None
+        
         uploaded = 0
         for root, dirs, files in os.walk(extract_dir):
             for file in files:
@@ -177,25 +203,13 @@ async def unzip_file(client: Client, message: Message):
                         continue
                     
                     uploaded += 1
-                    await status.edit_text(
+                    status_updater.update(
+                        status,
                         f"📤 **Uploading Files**\n\n"
                         f"**Progress:** {uploaded}/{file_count}\n"
                         f"**Current:** `{file}`"
                     )
                     
-                    # Get user settings
-                    thumbnail = await client.db.get_thumbnail(user_id)
-                    media_type = await client.db.get_media_type(user_id)
-                    
-                    # Download thumbnail if exists
-                    thumb_path = None
-                    if thumbnail:
-                        try:
-                            thumb_path = f"{download_dir}thumb.jpg"
-                            await client.download_media(thumbnail, file_name=thumb_path)
-                        except:
-                            thumb_path = None
-                    
                     # Check if video file
                     video_extensions = ['.mp4', '.mkv', '.avi', '.mov', '.webm', '.flv']
                     is_video = any(file.lower().endswith(ext) for ext in video_extensions)
@@ -222,7 +236,8 @@ async def unzip_file(client: Client, message: Message):
                     logger.error(f"Error uploading {file}: {e}")
                     continue
         
-        await status.edit_text(
+        await status_updater.edit(
+            status,
             f"✅ **Extraction Complete!**\n\n"
             f"**Files uploaded:** {uploaded}/{file_count}\n"
             f"**Total size:** {human_readable_size(total_size)}"
@@ -238,10 +253,13 @@ async def unzip_file(client: Client, message: Message):
             shutil.rmtree(extract_dir)
             
     except zipfile.BadZipFile:
-        await status.edit_text("❌ **Invalid or corrupted ZIP file!**")
+        await status_updater.edit(status, "❌ **Invalid or corrupted ZIP file!**")
     except Exception as e:
         logger.error(f"Unzip error: {e}")
-        await status.edit_text(f"❌ **Error:** {str(e)}")
+        await status_updater.edit(status, f"❌ **Error:** {str(e)}")
+    finally:
+        if ticket:
+            scheduler.release(ticket)
     
     replied = message.reply_to_message
     
@@ -271,14 +289,20 @@ async def unzip_file(client: Client, message: Message):
         f"**Status:** Downloading..."
     )
     
+    ticket = None
+    
     try:
+        # Wait for a free slot before downloading
+        ticket = await acquire_slot(client, user_id, status)
+        
         download_dir = f"./downloads/{user_id}/"
         extract_dir = f"./downloads/{user_id}/extracted/"
         os.makedirs(download_dir, exist_ok=True)
         os.makedirs(extract_dir, exist_ok=True)
         
         # Download file
-        await status.edit_text(
+        await status_updater.edit(
+            status,
             f"📦 **Extracting Archive**\n\n"
             f"**File:** `{file_name}`\n"
             f"[●●●○○○○○○○] Downloading...\n\n"
@@ -286,13 +310,15 @@ async def unzip_file(client: Client, message: Message):
         )
         
         progress = EnhancedProgress(total_size=file_size)
-        archive_path = await replied.download(
+        archive_path = await download_media(
+            replied,
             file_name=download_dir,
-            progress=lambda c, t: progress.download_progress(c, t, status, "Downloading")
+            progress=transfer_progress(status, render=progress.download_text)
         )
         
         # Extract based on format
-        await status.edit_text(
+        await status_updater.edit(
+            status,
             f"📦 **Extracting Archive**\n\n"
             f"**File:** `{file_name}`\n"
             f"[●●●●●●●○○○] Extracting...\n\n"
@@ -327,7 +353,7 @@ async def unzip_file(client: Client, message: Message):
                 extracted_files = tar_ref.getnames()
         
         if not extracted_files:
-            await status.edit_text("❌ **No files found in archive!**")
+            await status_updater.edit(status, "❌ **No files found in archive!**")
             return
         
         # Get extracted file sizes
@@ -340,13 +366,27 @@ async def unzip_file(client: Client, message: Message):
                 file_count += 1
         
         # Send extracted files
-        await status.edit_text(
+        await status_updater.edit(
+            status,
             f"📦 **Extraction Complete!**\n\n"
             f"**Files extracted:** {file_count}\n"
             f"**Total size:** {human_readable_size(total_size)}\n\n"
             f"**Uploading files...**"
         )
         
+        # Get user settings once for every extracted file
+        user_settings = await client.db.get_user_settings(user_id)
+        media_type = user_settings["media_type"]
+        
+        # Download thumbnail if exists
+        thumb_path = None
+        if user_settings["thumbnail"]:
+            try:
+                thumb_path = f"{download_dir}thumb.jpg"
+                await client.download_media(user_settings["thumbnail"], file_name=thumb_path)
+            except:
+                thumb_path = None
+        
         uploaded = 0
         for root, dirs, files in os.walk(extract_dir):
             for file in files:
@@ -359,25 +399,13 @@ async def unzip_file(client: Client, message: Message):
                         continue
                     
                     uploaded += 1
-                    await status.edit_text(
+                    status_updater.update(
+                        status,
                         f"📤 **Uploading Files**\n\n"
                         f"**Progress:** {uploaded}/{file_count}\n"
                         f"**Current:** `{file}`"
                     )
                     
-                    # Get user settings
-                    thumbnail = await client.db.get_thumbnail(user_id)
-                    media_type = await client.db.get_media_type(user_id)
-                    
-                    # Download thumbnail if exists
-                    thumb_path = None
-                    if thumbnail:
-                        try:
-                            thumb_path = f"{download_dir}thumb.jpg"
-                            await client.download_media(thumbnail, file_name=thumb_path)
-                        except:
-                            thumb_path = None
-                    
                     # Check if video file
                     video_extensions = ['.mp4', '.mkv', '.avi', '.mov', '.webm', '.flv']
                     is_video = any(file.lower().endswith(ext) for ext in video_extensions)
@@ -404,7 +432,8 @@ async def unzip_file(client: Client, message: Message):
                     logger.error(f"Error uploading {file}: {e}")
                     continue
         
-        await status.edit_text(
+        await status_updater.edit(
+            status,
             f"✅ **Extraction Complete!**\n\n"
             f"**Files uploaded:** {uploaded}/{file_count}\n"
             f"**Total size:** {human_readable_size(total_size)}"
@@ -420,9 +449,12 @@ async def unzip_file(client: Client, message: Message):
             shutil.rmtree(extract_dir)
             
     except zipfile.BadZipFile:
-        await status.edit_text("❌ **Invalid or corrupted ZIP file!**")
+        await status_updater.edit(status, "❌ **Invalid or corrupted ZIP file!**")
     except rarfile.BadRarFile:
-        await status.edit_text("❌ **Invalid or corrupted RAR file!**")
+        await status_updater.edit(status, "❌ **Invalid or corrupted RAR file!**")
     except Exception as e:
         logger.error(f"Unzip error: {e}")
-        await status.edit_text(f"❌ **Error:** {str(e)}")
+        await status_updater.edit(status, f"❌ **Error:** {str(e)}")
+    finally:
+        if ticket:
+            scheduler.release(ticket)
@@ -0,0 +1,132 @@
+import os
+import shutil
+import asyncio
+import logging
+from typing import List, Optional
+from config import Config
+from utils.ffmpeg import FFmpegEncoder
+from utils.rate_control import RateProfile
+
+logger = logging.getLogger(__name__)
+
+# Candidates run from this far below the configured CRF...
+CRF_BELOW = 4
+# ...to this far above it, in CRF_STEP steps
+CRF_ABOVE = 8
+CRF_STEP = 2
+
+
+class CrfChoice:
+    """Outcome of a content-adaptive CRF analysis"""
+
+    def __init__(self, crf: int, base_crf: int, ssim: float, psnr: float, sample_bytes: int):
+        self.crf = crf
+        self.base_crf = base_crf
+        self.ssim = ssim                  # worst sample window
+        self.psnr = psnr                  # average over the windows, dB
+        self.sample_bytes = sample_bytes
+
+    @property
+    def summary(self) -> str:
+        """One line for the caption"""
+        change = "" if self.crf == self.base_crf else f", configured {self.base_crf}"
+        return f"{self.crf} adaptive{change} (SSIM {self.ssim:.3f}, PSNR {self.psnr:.1f} dB)"
+
+
+def candidate_crfs(base_crf: int) -> List[int]:
+    """CRFs tried around the configured one, lowest (best quality) first"""
+    low = max(base_crf - CRF_BELOW, 0)
+    high = min(base_crf + CRF_ABOVE, 51)
+    return sorted(set(range(low, high + 1, CRF_STEP)) | {base_crf})
+
+
+def sample_windows(duration: float, count: int, length: float) -> List[float]:
+    """Start times of count windows spread over the video, none if it is too short"""
+    if count < 1 or duration < count * length * 2:
+        return []
+    return [duration * (i + 1) / (count + 1) - length / 2 for i in range(count)]
+
+
+async def choose_crf(
+    input_file: str,
+    work_dir: str,
+    duration: float,
+    height: Optional[int],
+    codec: str,
+    preset: str,
+    base_crf: int,
+    rate: Optional[RateProfile] = None,
+    min_ssim: float = None
+) -> Optional[CrfChoice]:
+    """
+    Pick the highest (cheapest) CRF whose samples still meet the SSIM floor
+
+    A few short windows spread over the video are encoded with the real
+    settings and compared with the source; quality falls as CRF rises,
+    so the candidates are binary searched. Flat content such as
+    cartoons or screen recordings passes at a high CRF, grain and noise
+    pull it down. Returns None when the video is too short to sample or
+    the analysis fails, the caller then keeps base_crf.
+
+    Args:
+        work_dir: Directory for the sample encodes, removed afterwards
+        rate: Rate profile of the rendition, its caps apply to the samples
+        min_ssim: Worst window SSIM accepted (default Config.ADAPTIVE_CRF_MIN_SSIM)
+    """
+    min_ssim = min_ssim or Config.ADAPTIVE_CRF_MIN_SSIM
+    length = Config.ADAPTIVE_CRF_SAMPLE_SECONDS
+    windows = sample_windows(duration, Config.ADAPTIVE_CRF_SAMPLES, length)
+    if not windows:
+        return None
+
+    measured = {}
+
+    async def measure_window(crf: int, index: int, start: float) -> tuple:
+        sample = os.path.join(work_dir, f"crf{crf}_{index}.mkv")
+        command = FFmpegEncoder.sample_command(
+            input_file, sample, start, length, height, codec, preset, crf,
+            rate.with_crf(crf) if rate else None
+        )
+        if not await FFmpegEncoder._run(command, f"CRF {crf} sample"):
+            raise RuntimeError(f"CRF {crf} sample encode failed")
+        try:
+            ssim, psnr = await FFmpegEncoder.measure_quality(sample, input_file, start, length, height)
+            return ssim, psnr, os.path.getsize(sample)
+        finally:
+            os.remove(sample)
+
+    async def measure(crf: int) -> CrfChoice:
+        if crf not in measured:
+            results = await asyncio.gather(*(
+                measure_window(crf, i, start) for i, start in enumerate(windows)
+            ))
+            measured[crf] = CrfChoice(
+                crf,
+                base_crf,
+                min(r[0] for r in results),
+                sum(r[1] for r in results) / len(results),
+                sum(r[2] for r in results)
+            )
+            logger.info(f"CRF {crf}: SSIM {measured[crf].ssim:.4f}, {measured[crf].sample_bytes} bytes")
+        return measured[crf]
+
+    candidates = candidate_crfs(base_crf)
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        best = None
+        low, high = 0, len(candidates) - 1
+        while low <= high:
+            middle = (low + high) // 2
+            choice = await measure(candidates[middle])
+            if choice.ssim >= min_ssim:
+                best = choice
+                low = middle + 1
+            else:
+                high = middle - 1
+        # Nothing meets the floor: the best quality candidate is the closest
+        return best or await measure(candidates[0])
+    except Exception as e:
+        logger.error(f"Adaptive CRF analysis failed, keeping CRF {base_crf}: {e}")
+        return None
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -1,22 +1,162 @@
-import subprocess
 import os
 import json
-import re
+import shutil
 import asyncio
 import logging
-from typing import Optional, Callable
+from typing import Optional, Callable, List
+from config import Config
+from utils.process import supervisor
+from utils.ffmpeg_progress import ProgressParser, ProgressSnapshot, progress_parser
+from utils.ffmpeg_command import FFmpegCommand, Filter, Output
+from utils.rate_control import RateProfile, apply_rate_control
 
 logger = logging.getLogger(__name__)
 
 class FastEncoder:
     """Optimized fast video encoder"""
     
+    @staticmethod
+    def _video_filters(height: int = None, watermark_text: str = None) -> List[Filter]:
+        """Scale and text watermark filters"""
+        filters = []
+        
+        # Scale filter
+        if height:
+            filters.append(Filter("scale", -2, height))
+        
+        # Watermark text
+        if watermark_text:
+            watermark_text = watermark_text.replace("'", "\\'")
+            filters.append(Filter.parse(
+                f"drawtext=text='{watermark_text}':"
+                f"fontsize=20:fontcolor=white@0.7:"
+                f"x=10:y=H-th-10:"
+                f"box=1:boxcolor=black@0.4:boxborderw=3"
+            ))
+        
+        return filters
+    
+    @staticmethod
+    def _video_output(
+        command: FFmpegCommand,
+        output: Output,
+        filters: List[Filter],
+        codec: str,
+        preset: str,
+        crf: int,
+        rate: Optional[RateProfile]
+    ):
+        """Map the filtered first video stream and set the encoder, capped CRF with a rate profile"""
+        if filters:
+            command.graph.chain(["0:v:0"], filters, ["v"])
+            output.map("[v]")
+        else:
+            output.map("0:v:0")
+        
+        apply_rate_control(output, codec, preset, crf, rate)
+        if codec == "libx264":
+            output.set("-profile:v", "high")
+            output.set("-level", "4.1")
+            output.set("-pix_fmt", "yuv420p")
+        elif codec == "libx265":
+            output.set("-tag:v", "hvc1")
+    
+    @staticmethod
+    def fast_command(
+        input_file: str,
+        output_file: str,
+        height: int = None,
+        rate: Optional[RateProfile] = None,
+        audio_bitrate: str = "128k",
+        codec: str = "libx264",
+        preset: str = "faster",
+        crf: int = 23,
+        watermark_text: str = None
+    ) -> FFmpegCommand:
+        """Build the encode_video_fast command"""
+        command = FFmpegCommand().progress()
+        command.add_input(input_file)
+        output = command.add_output(output_file)
+        
+        FastEncoder._video_output(
+            command, output, FastEncoder._video_filters(height, watermark_text),
+            codec, preset, crf, rate
+        )
+        output.map("0:a:0?")  # First audio stream if it exists
+        output.audio_codec("aac", bitrate=audio_bitrate)
+        output.set("-ac", 2)  # Stereo
+        
+        # Output settings for faster encoding
+        output.set("-movflags", "+faststart")
+        output.set("-threads", 0)  # Use all CPU cores
+        output.set("-max_muxing_queue_size", 1024)
+        return command
+    
+    @staticmethod
+    def split_command(input_file: str, pattern: str, chunk_seconds: int) -> FFmpegCommand:
+        """Stream-copy the video into keyframe-aligned chunks"""
+        command = FFmpegCommand()
+        command.add_input(input_file)
+        output = command.add_output(pattern)
+        output.map("0:v:0")
+        output.set("-c", "copy")
+        output.set("-f", "segment")
+        output.set("-segment_time", chunk_seconds)
+        output.set("-reset_timestamps", 1)
+        return command
+    
+    @staticmethod
+    def chunk_command(
+        chunk_file: str,
+        output_file: str,
+        filters: List[Filter],
+        codec: str,
+        preset: str,
+        crf: int,
+        rate: Optional[RateProfile],
+        threads: int
+    ) -> FFmpegCommand:
+        """Encode one video-only chunk"""
+        command = FFmpegCommand().progress()
+        command.add_input(chunk_file)
+        output = command.add_output(output_file)
+        FastEncoder._video_output(command, output, filters, codec, preset, crf, rate)
+        output.set("-an")
+        output.set("-threads", threads)
+        return command
+    
+    @staticmethod
+    def audio_command(input_file: str, output_file: str, audio_bitrate: str) -> FFmpegCommand:
+        """Encode the first audio stream on its own"""
+        command = FFmpegCommand()
+        command.add_input(input_file)
+        output = command.add_output(output_file)
+        output.map("0:a:0")
+        output.set("-vn")
+        output.audio_codec("aac", bitrate=audio_bitrate)
+        output.set("-ac", 2)
+        return command
+    
+    @staticmethod
+    def concat_command(concat_file: str, output_file: str, audio_file: Optional[str] = None) -> FFmpegCommand:
+        """Join encoded chunks (and the audio) without re-encoding"""
+        command = FFmpegCommand()
+        command.add_input(concat_file).set("-f", "concat").set("-safe", 0)
+        output = command.add_output(output_file)
+        output.map("0:v:0")
+        if audio_file:
+            command.add_input(audio_file)
+            output.map("1:a:0")
+        output.set("-c", "copy")
+        output.set("-movflags", "+faststart")
+        return command
+    
     @staticmethod
     async def encode_video_fast(
         input_file: str,
         output_file: str,
         height: int = None,
-        video_bitrate: str = "1M",
+        rate: Optional[RateProfile] = None,
         audio_bitrate: str = "128k",
         codec: str = "libx264",
         preset: str = "faster",  # Changed from medium to faster
@@ -24,7 +164,8 @@ class FastEncoder:
         watermark_text: str = None,
         progress_callback: Optional[Callable] = None,
         status_msg = None,
-        file_name: str = ""
+        file_name: str = "",
+        duration: float = 0
     ) -> bool:
         """
         Fast video encoding with progress tracking
@@ -33,176 +174,208 @@ class FastEncoder:
             input_file: Input video path
             output_file: Output video path
             height: Target height (width auto-calculated)
-            video_bitrate: Video bitrate (e.g., "1M", "2M")
+            rate: Rate profile capping the CRF encode, plain CRF if None
             audio_bitrate: Audio bitrate (e.g., "128k", "192k")
             codec: Video codec (libx264, libx265, libvpx-vp9)
             preset: Encoding preset (ultrafast, superfast, veryfast, faster, fast, medium)
             crf: Constant Rate Factor (18-28 recommended)
             watermark_text: Text watermark to add
-            progress_callback: Async callback for progress updates
+            progress_callback: Async callback(snapshot, status_msg, file_name)
+                receiving a ProgressSnapshot every 3 seconds
             status_msg: Status message object to update
             file_name: Original file name for display
+            duration: Input duration in seconds (e.g. Telegram's
+                video.duration); probed from the container when unknown
         
         Returns:
             bool: True if successful, False otherwise
         """
         try:
-            # Get total frames for progress calculation
-            total_frames = await FastEncoder.get_total_frames(input_file)
-            
-            # Build FFmpeg command
-            cmd = ["ffmpeg", "-i", input_file, "-y"]
-            
-            # Hardware acceleration (if available)
-            # cmd.extend(["-hwaccel", "auto"])
+            # Progress is encoded time over duration, no frame counting pass
+            if not duration:
+                duration = await FastEncoder.get_duration(input_file)
             
-            # Video filters
-            filters = []
+            command = FastEncoder.fast_command(
+                input_file, output_file, height, rate, audio_bitrate,
+                codec, preset, crf, watermark_text
+            )
             
-            # Scale filter
-            if height:
-                filters.append(f"scale=-2:{height}")
+            logger.info(f"Encoding command: {command}")
             
-            # Watermark text
-            if watermark_text:
-                watermark_text = watermark_text.replace("'", "\\'")
-                filters.append(
-                    f"drawtext=text='{watermark_text}':"
-                    f"fontsize=20:fontcolor=white@0.7:"
-                    f"x=10:y=H-th-10:"
-                    f"box=1:boxcolor=black@0.4:boxborderw=3"
-                )
+            # Execute FFmpeg with progress tracking
+            async def show_progress(snapshot: ProgressSnapshot):
+                if progress_callback and status_msg:
+                    await progress_callback(snapshot, status_msg, file_name)
             
-            # Apply filters
-            if filters:
-                cmd.extend(["-vf", ",".join(filters)])
+            parser = progress_parser(duration, show_progress)
+            result = await supervisor.run(
+                command.args(),
+                timeout=Config.FFMPEG_TIMEOUT or None,
+                on_stdout_line=parser.feed
+            )
             
-            # Video codec settings
-            if codec == "libx264":
-                cmd.extend([
-                    "-c:v", "libx264",
-                    "-preset", preset,
-                    "-crf", str(crf),
-                    "-profile:v", "high",
-                    "-level", "4.1",
-                    "-pix_fmt", "yuv420p"
-                ])
-            elif codec == "libx265":
-                cmd.extend([
-                    "-c:v", "libx265",
-                    "-preset", preset,
-                    "-crf", str(crf),
-                    "-tag:v", "hvc1"
-                ])
+            if result.ok:
+                logger.info(f"Encoding successful: {output_file}")
+                return True
             else:
-                cmd.extend([
-                    "-c:v", codec,
-                    "-b:v", video_bitrate
-                ])
+                logger.error(f"Encoding failed: {result.stderr_text}")
+                return False
             
-            # Audio settings
-            cmd.extend([
-                "-c:a", "aac",
-                "-b:a", audio_bitrate,
-                "-ac", "2"  # Stereo
-            ])
+        except Exception as e:
+            logger.error(f"Encoding error: {e}")
+            return False
+    
+    @staticmethod
+    async def encode_video_segmented(
+        input_file: str,
+        output_file: str,
+        height: int = None,
+        rate: Optional[RateProfile] = None,
+        audio_bitrate: str = "128k",
+        codec: str = "libx264",
+        preset: str = "faster",
+        crf: int = 23,
+        watermark_text: str = None,
+        progress_callback: Optional[Callable] = None,
+        status_msg = None,
+        file_name: str = "",
+        duration: float = 0,
+        chunk_seconds: int = None,
+        workers: int = None
+    ) -> bool:
+        """
+        Encode a long video in parallel keyframe-aligned chunks
+        
+        The video stream is stream-copied into chunks (the segment muxer only
+        cuts on keyframes), the chunks are encoded in a bounded pool of ffmpeg
+        processes, audio is encoded once, and everything is concat-copied
+        into the final MP4. Inputs shorter than two chunks use
+        encode_video_fast instead.
+        
+        Args:
+            chunk_seconds: Target chunk length (default Config.SEGMENT_SECONDS)
+            workers: Parallel encoder processes (default Config.SEGMENT_WORKERS,
+                0 = one per four CPU cores)
+            Other arguments are the same as encode_video_fast; progress of
+            the parallel chunk encoders is combined into one snapshot.
+        
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        chunk_seconds = chunk_seconds or Config.SEGMENT_SECONDS
+        workers = workers or Config.SEGMENT_WORKERS or max(1, (os.cpu_count() or 1) // 4)
+        
+        info = await FastEncoder.get_video_info(input_file)
+        duration = float(info.get("format", {}).get("duration", 0) or 0) or duration
+        has_audio = any(st.get("codec_type") == "audio" for st in info.get("streams", []))
+        
+        if workers < 2 or duration < chunk_seconds * 2:
+            return await FastEncoder.encode_video_fast(
+                input_file, output_file, height, rate, audio_bitrate,
+                codec, preset, crf, watermark_text, progress_callback, status_msg, file_name,
+                duration
+            )
+        
+        work_dir = output_file + ".parts"
+        os.makedirs(work_dir, exist_ok=True)
+        timeout = Config.FFMPEG_TIMEOUT or None
+        
+        try:
+            # Split the video stream at keyframes without re-encoding
+            result = await supervisor.run(
+                FastEncoder.split_command(input_file, os.path.join(work_dir, "src_%05d.mkv"), chunk_seconds).args(),
+                timeout=timeout
+            )
             
-            # Output settings for faster encoding
-            cmd.extend([
-                "-movflags", "+faststart",
-                "-map", "0:v:0",  # Map first video stream
-                "-map", "0:a:0?",  # Map first audio stream if exists
-                "-threads", "0",  # Use all CPU cores
-                "-max_muxing_queue_size", "1024"
-            ])
+            if not result.ok:
+                logger.error(f"Segmenting failed: {result.stderr_text[-1000:]}")
+                return False
             
-            # Enable progress reporting
-            cmd.extend(["-progress", "pipe:1"])
+            chunks = sorted(f for f in os.listdir(work_dir) if f.startswith("src_"))
+            logger.info(f"Encoding {len(chunks)} chunks with {workers} workers: {output_file}")
             
-            cmd.append(output_file)
+            # Split the CPU between the parallel encoders
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            filters = FastEncoder._video_filters(height, watermark_text)
             
-            logger.info(f"Encoding command: {' '.join(cmd)}")
+            semaphore = asyncio.Semaphore(workers)
+            chunk_parsers = [ProgressParser() for _ in chunks]
             
-            # Execute FFmpeg with progress tracking
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
+            async def show_progress(snapshot: ProgressSnapshot):
+                if progress_callback and status_msg:
+                    await progress_callback(snapshot, status_msg, file_name)
             
-            current_frame = 0
+            combined = progress_parser(duration, show_progress)
             
-            # Read progress
-            while True:
-                line = await process.stdout.readline()
-                if not line:
-                    break
+            async def encode_chunk(index: int, chunk: str) -> str:
+                chunk_output = os.path.join(work_dir, chunk.replace("src_", "enc_"))
                 
-                line = line.decode('utf-8').strip()
+                async def on_progress_line(line: str):
+                    await chunk_parsers[index].feed(line)
+                    if line.startswith("progress="):
+                        await combined.publish(ProgressSnapshot.combine(
+                            [p.latest for p in chunk_parsers], duration
+                        ))
                 
-                # Parse frame number
-                if line.startswith('frame='):
-                    try:
-                        frame_match = re.search(r'frame=\s*(\d+)', line)
-                        if frame_match:
-                            current_frame = int(frame_match.group(1))
-                            
-                            if progress_callback and status_msg and total_frames > 0:
-                                await progress_callback(
-                                    current_frame, 
-                                    total_frames, 
-                                    status_msg,
-                                    file_name
-                                )
-                    except Exception as e:
-                        logger.error(f"Progress parsing error: {e}")
+                command = FastEncoder.chunk_command(
+                    os.path.join(work_dir, chunk), chunk_output, filters,
+                    codec, preset, crf, rate, threads
+                )
+                
+                async with semaphore:
+                    result = await supervisor.run(command.args(), timeout=timeout, on_stdout_line=on_progress_line)
+                
+                if not result.ok:
+                    raise RuntimeError(f"chunk {chunk} failed: {result.stderr_text[-500:]}")
+                return chunk_output
             
-            await process.wait()
+            async def encode_audio() -> Optional[str]:
+                if not has_audio:
+                    return None
+                audio_output = os.path.join(work_dir, "audio.m4a")
+                result = await supervisor.run(
+                    FastEncoder.audio_command(input_file, audio_output, audio_bitrate).args(),
+                    timeout=timeout
+                )
+                
+                if not result.ok:
+                    raise RuntimeError(f"audio failed: {result.stderr_text[-500:]}")
+                return audio_output
             
-            if process.returncode == 0:
-                logger.info(f"Encoding successful: {output_file}")
-                return True
-            else:
-                stderr = await process.stderr.read()
-                logger.error(f"Encoding failed: {stderr.decode('utf-8')}")
-                return False
+            tasks = [asyncio.ensure_future(encode_chunk(i, c)) for i, c in enumerate(chunks)]
+            audio_task = asyncio.ensure_future(encode_audio())
             
-        except Exception as e:
-            logger.error(f"Encoding error: {e}")
-            return False
-    
-    @staticmethod
-    async def get_total_frames(file_path: str) -> int:
-        """Get total number of frames in video"""
-        try:
-            cmd = [
-                "ffprobe",
-                "-v", "error",
-                "-select_streams", "v:0",
-                "-count_packets",
-                "-show_entries", "stream=nb_read_packets",
-                "-of", "csv=p=0",
-                file_path
-            ]
+            try:
+                encoded = await asyncio.gather(*tasks)
+                audio_output = await audio_task
+            except BaseException:
+                # Fail fast: one bad chunk stops the rest of the pool
+                for task in tasks + [audio_task]:
+                    task.cancel()
+                await asyncio.gather(*tasks, audio_task, return_exceptions=True)
+                raise
             
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
+            # Join the encoded chunks and the audio without re-encoding
+            concat_file = os.path.join(work_dir, "concat.txt")
+            with open(concat_file, "w") as f:
+                for chunk_output in encoded:
+                    f.write(f"file '{os.path.abspath(chunk_output)}'\n")
+            
+            command = FastEncoder.concat_command(concat_file, output_file, audio_output)
+            
+            result = await supervisor.run(command.args(), timeout=timeout)
+            if not result.ok:
+                logger.error(f"Concat failed: {result.stderr_text[-1000:]}")
+                return False
             
-            stdout, _ = await process.communicate()
-            frames = int(stdout.decode('utf-8').strip())
-            return frames
+            logger.info(f"Segmented encoding successful: {output_file}")
+            return True
             
         except Exception as e:
-            logger.error(f"Error getting frame count: {e}")
-            # Fallback: calculate from duration and fps
-            try:
-                duration = await FastEncoder.get_duration(file_path)
-                return int(duration * 24)  # Assume 24fps
-            except:
-                return 0
+            logger.error(f"Segmented encoding error: {e}")
+            return False
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
     
     @staticmethod
     async def get_duration(file_path: str) -> float:
@@ -216,14 +389,8 @@ class FastEncoder:
                 file_path
             ]
             
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            
-            stdout, _ = await process.communicate()
-            return float(stdout.decode('utf-8').strip())
+            result = await supervisor.run(cmd, timeout=Config.FFPROBE_TIMEOUT or None)
+            return float(result.stdout_text.strip())
             
         except Exception as e:
             logger.error(f"Error getting duration: {e}")
@@ -242,14 +409,8 @@ class FastEncoder:
                 file_path
             ]
             
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            
-            stdout, _ = await process.communicate()
-            return json.loads(stdout.decode('utf-8'))
+            result = await supervisor.run(cmd, timeout=Config.FFPROBE_TIMEOUT or None)
+            return json.loads(result.stdout_text)
             
         except Exception as e:
             logger.error(f"Error getting video info: {e}")
@@ -1,17 +1,70 @@
-import subprocess
 import os
+import re
+import glob
 import json
 import logging
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Callable, Awaitable
+from config import Config
+from utils.ffmpeg_command import FFmpegCommand, Filter, format_bitrate
+from utils.rate_control import RateProfile, apply_rate_control
+from utils.process import supervisor
+from utils.ffmpeg_progress import ProgressSnapshot, progress_parser
+from utils.transfer import GrowingFile
 
 logger = logging.getLogger(__name__)
 
+# Encoders with a -pass 1/-pass 2 mode for size-targeted encodes
+TWO_PASS_CODECS = {"libx264", "libvpx-vp9", "libaom-av1"}
+
 class FFmpegEncoder:
     """Handle FFmpeg operations"""
     
     @staticmethod
-    async def get_video_info(file_path: str) -> Optional[Dict[str, Any]]:
-        """Get video information using ffprobe"""
+    async def _run(
+        command: FFmpegCommand,
+        label: str,
+        on_stdout_line: Optional[Callable[[str], Awaitable[None]]] = None,
+        input_stream: Optional[GrowingFile] = None
+    ) -> bool:
+        """Validate an ffmpeg command and run it through the shared process supervisor"""
+        timeout = Config.FFMPEG_TIMEOUT or None
+        result = await supervisor.run(
+            command.args(),
+            timeout=timeout,
+            on_stdout_line=on_stdout_line,
+            stdin_feed=input_stream.chunks() if input_stream else None
+        )
+        if not result.ok:
+            reason = "timed out" if result.timed_out else f"exit code {result.returncode}"
+            logger.error(f"{label} failed ({reason}): {result.stderr_text[-1000:]}")
+        return result.ok
+    
+    @staticmethod
+    async def _probe(cmd: List[str], input_stream: Optional[GrowingFile] = None) -> str:
+        """Run an ffprobe command and return its stdout"""
+        result = await supervisor.run(
+            cmd,
+            timeout=Config.FFPROBE_TIMEOUT or None,
+            stdin_feed=input_stream.chunks() if input_stream else None
+        )
+        if not result.ok:
+            raise RuntimeError(f"ffprobe failed: {result.stderr_text[-500:]}")
+        return result.stdout_text
+    
+    @staticmethod
+    def _drawtext_filter(watermark_text: str) -> str:
+        """Build the drawtext filter used for text watermarks"""
+        watermark_text = watermark_text.replace("'", "\\'")
+        return (
+            f"drawtext=text='{watermark_text}':"
+            f"fontsize=24:fontcolor=white@0.8:"
+            f"x=10:y=H-th-10:"
+            f"box=1:boxcolor=black@0.5:boxborderw=5"
+        )
+    
+    @staticmethod
+    async def get_video_info(file_path: str, input_stream: Optional[GrowingFile] = None) -> Optional[Dict[str, Any]]:
+        """Get video information using ffprobe (from the download when input_stream is set)"""
         try:
             cmd = [
                 "ffprobe",
@@ -19,96 +72,446 @@ class FFmpegEncoder:
                 "-print_format", "json",
                 "-show_format",
                 "-show_streams",
-                file_path
+                "pipe:0" if input_stream else file_path
             ]
             
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            return json.loads(result.stdout)
+            stdout = await FFmpegEncoder._probe(cmd, input_stream)
+            return json.loads(stdout)
         except Exception as e:
             logger.error(f"Error getting video info: {e}")
             return None
     
+    @staticmethod
+    def encode_command(
+        input_file: str,
+        output_file: str,
+        height: int = None,
+        width: int = None,
+        rate: Optional[RateProfile] = None,
+        audio_bitrate: str = "128k",
+        codec: str = "libx264",
+        preset: str = "medium",
+        crf: int = 23,
+        watermark_text: str = None,
+        watermark_logo: str = None,
+        fragmented: bool = False
+    ) -> FFmpegCommand:
+        """
+        Build the encode_video command
+        
+        rate caps the CRF encode (see RateProfile), without it the encode
+        is plain CRF. A logo is a second input, so it is overlaid in a
+        filtergraph instead of -vf.
+        """
+        command = FFmpegCommand().progress()
+        command.add_input(input_file)
+        output = command.add_output(output_file)
+        
+        # Video filters
+        chain = []
+        if height:
+            chain.append(Filter("scale", -2, height))
+        elif width:
+            chain.append(Filter("scale", width, -2))
+        if watermark_text:
+            chain.append(Filter.parse(FFmpegEncoder._drawtext_filter(watermark_text)))
+        
+        if watermark_logo:
+            command.add_input(watermark_logo)
+            command.graph.chain(["0:v:0"], chain or [Filter("null")], ["base"])
+            command.graph.chain(["base", "1:v:0"], [Filter("overlay", "W-w-10", 10)], ["v"])
+            output.map("[v]")
+        elif chain:
+            command.graph.chain(["0:v:0"], chain, ["v"])
+            output.map("[v]")
+        else:
+            output.map("0:v:0")
+        output.map("0:a:0?")
+        
+        apply_rate_control(output, codec, preset, crf, rate)
+        output.audio_codec("aac", bitrate=audio_bitrate, sample_rate=48000)
+        output.set("-movflags", FFmpegEncoder._movflags(fragmented))
+        return command
+    
+    @staticmethod
+    def _movflags(fragmented: bool) -> str:
+        """Fragmented MP4 for streaming uploads, else moov moved to the front"""
+        return "+frag_keyframe+empty_moov+default_base_moof" if fragmented else "+faststart"
+    
     @staticmethod
     async def encode_video(
         input_file: str,
         output_file: str,
         height: int = None,
         width: int = None,
-        video_bitrate: str = "1M",
+        rate: Optional[RateProfile] = None,
         audio_bitrate: str = "128k",
         codec: str = "libx264",
         preset: str = "medium",
         crf: int = 23,
         watermark_text: str = None,
-        watermark_logo: str = None
+        watermark_logo: str = None,
+        input_stream: Optional[GrowingFile] = None,
+        fragmented: bool = False,
+        progress_callback: Optional[Callable[[ProgressSnapshot], Awaitable[None]]] = None,
+        duration: float = 0
+    ) -> bool:
+        """
+        Encode video with specified parameters
+        
+        With input_stream the source is piped in while it is still being
+        downloaded and input_file is ignored. A fragmented MP4 is only ever
+        appended to, so it can be uploaded while it is written; otherwise
+        the output is rewritten at the end for +faststart. progress_callback
+        receives a ProgressSnapshot every 3 seconds, its percentage and ETA
+        are relative to duration (seconds, 0 if unknown).
+        """
+        try:
+            if watermark_logo and not os.path.exists(watermark_logo):
+                watermark_logo = None
+            
+            command = FFmpegEncoder.encode_command(
+                "pipe:0" if input_stream else input_file,
+                output_file,
+                height=height,
+                width=width,
+                rate=rate,
+                audio_bitrate=audio_bitrate,
+                codec=codec,
+                preset=preset,
+                crf=crf,
+                watermark_text=watermark_text,
+                watermark_logo=watermark_logo,
+                fragmented=fragmented
+            )
+            parser = progress_parser(duration, progress_callback)
+            return await FFmpegEncoder._run(command, "Encoding", parser.feed, input_stream)
+            
+        except Exception as e:
+            logger.error(f"Encoding error: {e}")
+            return False
+    
+    @staticmethod
+    def remux_command(
+        input_file: str,
+        output_file: str,
+        copy_audio: bool = True,
+        audio_bitrate: str = "128k",
+        fragmented: bool = False
+    ) -> FFmpegCommand:
+        """Build the remux_video command"""
+        command = FFmpegCommand().progress()
+        command.add_input(input_file)
+        output = command.add_output(output_file)
+        output.map("0:v:0").map("0:a:0?")
+        output.set("-map_metadata", 0)
+        output.set("-c:v", "copy")
+        if copy_audio:
+            output.audio_codec("copy")
+        else:
+            output.audio_codec("aac", bitrate=audio_bitrate, sample_rate=48000)
+        output.set("-movflags", FFmpegEncoder._movflags(fragmented))
+        return command
+    
+    @staticmethod
+    async def remux_video(
+        input_file: str,
+        output_file: str,
+        copy_audio: bool = True,
+        audio_bitrate: str = "128k",
+        input_stream: Optional[GrowingFile] = None,
+        fragmented: bool = False,
+        progress_callback: Optional[Callable[[ProgressSnapshot], Awaitable[None]]] = None,
+        duration: float = 0
     ) -> bool:
-        """Encode video with specified parameters"""
+        """
+        Rewrap a source into MP4 without re-encoding the video
+        
+        Audio is copied too unless copy_audio is False, in which case it
+        is converted to AAC like encode_video does. Progress is reported
+        like encode_video's.
+        """
         try:
-            # Build FFmpeg command
-            cmd = ["ffmpeg", "-i", input_file]
+            command = FFmpegEncoder.remux_command(
+                "pipe:0" if input_stream else input_file,
+                output_file,
+                copy_audio=copy_audio,
+                audio_bitrate=audio_bitrate,
+                fragmented=fragmented
+            )
+            parser = progress_parser(duration, progress_callback)
+            return await FFmpegEncoder._run(command, "Remux", parser.feed, input_stream)
             
-            # Video filters
-            filters = []
+        except Exception as e:
+            logger.error(f"Remux error: {e}")
+            return False
+    
+    @staticmethod
+    def ladder_command(
+        input_file: str,
+        renditions: List[Dict[str, Any]],
+        audio_bitrate: str = "128k",
+        codec: str = "libx264",
+        preset: str = "medium",
+        crf: int = 23,
+        watermark_text: str = None
+    ) -> FFmpegCommand:
+        """Build the encode_ladder command, each rendition's rate profile caps its CRF"""
+        count = len(renditions)
+        command = FFmpegCommand().progress()
+        command.add_input(input_file)
+        command.graph.chain(["0:v:0"], [Filter("split", count)], [f"s{i}" for i in range(count)])
+        
+        for i, rendition in enumerate(renditions):
+            chain = [Filter("scale", -2, rendition["height"])]
+            if watermark_text:
+                chain.append(Filter.parse(FFmpegEncoder._drawtext_filter(watermark_text)))
+            command.graph.chain([f"s{i}"], chain, [f"v{i}"])
+            
+            output = command.add_output(rendition["output_file"])
+            output.map(f"[v{i}]").map("0:a:0?")
+            apply_rate_control(output, codec, preset, crf, rendition.get("rate"))
+            output.audio_codec("aac", bitrate=audio_bitrate, sample_rate=48000)
+            output.set("-movflags", "+faststart")
+        return command
+    
+    @staticmethod
+    async def encode_ladder(
+        input_file: str,
+        renditions: List[Dict[str, Any]],
+        audio_bitrate: str = "128k",
+        codec: str = "libx264",
+        preset: str = "medium",
+        crf: int = 23,
+        watermark_text: str = None,
+        progress_callback: Optional[Callable[[ProgressSnapshot], Awaitable[None]]] = None,
+        duration: float = 0,
+        input_stream: Optional[GrowingFile] = None
+    ) -> List[str]:
+        """
+        Encode several renditions from a single decode of the input
+        
+        The source is decoded once and fanned out with a split filter to one
+        scale (and optional watermark) branch per rendition, each written to
+        its own output by the same ffmpeg process.
+        
+        Args:
+            input_file: Input video path
+            renditions: Dicts with "height", "rate" (RateProfile) and
+                "output_file"
+            progress_callback: Async callback receiving a ProgressSnapshot
+                every 5 seconds
+            duration: Input duration in seconds, used for percentage and ETA
+            input_stream: Download to pipe in while it is still being
+                written, input_file is ignored when set
+        
+        Returns:
+            list: Output files that were written successfully
+        """
+        if not renditions:
+            return []
+        
+        try:
+            command = FFmpegEncoder.ladder_command(
+                "pipe:0" if input_stream else input_file,
+                renditions,
+                audio_bitrate=audio_bitrate,
+                codec=codec,
+                preset=preset,
+                crf=crf,
+                watermark_text=watermark_text
+            )
+            
+            parser = progress_parser(duration, progress_callback, interval=5)
+            success = await FFmpegEncoder._run(command, "Ladder encoding", parser.feed, input_stream)
+            if not success:
+                return []
             
-            # Scale filter
-            if height:
-                filters.append(f"scale=-2:{height}")
-            elif width:
-                filters.append(f"scale={width}:-2")
+            return [
+                r["output_file"] for r in renditions
+                if os.path.exists(r["output_file"]) and os.path.getsize(r["output_file"]) > 0
+            ]
+            
+        except Exception as e:
+            logger.error(f"Ladder encoding error: {e}")
+            return []
+    
+    @staticmethod
+    def size_commands(
+        input_file: str,
+        output_file: str,
+        video_bitrate: int,
+        audio_bitrate: str = "128k",
+        codec: str = "libx264",
+        preset: str = "medium",
+        watermark_text: str = None,
+        passlog: str = None
+    ) -> List[FFmpegCommand]:
+        """
+        Build the commands of a target-size encode
+        
+        Codecs in TWO_PASS_CODECS get an analysis pass writing passlog and
+        a second pass spending the bits where the first found them needed.
+        Others get a single bitrate-targeted pass. Both cap peaks with a
+        VBV (-maxrate/-bufsize) so the file also streams smoothly.
+        """
+        bitrate = format_bitrate(video_bitrate)
+        maxrate = format_bitrate(int(video_bitrate * 1.5))
+        bufsize = format_bitrate(video_bitrate * 2)
+        two_pass = codec in TWO_PASS_CODECS and passlog
+        
+        commands = []
+        for number in ([1, 2] if two_pass else [None]):
+            first = number == 1
+            command = FFmpegCommand().progress()
+            command.add_input(input_file)
+            output = command.add_output("/dev/null" if first else output_file)
             
-            # Watermark text
             if watermark_text:
-                watermark_text = watermark_text.replace("'", "\\'")
-                filters.append(
-                    f"drawtext=text='{watermark_text}':"
-                    f"fontsize=24:fontcolor=white@0.8:"
-                    f"x=10:y=H-th-10:"
-                    f"box=1:boxcolor=black@0.5:boxborderw=5"
+                command.graph.chain(
+                    ["0:v:0"],
+                    [Filter.parse(FFmpegEncoder._drawtext_filter(watermark_text))],
+                    ["v"]
                 )
-            
-            # Watermark logo
-            if watermark_logo and os.path.exists(watermark_logo):
-                cmd.extend(["-i", watermark_logo])
-                filters.append("overlay=W-w-10:10")
-            
-            # Apply filters
-            if filters:
-                cmd.extend(["-vf", ",".join(filters)])
-            
-            # Video codec settings
-            cmd.extend([
-                "-c:v", codec,
-                "-preset", preset,
-                "-crf", str(crf),
-                "-b:v", video_bitrate
-            ])
-            
-            # Audio settings
-            cmd.extend([
-                "-c:a", "aac",
-                "-b:a", audio_bitrate,
-                "-ar", "48000"
-            ])
-            
-            # Output settings
-            cmd.extend([
-                "-y",  # Overwrite output file
-                "-movflags", "+faststart",  # Enable streaming
-                output_file
-            ])
-            
-            # Execute FFmpeg
-            process = subprocess.run(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
+                output.map("[v]")
+            else:
+                output.map("0:v:0")
+            
+            output.video_codec(codec, preset=preset, bitrate=bitrate, maxrate=maxrate, bufsize=bufsize)
+            if number:
+                output.set("-pass", number).set("-passlogfile", passlog)
+            if first:
+                # Only the video statistics matter, nothing is written
+                output.set("-an").set("-f", "null")
+            else:
+                output.map("0:a:0?")
+                output.audio_codec("aac", bitrate=audio_bitrate, sample_rate=48000)
+                output.set("-movflags", "+faststart")
+            commands.append(command)
+        return commands
+    
+    @staticmethod
+    async def encode_to_size(
+        input_file: str,
+        output_file: str,
+        video_bitrate: int,
+        audio_bitrate: str = "128k",
+        codec: str = "libx264",
+        preset: str = "medium",
+        watermark_text: str = None,
+        progress_callback: Optional[Callable[[int, int, ProgressSnapshot], Awaitable[None]]] = None,
+        duration: float = 0
+    ) -> bool:
+        """
+        Encode to an average video bitrate, two-pass where the codec allows
+        
+        Args:
+            video_bitrate: Average video bitrate in bits/s, see size_budget()
+            progress_callback: Async callback receiving the pass number,
+                the pass count and a ProgressSnapshot every 5 seconds
+            duration: Input duration in seconds, used for percentage and ETA
+        """
+        passlog = os.path.splitext(output_file)[0] + "_passlog"
+        try:
+            commands = FFmpegEncoder.size_commands(
+                input_file,
+                output_file,
+                video_bitrate,
+                audio_bitrate=audio_bitrate,
+                codec=codec,
+                preset=preset,
+                watermark_text=watermark_text,
+                passlog=passlog
             )
             
-            return process.returncode == 0
+            for number, command in enumerate(commands, 1):
+                async def on_progress(snapshot: ProgressSnapshot, number=number):
+                    if progress_callback:
+                        await progress_callback(number, len(commands), snapshot)
+                
+                parser = progress_parser(duration, on_progress, interval=5)
+                if not await FFmpegEncoder._run(command, f"Size encoding pass {number}", parser.feed):
+                    return False
+            return True
             
         except Exception as e:
-            logger.error(f"Encoding error: {e}")
+            logger.error(f"Size encoding error: {e}")
             return False
+        finally:
+            # x264 writes passlog-0.log and .mbtree, vpx passlog-0.log
+            for path in glob.glob(glob.escape(passlog) + "*"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    
+    @staticmethod
+    def sample_command(
+        input_file: str,
+        output_file: str,
+        start: float,
+        length: float,
+        height: int = None,
+        codec: str = "libx264",
+        preset: str = "medium",
+        crf: int = 23,
+        rate: Optional[RateProfile] = None
+    ) -> FFmpegCommand:
+        """Encode one analysis window of the source like the real encode would"""
+        command = FFmpegCommand()
+        command.add_input(input_file).set("-ss", f"{start:.3f}").set("-t", f"{length:g}")
+        command.graph.chain(["0:v:0"], [Filter("scale", -2, height) if height else Filter("null")], ["v"])
+        output = command.add_output(output_file)
+        output.map("[v]")
+        apply_rate_control(output, codec, preset, crf, rate)
+        output.set("-an")
+        return command
+    
+    @staticmethod
+    def quality_command(
+        sample_file: str,
+        input_file: str,
+        start: float,
+        length: float,
+        height: int = None
+    ) -> FFmpegCommand:
+        """Compare an encoded window with the same window of the source (SSIM and PSNR)"""
+        command = FFmpegCommand()
+        command.add_input(sample_file)
+        command.add_input(input_file).set("-ss", f"{start:.3f}").set("-t", f"{length:g}")
+        
+        # Both sides in the same size, pixel format and timeline
+        common = [Filter("format", "yuv420p"), Filter("setpts", "PTS-STARTPTS"), Filter("split")]
+        reference = [Filter("scale", -2, height)] if height else []
+        command.graph.chain(["0:v:0"], common, ["e1", "e2"])
+        command.graph.chain(["1:v:0"], reference + common, ["r1", "r2"])
+        command.graph.chain(["e1", "r1"], [Filter("ssim")], ["s"])
+        command.graph.chain(["e2", "r2"], [Filter("psnr")], ["p"])
+        
+        output = command.add_output("-")
+        output.map("[s]").map("[p]").set("-f", "null")
+        return command
+    
+    @staticmethod
+    async def measure_quality(
+        sample_file: str,
+        input_file: str,
+        start: float,
+        length: float,
+        height: int = None
+    ) -> tuple:
+        """SSIM (0-1) and PSNR (dB) of an encoded window against the source"""
+        command = FFmpegEncoder.quality_command(sample_file, input_file, start, length, height)
+        result = await supervisor.run(command.args(), timeout=Config.FFMPEG_TIMEOUT or None)
+        if not result.ok:
+            raise RuntimeError(f"Quality measurement failed: {result.stderr_text[-500:]}")
+        
+        # The filters log their summary when the graph is closed
+        ssim = re.search(r"SSIM .*All:([\d.]+)", result.stderr_text)
+        psnr = re.search(r"PSNR .*average:([\d.]+|inf)", result.stderr_text)
+        if not ssim or not psnr:
+            raise RuntimeError("Quality measurement printed no SSIM/PSNR")
+        return float(ssim.group(1)), float(psnr.group(1))
     
     @staticmethod
     async def trim_video(
@@ -119,18 +522,11 @@ class FFmpegEncoder:
     ) -> bool:
         """Trim video"""
         try:
-            cmd = [
-                "ffmpeg",
-                "-i", input_file,
-                "-ss", start_time,
-                "-to", end_time,
-                "-c", "copy",
-                "-y",
-                output_file
-            ]
+            command = FFmpegCommand()
+            command.add_input(input_file)
+            command.add_output(output_file).set("-ss", start_time).set("-to", end_time).set("-c", "copy")
             
-            process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            return process.returncode == 0
+            return await FFmpegEncoder._run(command, "Trim")
             
         except Exception as e:
             logger.error(f"Trim error: {e}")
@@ -156,17 +552,14 @@ class FFmpegEncoder:
             if aspect_ratio not in crop_filters:
                 return False
             
-            cmd = [
-                "ffmpeg",
-                "-i", input_file,
-                "-vf", crop_filters[aspect_ratio],
-                "-c:a", "copy",
-                "-y",
-                output_file
-            ]
+            command = FFmpegCommand()
+            command.add_input(input_file)
+            command.graph.chain(["0:v:0"], [Filter.parse(crop_filters[aspect_ratio])], ["v"])
+            output = command.add_output(output_file)
+            output.map("[v]").map("0:a:0?")
+            output.audio_codec("copy")
             
-            process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            return process.returncode == 0
+            return await FFmpegEncoder._run(command, "Crop")
             
         except Exception as e:
             logger.error(f"Crop error: {e}")
@@ -179,29 +572,22 @@ class FFmpegEncoder:
     ) -> bool:
         """Merge multiple videos"""
         try:
-            # Create concat file
-            concat_file = "concat_list.txt"
+            # Create concat file next to the output so concurrent merges don't collide
+            concat_file = os.path.splitext(output_file)[0] + "_concat.txt"
             with open(concat_file, "w") as f:
                 for file in input_files:
                     f.write(f"file '{file}'\n")
             
-            cmd = [
-                "ffmpeg",
-                "-f", "concat",
-                "-safe", "0",
-                "-i", concat_file,
-                "-c", "copy",
-                "-y",
-                output_file
-            ]
-            
-            process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            
-            # Cleanup
-            if os.path.exists(concat_file):
-                os.remove(concat_file)
+            command = FFmpegCommand()
+            command.add_input(concat_file).set("-f", "concat").set("-safe", 0)
+            command.add_output(output_file).set("-c", "copy")
             
-            return process.returncode == 0
+            try:
+                return await FFmpegEncoder._run(command, "Merge")
+            finally:
+                # Cleanup
+                if os.path.exists(concat_file):
+                    os.remove(concat_file)
             
         except Exception as e:
             logger.error(f"Merge error: {e}")
@@ -216,30 +602,20 @@ class FFmpegEncoder:
     ) -> bool:
         """Add subtitle to video"""
         try:
+            command = FFmpegCommand()
+            command.add_input(input_file)
+            output = command.add_output(output_file)
             if hard_sub:
                 # Hard subtitle (burned in)
-                cmd = [
-                    "ffmpeg",
-                    "-i", input_file,
-                    "-vf", f"subtitles={subtitle_file}",
-                    "-c:a", "copy",
-                    "-y",
-                    output_file
-                ]
+                command.graph.chain(["0:v:0"], [Filter("subtitles", subtitle_file)], ["v"])
+                output.map("[v]").map("0:a:0?")
+                output.audio_codec("copy")
             else:
                 # Soft subtitle (embedded)
-                cmd = [
-                    "ffmpeg",
-                    "-i", input_file,
-                    "-i", subtitle_file,
-                    "-c", "copy",
-                    "-c:s", "mov_text",
-                    "-y",
-                    output_file
-                ]
-            
-            process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            return process.returncode == 0
+                command.add_input(subtitle_file)
+                output.set("-c", "copy").set("-c:s", "mov_text")
+            
+            return await FFmpegEncoder._run(command, "Subtitle")
             
         except Exception as e:
             logger.error(f"Subtitle error: {e}")
@@ -253,17 +629,13 @@ class FFmpegEncoder:
     ) -> bool:
         """Extract audio from video"""
         try:
-            cmd = [
-                "ffmpeg",
-                "-i", input_file,
-                "-vn",  # No video
-                "-acodec", "libmp3lame" if format == "mp3" else "copy",
-                "-y",
-                output_file
-            ]
+            command = FFmpegCommand()
+            command.add_input(input_file)
+            output = command.add_output(output_file)
+            output.set("-vn")  # No video
+            output.audio_codec("libmp3lame" if format == "mp3" else "copy")
             
-            process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            return process.returncode == 0
+            return await FFmpegEncoder._run(command, "Extract audio")
             
         except Exception as e:
             logger.error(f"Extract audio error: {e}")
@@ -276,16 +648,11 @@ class FFmpegEncoder:
     ) -> bool:
         """Extract subtitle from video"""
         try:
-            cmd = [
-                "ffmpeg",
-                "-i", input_file,
-                "-map", "0:s:0",
-                "-y",
-                output_file
-            ]
+            command = FFmpegCommand()
+            command.add_input(input_file)
+            command.add_output(output_file).map("0:s:0")
             
-            process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            return process.returncode == 0
+            return await FFmpegEncoder._run(command, "Extract subtitle")
             
         except Exception as e:
             logger.error(f"Extract subtitle error: {e}")
@@ -299,17 +666,11 @@ class FFmpegEncoder:
     ) -> bool:
         """Extract thumbnail from video"""
         try:
-            cmd = [
-                "ffmpeg",
-                "-i", input_file,
-                "-ss", timestamp,
-                "-vframes", "1",
-                "-y",
-                output_file
-            ]
+            command = FFmpegCommand()
+            command.add_input(input_file)
+            command.add_output(output_file).set("-ss", timestamp).set("-vframes", 1)
             
-            process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            return process.returncode == 0
+            return await FFmpegEncoder._run(command, "Extract thumbnail")
             
         except Exception as e:
             logger.error(f"Extract thumbnail error: {e}")
@@ -323,21 +684,16 @@ class FFmpegEncoder:
     ) -> bool:
         """Add audio to video"""
         try:
-            cmd = [
-                "ffmpeg",
-                "-i", video_file,
-                "-i", audio_file,
-                "-c:v", "copy",
-                "-c:a", "aac",
-                "-map", "0:v:0",
-                "-map", "1:a:0",
-                "-shortest",
-                "-y",
-                output_file
-            ]
+            command = FFmpegCommand()
+            command.add_input(video_file)
+            command.add_input(audio_file)
+            output = command.add_output(output_file)
+            output.map("0:v:0").map("1:a:0")
+            output.set("-c:v", "copy")
+            output.audio_codec("aac")
+            output.set("-shortest")
             
-            process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            return process.returncode == 0
+            return await FFmpegEncoder._run(command, "Add audio")
             
         except Exception as e:
             logger.error(f"Add audio error: {e}")
@@ -350,17 +706,11 @@ class FFmpegEncoder:
     ) -> bool:
         """Remove audio from video"""
         try:
-            cmd = [
-                "ffmpeg",
-                "-i", input_file,
-                "-c:v", "copy",
-                "-an",  # No audio
-                "-y",
-                output_file
-            ]
+            command = FFmpegCommand()
+            command.add_input(input_file)
+            command.add_output(output_file).set("-c:v", "copy").set("-an")  # No audio
             
-            process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            return process.returncode == 0
+            return await FFmpegEncoder._run(command, "Remove audio")
             
         except Exception as e:
             logger.error(f"Remove audio error: {e}")
@@ -373,17 +723,11 @@ class FFmpegEncoder:
     ) -> bool:
         """Remove all subtitles from video"""
         try:
-            cmd = [
-                "ffmpeg",
-                "-i", input_file,
-                "-c", "copy",
-                "-sn",  # No subtitle
-                "-y",
-                output_file
-            ]
+            command = FFmpegCommand()
+            command.add_input(input_file)
+            command.add_output(output_file).set("-c", "copy").set("-sn")  # No subtitle
             
-            process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            return process.returncode == 0
+            return await FFmpegEncoder._run(command, "Remove subtitle")
             
         except Exception as e:
             logger.error(f"Remove subtitle error: {e}")
@@ -401,8 +745,8 @@ class FFmpegEncoder:
                 file_path
             ]
             
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            return float(result.stdout.strip())
+            stdout = await FFmpegEncoder._probe(cmd)
+            return float(stdout.strip())
             
         except Exception as e:
             logger.error(f"Get duration error: {e}")
@@ -421,8 +765,8 @@ class FFmpegEncoder:
                 file_path
             ]
             
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            width, height = result.stdout.strip().split('x')
+            stdout = await FFmpegEncoder._probe(cmd)
+            width, height = stdout.strip().split('x')
             return int(width), int(height)
             
         except Exception as e:
@@ -449,19 +793,16 @@ class FFmpegEncoder:
             
             overlay_pos = positions.get(position, "W-w-10:H-h-10")
             
-            cmd = [
-                "ffmpeg",
-                "-i", input_file,
-                "-i", watermark_file,
-                "-filter_complex",
-                f"[1:v]scale=iw*0.2:-1[wm];[0:v][wm]overlay={overlay_pos}",
-                "-c:a", "copy",
-                "-y",
-                output_file
-            ]
+            command = FFmpegCommand()
+            command.add_input(input_file)
+            command.add_input(watermark_file)
+            command.graph.chain(["1:v:0"], [Filter("scale", "iw*0.2", -1)], ["wm"])
+            command.graph.chain(["0:v:0", "wm"], [Filter("overlay", overlay_pos)], ["v"])
+            output = command.add_output(output_file)
+            output.map("[v]").map("0:a:0?")
+            output.audio_codec("copy")
             
-            process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            return process.returncode == 0
+            return await FFmpegEncoder._run(command, "Add watermark logo")
             
         except Exception as e:
             logger.error(f"Add watermark logo error: {e}")
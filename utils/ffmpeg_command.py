@@ -0,0 +1,361 @@
+import re
+import shlex
+import hashlib
+from typing import List, Optional, Tuple, Union
+
+# Filters that take more than one input pad, with how many they need
+MULTI_INPUT_FILTERS = {
+    "overlay": 2,
+    "scale2ref": 2,
+    "ssim": 2,
+    "psnr": 2,
+    "amix": None,
+    "hstack": None,
+    "vstack": None,
+    "concat": None
+}
+
+# Options that belong to exactly one rate-control mode
+RATE_CONTROL_CONFLICTS = [
+    ("-crf", "-b:v", "-crf is constant quality and -b:v a target bitrate; cap CRF with -maxrate/-bufsize instead"),
+    ("-crf", "-qp", "-crf and -qp are both quality targets")
+]
+
+# Encoders where -b:v next to -crf caps the bitrate (constrained quality)
+CONSTRAINED_QUALITY_CODECS = {"libvpx-vp9", "libaom-av1"}
+
+# "0:v:0", "1:a:0?", "0"
+STREAM_SPEC = re.compile(r"^(\d+)(:[vasdt](:\d+)?)?\??$")
+
+
+class CommandError(ValueError):
+    """An ffmpeg command that can't work, raised before anything is run"""
+
+
+def parse_bitrate(value: Union[str, int]) -> int:
+    """'2M' / '512k' / '128000' -> bits per second"""
+    value = str(value).strip().lower()
+    multiplier = 1
+    if value.endswith("m"):
+        multiplier, value = 1_000_000, value[:-1]
+    elif value.endswith("k"):
+        multiplier, value = 1000, value[:-1]
+    try:
+        return int(float(value) * multiplier)
+    except ValueError:
+        return 0
+
+
+def format_bitrate(bits: int) -> str:
+    """bits per second -> '2000k'"""
+    return f"{max(bits // 1000, 1)}k"
+
+
+def split_chain(chain: str) -> List[str]:
+    """Split a filter chain on commas that aren't quoted or escaped"""
+    parts, current, quoted, escaped = [], [], False, False
+    for char in chain:
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == "'":
+            quoted = not quoted
+        elif char == "," and not quoted:
+            parts.append("".join(current).strip())
+            current = []
+            continue
+        current.append(char)
+    parts.append("".join(current).strip())
+    return parts
+
+
+class Filter:
+    """
+    One filter of a filtergraph
+
+    Filter("scale", -2, 720) -> scale=-2:720
+    Filter("crop", w="iw/2", h="ih") -> crop=w=iw/2:h=ih
+    Values are used as given, quote anything containing ,;[] yourself.
+    """
+
+    def __init__(self, name: str, *args, **options):
+        if not re.match(r"^[a-z0-9_]+$", name):
+            raise CommandError(f"Invalid filter name: {name!r}")
+        self.name = name
+        self.args = [str(a) for a in args]
+        self.options = {k: str(v) for k, v in options.items()}
+
+    @classmethod
+    def parse(cls, text: str) -> "Filter":
+        """Wrap an already formatted filter such as a drawtext string"""
+        name, _, arguments = text.partition("=")
+        node = cls(name)
+        node.args = [arguments] if arguments else []
+        return node
+
+    @property
+    def input_count(self) -> Optional[int]:
+        """Pads the filter needs, None for a variable number, 1 for simple filters"""
+        return MULTI_INPUT_FILTERS.get(self.name, 1)
+
+    def __str__(self) -> str:
+        parts = self.args + [f"{k}={v}" for k, v in self.options.items()]
+        return f"{self.name}={':'.join(parts)}" if parts else self.name
+
+
+class FilterGraph:
+    """Filter chains connected by [labels], rendered for -filter_complex"""
+
+    def __init__(self):
+        self.chains: List[Tuple[List[str], List[Filter], List[str]]] = []
+
+    def chain(self, inputs: List[str], filters: List[Filter], outputs: List[str]) -> "FilterGraph":
+        """
+        Add a chain
+
+        Args:
+            inputs: Input stream specifiers ("0:v:0") or labels of earlier
+                chains' outputs
+            filters: Filters applied in order
+            outputs: Labels for the chain's output pads
+        """
+        self.chains.append((list(inputs), list(filters), list(outputs)))
+        return self
+
+    def validate(self, input_count: int) -> List[str]:
+        """Check pads and labels, returns the labels left for -map"""
+        produced = {}
+        for _, _, outputs in self.chains:
+            for label in outputs:
+                if label in produced:
+                    raise CommandError(f"Filter label [{label}] is defined twice")
+                produced[label] = False
+
+        for inputs, filters, outputs in self.chains:
+            if not filters:
+                raise CommandError("Empty filter chain")
+            if not outputs:
+                raise CommandError(f"Chain {filters[0].name} has no output label")
+
+            needed = filters[0].input_count
+            if needed is not None and len(inputs) != needed:
+                raise CommandError(
+                    f"{filters[0].name} takes {needed} input(s), got {len(inputs)}"
+                )
+            for node in filters[1:]:
+                if node.input_count != 1:
+                    raise CommandError(
+                        f"{node.name} needs several inputs and must start its own chain"
+                    )
+
+            for spec in inputs:
+                if spec in produced:
+                    if produced[spec]:
+                        raise CommandError(f"Filter label [{spec}] is used twice, split it first")
+                    produced[spec] = True
+                    continue
+                match = STREAM_SPEC.match(spec)
+                if not match:
+                    raise CommandError(f"Unknown filter input [{spec}]")
+                if int(match.group(1)) >= input_count:
+                    raise CommandError(f"Filter input [{spec}] refers to a missing input")
+
+        return [label for label, used in produced.items() if not used]
+
+    def __str__(self) -> str:
+        return ";".join(
+            "".join(f"[{i}]" for i in inputs)
+            + ",".join(str(f) for f in filters)
+            + "".join(f"[{o}]" for o in outputs)
+            for inputs, filters, outputs in self.chains
+        )
+
+
+class Input:
+    """A source file with the options placed before its -i"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.options: List[Tuple[str, str]] = []
+
+    def set(self, flag: str, value) -> "Input":
+        self.options.append((flag, str(value)))
+        return self
+
+
+class Output:
+    """An output file with its stream maps and options"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.maps: List[str] = []
+        self.options: List[Tuple[str, Optional[str]]] = []
+
+    def map(self, spec: str) -> "Output":
+        """Map a stream specifier ("0:a:0?") or a graph label ("[v]")"""
+        self.maps.append(spec)
+        return self
+
+    def set(self, flag: str, value=None) -> "Output":
+        self.options.append((flag, None if value is None else str(value)))
+        return self
+
+    def get(self, flag: str) -> Optional[str]:
+        for name, value in self.options:
+            if name == flag:
+                return value
+        return None
+
+    def video_codec(
+        self,
+        codec: str,
+        preset: Optional[str] = None,
+        crf: Optional[int] = None,
+        bitrate: Optional[str] = None,
+        maxrate: Optional[str] = None,
+        bufsize: Optional[str] = None
+    ) -> "Output":
+        """Video encoder settings; with crf, maxrate/bufsize cap it (capped CRF)"""
+        self.set("-c:v", codec)
+        if preset:
+            self.set("-preset", preset)
+        if crf is not None:
+            self.set("-crf", crf)
+        if bitrate:
+            self.set("-b:v", bitrate)
+        if maxrate:
+            self.set("-maxrate", maxrate)
+            self.set("-bufsize", bufsize or format_bitrate(parse_bitrate(maxrate) * 2))
+        return self
+
+    def audio_codec(self, codec: str, bitrate: Optional[str] = None, sample_rate: Optional[int] = None) -> "Output":
+        self.set("-c:a", codec)
+        if bitrate and codec != "copy":
+            self.set("-b:a", bitrate)
+        if sample_rate and codec != "copy":
+            self.set("-ar", sample_rate)
+        return self
+
+    def validate(self, input_count: int, labels: List[str]):
+        flags = [name for name, _ in self.options]
+        for first, second, reason in RATE_CONTROL_CONFLICTS:
+            if (first, second) == ("-crf", "-b:v") and self.get("-c:v") in CONSTRAINED_QUALITY_CODECS:
+                continue
+            if first in flags and second in flags:
+                raise CommandError(reason)
+        if "-maxrate" in flags and "-bufsize" not in flags:
+            raise CommandError("-maxrate needs -bufsize")
+        if "-vf" in flags or "-filter:v" in flags:
+            chain = self.get("-vf") or self.get("-filter:v") or ""
+            for text in split_chain(chain):
+                if Filter.parse(text).input_count != 1:
+                    raise CommandError(
+                        f"{text} needs a second input, use a filtergraph instead of -vf"
+                    )
+
+        for spec in self.maps:
+            if spec.startswith("["):
+                if spec.strip("[]") not in labels:
+                    raise CommandError(f"-map {spec} is not a filtergraph output")
+                continue
+            match = STREAM_SPEC.match(spec)
+            if not match or int(match.group(1)) >= input_count:
+                raise CommandError(f"-map {spec} refers to a missing input")
+
+
+class FFmpegCommand:
+    """
+    An ffmpeg invocation built from inputs, a filtergraph and outputs
+
+    validate() checks the things ffmpeg would only complain about after
+    the download (dangling or reused labels, filters missing an input,
+    conflicting rate control, maps to nothing). canonical() renders the
+    command with the file paths replaced by placeholders so identical
+    jobs on different files compare and hash the same.
+    """
+
+    def __init__(self, overwrite: bool = True):
+        self.overwrite = overwrite
+        self.global_options: List[str] = []
+        self.inputs: List[Input] = []
+        self.graph = FilterGraph()
+        self.outputs: List[Output] = []
+
+    def add_input(self, path: str) -> Input:
+        source = Input(path)
+        self.inputs.append(source)
+        return source
+
+    def index(self, source: Input) -> int:
+        return self.inputs.index(source)
+
+    def add_output(self, path: str) -> Output:
+        output = Output(path)
+        self.outputs.append(output)
+        return output
+
+    def progress(self) -> "FFmpegCommand":
+        """Machine readable progress on stdout, see ProgressParser"""
+        self.global_options.extend(["-progress", "pipe:1", "-nostats"])
+        return self
+
+    def validate(self) -> "FFmpegCommand":
+        if not self.inputs:
+            raise CommandError("No input")
+        if not self.outputs:
+            raise CommandError("No output")
+
+        unused = self.graph.validate(len(self.inputs))
+        mapped = {spec.strip("[]") for output in self.outputs for spec in output.maps if spec.startswith("[")}
+        for label in unused:
+            if label not in mapped:
+                raise CommandError(f"Filtergraph output [{label}] is never mapped")
+        for output in self.outputs:
+            output.validate(len(self.inputs), unused)
+        return self
+
+    def _render(self, input_paths: List[str], output_paths: List[str]) -> List[str]:
+        args = ["ffmpeg"] + list(self.global_options)
+        for source, path in zip(self.inputs, input_paths):
+            for flag, value in source.options:
+                args.extend([flag, value])
+            args.extend(["-i", path])
+        if self.graph.chains:
+            args.extend(["-filter_complex", str(self.graph)])
+        for output, path in zip(self.outputs, output_paths):
+            for spec in output.maps:
+                args.extend(["-map", spec])
+            for flag, value in output.options:
+                args.append(flag)
+                if value is not None:
+                    args.append(value)
+            if self.overwrite:
+                args.append("-y")
+            args.append(path)
+        return args
+
+    def args(self) -> List[str]:
+        """Validated argument list for supervisor.run"""
+        self.validate()
+        return self._render([i.path for i in self.inputs], [o.path for o in self.outputs])
+
+    def canonical(self) -> str:
+        """The command with paths replaced by {in0}, {out0}, ..."""
+        return shlex.join(self._render(
+            [f"{{in{i}}}" for i in range(len(self.inputs))],
+            [f"{{out{i}}}" for i in range(len(self.outputs))]
+        ))
+
+    def key(self) -> str:
+        """Hash of canonical(), for result caching and dedup"""
+        return hashlib.sha256(self.canonical().encode()).hexdigest()
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, FFmpegCommand) and self.canonical() == other.canonical()
+
+    def __hash__(self) -> int:
+        return hash(self.canonical())
+
+    def __str__(self) -> str:
+        return shlex.join(self._render([i.path for i in self.inputs], [o.path for o in self.outputs]))
@@ -0,0 +1,210 @@
+import time
+import logging
+from typing import Awaitable, Callable, List, Optional
+from utils.jobs import report_progress
+
+logger = logging.getLogger(__name__)
+
+# How often the job record is updated with the latest snapshot
+JOB_PROGRESS_INTERVAL = 10
+
+
+def _number(value: Optional[str], suffix: str = "") -> float:
+    """Parse a -progress value such as '1234.5kbits/s' or '1.02x' (N/A -> 0)"""
+    if not value:
+        return 0.0
+    value = value.strip()
+    if suffix and value.endswith(suffix):
+        value = value[:-len(suffix)]
+    try:
+        return float(value)
+    except ValueError:
+        return 0.0
+
+
+class ProgressSnapshot:
+    """One block of ffmpeg -progress output"""
+
+    def __init__(
+        self,
+        out_time: float = 0.0,
+        duration: float = 0.0,
+        frame: int = 0,
+        fps: float = 0.0,
+        speed: float = 0.0,
+        bitrate: float = 0.0,
+        total_size: int = 0,
+        dup_frames: int = 0,
+        drop_frames: int = 0,
+        finished: bool = False
+    ):
+        self.out_time = out_time          # seconds of output written
+        self.duration = duration          # seconds of input, 0 if unknown
+        self.frame = frame
+        self.fps = fps
+        self.speed = speed                # multiple of realtime
+        self.bitrate = bitrate            # kbit/s
+        self.total_size = total_size      # bytes
+        self.dup_frames = dup_frames
+        self.drop_frames = drop_frames
+        self.finished = finished
+
+    @property
+    def percentage(self) -> float:
+        if self.finished:
+            return 100.0
+        if not self.duration:
+            return 0.0
+        return min(self.out_time / self.duration * 100, 100.0)
+
+    @property
+    def eta(self) -> float:
+        """Seconds left at the current encode speed"""
+        if not self.duration or self.speed <= 0:
+            return 0.0
+        return max(self.duration - self.out_time, 0.0) / self.speed
+
+    def to_dict(self) -> dict:
+        return {
+            "out_time": self.out_time,
+            "duration": self.duration,
+            "percentage": round(self.percentage, 1),
+            "fps": self.fps,
+            "speed": self.speed,
+            "bitrate": self.bitrate,
+            "total_size": self.total_size,
+            "eta": round(self.eta),
+            "dup_frames": self.dup_frames,
+            "drop_frames": self.drop_frames
+        }
+
+    @classmethod
+    def combine(cls, snapshots: List["ProgressSnapshot"], duration: float) -> "ProgressSnapshot":
+        """Merge snapshots of processes encoding parts of one input in parallel"""
+        out_time = sum(s.out_time for s in snapshots)
+        total_size = sum(s.total_size for s in snapshots)
+        return cls(
+            out_time=out_time,
+            duration=duration,
+            frame=sum(s.frame for s in snapshots),
+            fps=sum(s.fps for s in snapshots if not s.finished),
+            speed=sum(s.speed for s in snapshots if not s.finished),
+            bitrate=(total_size * 8 / 1000 / out_time) if out_time else 0.0,
+            total_size=total_size,
+            dup_frames=sum(s.dup_frames for s in snapshots),
+            drop_frames=sum(s.drop_frames for s in snapshots),
+            finished=bool(snapshots) and all(s.finished for s in snapshots)
+        )
+
+
+class ProgressParser:
+    """
+    Streaming parser for `ffmpeg -progress pipe:1` output
+
+    Feed it stdout lines (it can be passed straight to
+    supervisor.run(on_stdout_line=...)). Every key=value block ending in
+    progress=continue/end becomes a ProgressSnapshot, which is published to
+    the subscribers no more often than each one's interval; the final
+    snapshot is always delivered.
+    """
+
+    def __init__(self, duration: float = 0):
+        self.duration = duration
+        self.fields = {}
+        self.latest = ProgressSnapshot(duration=duration)
+        self.subscribers = []
+
+    def subscribe(self, callback: Callable[[ProgressSnapshot], Awaitable[None]], interval: float = 3):
+        """Call `callback(snapshot)` at most once every `interval` seconds"""
+        self.subscribers.append([callback, interval, 0.0])
+
+    async def feed(self, line: str):
+        key, sep, value = line.partition("=")
+        if not sep:
+            return
+        key = key.strip()
+        if key != "progress":
+            self.fields[key] = value.strip()
+            return
+        self.latest = self._snapshot(finished=value.strip() == "end")
+        self.fields = {}
+        await self.publish(self.latest)
+
+    def _snapshot(self, finished: bool) -> ProgressSnapshot:
+        fields = self.fields
+        out_time_us = fields.get("out_time_us", "")
+        return ProgressSnapshot(
+            out_time=int(out_time_us) / 1_000_000 if out_time_us.isdigit() else self.latest.out_time,
+            duration=self.duration,
+            frame=int(_number(fields.get("frame"))) or self.latest.frame,
+            fps=_number(fields.get("fps")),
+            speed=_number(fields.get("speed"), "x"),
+            bitrate=_number(fields.get("bitrate"), "kbits/s"),
+            total_size=int(_number(fields.get("total_size"))) or self.latest.total_size,
+            dup_frames=int(_number(fields.get("dup_frames"))),
+            drop_frames=int(_number(fields.get("drop_frames"))),
+            finished=finished
+        )
+
+    async def publish(self, snapshot: ProgressSnapshot):
+        """Deliver a snapshot to every subscriber whose interval has passed"""
+        now = time.monotonic()
+        for subscriber in self.subscribers:
+            callback, interval, last = subscriber
+            if not snapshot.finished and now - last < interval:
+                continue
+            subscriber[2] = now
+            try:
+                await callback(snapshot)
+            except Exception as e:
+                logger.error(f"Progress subscriber error: {e}")
+
+
+class EncodeMetrics:
+    """Totals over finished ffmpeg runs, fed by every progress_parser()"""
+
+    def __init__(self):
+        self.runs = 0
+        self.encoded_seconds = 0.0
+        self.speed_total = 0.0
+        self.dup_frames = 0
+        self.drop_frames = 0
+
+    async def record(self, snapshot: ProgressSnapshot):
+        """Progress subscriber; only the final snapshot of a run counts"""
+        if not snapshot.finished:
+            return
+        self.runs += 1
+        self.encoded_seconds += snapshot.out_time
+        self.speed_total += snapshot.speed
+        self.dup_frames += snapshot.dup_frames
+        self.drop_frames += snapshot.drop_frames
+
+    def stats(self) -> dict:
+        """Encode throughput"""
+        return {
+            "runs": self.runs,
+            "encoded_seconds": self.encoded_seconds,
+            "average_speed": (self.speed_total / self.runs) if self.runs else 0.0,
+            "dup_frames": self.dup_frames,
+            "drop_frames": self.drop_frames
+        }
+
+
+# Shared metrics for every ffmpeg run with progress output
+encode_metrics = EncodeMetrics()
+
+
+def progress_parser(
+    duration: float = 0,
+    callback: Optional[Callable[[ProgressSnapshot], Awaitable[None]]] = None,
+    interval: float = 3
+) -> ProgressParser:
+    """Parser wired to a display callback, the current job's record and the metrics"""
+    parser = ProgressParser(duration)
+    if callback:
+        parser.subscribe(callback, interval)
+    parser.subscribe(report_progress, JOB_PROGRESS_INTERVAL)
+    # Throttling never drops the final snapshot, which is all it needs
+    parser.subscribe(encode_metrics.record, JOB_PROGRESS_INTERVAL)
+    return parser
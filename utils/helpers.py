@@ -1,6 +1,8 @@
 import os
 import time
 import math
+import json
+import hashlib
 from typing import Union
 
 def human_readable_size(size_bytes: int) -> str:
@@ -43,6 +45,23 @@ def clean_filename(filename: str) -> str:
         filename = filename.replace(char, '_')
     return filename
 
+def get_output_path(user_id: int, source_path: str, suffix: str) -> str:
+    """Build a per-user output path for a processed source file"""
+    output_dir = f"./downloads/{user_id}/"
+    os.makedirs(output_dir, exist_ok=True)
+    base_name = os.path.splitext(os.path.basename(source_path))[0]
+    return os.path.join(output_dir, base_name + suffix)
+
+def get_job_hash(file_unique_id: str, params: dict) -> str:
+    """Canonical hash of a job's source file and parameters"""
+    payload = json.dumps(
+        {"source": file_unique_id, **params},
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
 def get_file_extension(filename: str) -> str:
     """Get file extension"""
     return os.path.splitext(filename)[1].lower()
@@ -75,6 +94,18 @@ def parse_time(time_str: str) -> int:
     except:
         return 0
 
+def parse_size(size_str: str) -> int:
+    """Parse a size such as 50MB, 1.5GB or 700KB to bytes (0 if invalid)"""
+    units = {"KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    size_str = size_str.strip().upper()
+    try:
+        for unit in sorted(units, key=len, reverse=True):
+            if size_str.endswith(unit):
+                return int(float(size_str[:-len(unit)]) * units[unit])
+        return int(size_str)
+    except ValueError:
+        return 0
+
 def format_seconds_to_time(seconds: int) -> str:
     """Format seconds to HH:MM:SS"""
     hours = seconds // 3600
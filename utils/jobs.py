@@ -0,0 +1,320 @@
+import os
+import time
+import string
+import secrets
+import asyncio
+import logging
+import contextvars
+from datetime import datetime
+from typing import Callable, Coroutine, List, Optional
+
+logger = logging.getLogger(__name__)
+
+JOB_ID_ALPHABET = string.ascii_letters + string.digits
+
+# Stages in the order a job goes through them
+STAGES = ["queued", "downloading", "encoding", "uploading"]
+
+# A job that keeps getting interrupted (e.g. it OOMs the bot) is failed
+MAX_RESUMES = 2
+
+# Job being run by the current task, see set_stage()
+current_job = contextvars.ContextVar("current_job", default=None)
+
+
+class Job:
+    """A heavy handler running in the background"""
+
+    def __init__(
+        self,
+        task_id: str,
+        user_id: int,
+        kind: str,
+        task_type: str,
+        chat_id: int,
+        message_id: int,
+        command: Optional[List[str]] = None
+    ):
+        self.task_id = task_id
+        self.user_id = user_id
+        self.kind = kind
+        self.task_type = task_type
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.command = command
+        self.start_time = time.time()
+        self.added_time = datetime.now()
+        self.stage = "queued"
+        self.premium = False
+        self.artifacts = {}
+        self.progress = None
+        self.attempts = 0
+        self.resumed_stage = None
+        self.client = None
+        self.task = None
+
+    def to_doc(self) -> dict:
+        """Queue collection document"""
+        return {
+            "_id": self.task_id,
+            "user_id": self.user_id,
+            "kind": self.kind,
+            "task_type": self.task_type,
+            "chat_id": self.chat_id,
+            "message_id": self.message_id,
+            "command": self.command,
+            "status": "pending" if self.stage == "queued" else "running",
+            "stage": self.stage,
+            "premium": self.premium,
+            "artifacts": self.artifacts,
+            "progress": self.progress.to_dict() if self.progress else None,
+            "attempts": self.attempts,
+            "added_time": self.added_time,
+            "updated_time": datetime.now()
+        }
+
+    @classmethod
+    def from_doc(cls, doc: dict) -> "Job":
+        job = cls(
+            doc["_id"],
+            doc["user_id"],
+            doc["kind"],
+            doc.get("task_type", doc["kind"]),
+            doc["chat_id"],
+            doc["message_id"],
+            doc.get("command")
+        )
+        job.added_time = doc.get("added_time", job.added_time)
+        job.premium = doc.get("premium", False)
+        job.artifacts = doc.get("artifacts") or {}
+        job.attempts = doc.get("attempts", 0) + 1
+        job.resumed_stage = doc.get("stage", "queued")
+        job.stage = "queued"
+        return job
+
+
+class JobRunner:
+    """
+    Run heavy handlers as background tasks
+
+    Pyrogram only has Config.WORKERS handler workers. A handler that awaits
+    a whole download -> encode -> upload chain keeps its worker busy for
+    minutes, so a few encodes are enough to stall /tasks, /stop and
+    callbacks. Handlers submit the chain here and return immediately; the
+    job then waits for a slot in the scheduler on its own task.
+
+    Every job is written to the queue collection with its stage and
+    artifact paths. Jobs left unfinished by a restart or crash are resumed
+    on startup; downloads survive in the source cache and an encode that
+    finished before the restart is uploaded without re-encoding.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self.handlers = {}
+        self.shutting_down = False
+
+    def register(self, kind: str, handler: Callable):
+        """Make a handler available to submit() and to resume()"""
+        self.handlers[kind] = handler
+
+    def _new_id(self) -> str:
+        while True:
+            task_id = "".join(secrets.choice(JOB_ID_ALPHABET) for _ in range(9))
+            if task_id not in self.jobs:
+                return task_id
+
+    def submit(self, client, message, kind: str, task_type: str, user=None) -> Job:
+        """
+        Start a registered handler in the background
+
+        Args:
+            message: Command message the handler is called with
+            kind: Registered handler name
+            task_type: Description shown in /tasks
+            user: Requesting user when the message was sent by the bot
+                (callbacks); passed to the handler as a third argument
+        """
+        user = user or message.from_user
+        job = Job(
+            self._new_id(),
+            user.id,
+            kind,
+            task_type,
+            message.chat.id,
+            message.id,
+            getattr(message, "command", None)
+        )
+        args = (user,) if user is not message.from_user else ()
+        self._start(client, job, self.handlers[kind](client, message, *args))
+        return job
+
+    def _start(self, client, job: Job, coro: Coroutine):
+        job.client = client
+        self.jobs[job.task_id] = job
+        job.task = asyncio.create_task(self._run(job, coro))
+
+    async def _run(self, job: Job, coro: Coroutine):
+        current_job.set(job)
+        status = "done"
+        try:
+            await self._save(job)
+            await coro
+        except asyncio.CancelledError:
+            if self.shutting_down:
+                # Leave the record as is so the next start resumes it
+                logger.info(f"Job {job.task_id} ({job.task_type}) interrupted by shutdown")
+                status = None
+            else:
+                logger.info(f"Job {job.task_id} ({job.task_type}) cancelled")
+                status = "cancelled"
+        except Exception as e:
+            logger.error(f"Job {job.task_id} ({job.task_type}) failed: {e}")
+            status = "failed"
+        finally:
+            self.jobs.pop(job.task_id, None)
+            if status:
+                await self._finish(job, status)
+
+    async def _save(self, job: Job):
+        try:
+            await job.client.db.save_job(job.to_doc())
+        except Exception as e:
+            logger.error(f"Error saving job {job.task_id}: {e}")
+
+    async def _finish(self, job: Job, status: str, error: str = None):
+        try:
+            await job.client.db.finish_job(job.task_id, status, error)
+        except Exception as e:
+            logger.error(f"Error finishing job {job.task_id}: {e}")
+
+    async def resume(self, client):
+        """Resume jobs left unfinished by the previous run, or fail them cleanly"""
+        try:
+            docs = await client.db.get_unfinished_jobs()
+        except Exception as e:
+            logger.error(f"Error loading unfinished jobs: {e}")
+            return
+
+        for doc in docs:
+            job = Job.from_doc(doc)
+            job.client = client
+            handler = self.handlers.get(job.kind)
+            message = None
+            reason = None
+
+            if not handler:
+                reason = "This task type can no longer be resumed."
+            elif job.attempts > MAX_RESUMES:
+                reason = "The task was interrupted too many times."
+            else:
+                try:
+                    message = await client.get_messages(job.chat_id, job.message_id)
+                except Exception as e:
+                    logger.error(f"Error fetching message for job {job.task_id}: {e}")
+                if not message or message.empty:
+                    reason = "The original message is no longer available."
+
+            if reason:
+                await self._finish(job, "failed", reason)
+                try:
+                    await client.send_message(
+                        job.chat_id,
+                        f"❌ **Task interrupted by a restart**\n\n"
+                        f"**Task:** {job.task_type}\n"
+                        f"**Reason:** {reason}\n\n"
+                        f"Please send the command again."
+                    )
+                except:
+                    pass
+                continue
+
+            args = ()
+            message.command = job.command
+            if not message.from_user or message.from_user.id != job.user_id:
+                args = (await client.get_users(job.user_id),)
+
+            logger.info(f"Resuming job {job.task_id} ({job.task_type}) from stage {job.resumed_stage}")
+            self._start(client, job, handler(client, message, *args))
+            try:
+                await client.send_message(
+                    job.chat_id,
+                    f"♻️ **Resuming task after a restart**\n\n"
+                    f"**Task:** {job.task_type}\n"
+                    f"**Task ID:** `/stop{job.task_id}`"
+                )
+            except:
+                pass
+
+    def cancel(self, user_id: int, task_id: str) -> bool:
+        """Cancel a user's job; running ffmpeg processes are killed with it"""
+        job = self.jobs.get(task_id)
+        if not job or job.user_id != user_id:
+            return False
+        job.task.cancel()
+        return True
+
+    def user_jobs(self, user_id: int) -> List[Job]:
+        """Jobs currently running or queued for a user"""
+        return [job for job in self.jobs.values() if job.user_id == user_id]
+
+    async def shutdown(self):
+        """Stop every job, keeping their records so they resume on next start"""
+        self.shutting_down = True
+        tasks = [job.task for job in self.jobs.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Shared runner for background jobs
+job_runner = JobRunner()
+
+
+async def set_stage(stage: str, **artifacts):
+    """Record the current job's stage and any artifact paths it produced"""
+    job = current_job.get()
+    if not job:
+        return
+    job.stage = stage
+    job.artifacts.update(artifacts)
+    await job_runner._save(job)
+
+
+async def set_premium(premium: bool):
+    """Record which scheduler lane the current job waits in"""
+    job = current_job.get()
+    if not job or job.premium == premium:
+        return
+    job.premium = premium
+    await job_runner._save(job)
+
+
+async def report_progress(snapshot):
+    """Progress subscriber that keeps the current job's record up to date"""
+    job = current_job.get()
+    if not job:
+        return
+    job.progress = snapshot
+    await job_runner._save(job)
+
+
+def resumed_artifact(stage: str, name: str):
+    """
+    Artifact left by the interrupted run of a resumed job
+
+    Only returned when that run had already reached `stage`, so a partial
+    file from a run that died mid-stage is never reused. Lists are
+    filtered down to the paths that still exist.
+    """
+    job = current_job.get()
+    if not job or not job.resumed_stage:
+        return None
+    if STAGES.index(job.resumed_stage) < STAGES.index(stage):
+        return None
+    value = job.artifacts.get(name)
+    if isinstance(value, list):
+        return [path for path in value if os.path.exists(path)]
+    if value and os.path.exists(value):
+        return value
+    return None
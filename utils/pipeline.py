@@ -0,0 +1,318 @@
+import os
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from utils.ffmpeg import FFmpegEncoder
+from utils.ffmpeg_progress import ProgressSnapshot, progress_parser
+from utils.ffmpeg_command import FFmpegCommand, Filter
+from utils.rate_control import RateProfile, apply_rate_control
+from utils.helpers import format_seconds_to_time
+from utils.transfer import GrowingFile, download_media
+
+logger = logging.getLogger(__name__)
+
+# Steps are applied in this order, whatever order they were requested in
+STEP_ORDER = ["trim", "crop", "scale", "subtitles", "watermark"]
+
+# Aspect ratios offered by /crop
+CROP_RATIOS = {
+    "16:9": (16, 9),
+    "9:16": (9, 16),
+    "1:1": (1, 1),
+    "4:3": (4, 3),
+    "21:9": (21, 9)
+}
+
+
+class EditStep:
+    """One operation of an edit pipeline"""
+
+    kind = ""
+
+    def describe(self) -> str:
+        raise NotImplementedError
+
+    def key(self) -> Dict[str, Any]:
+        """What identifies the step's effect on the output"""
+        raise NotImplementedError
+
+    def input_options(self) -> List[str]:
+        """Options placed before the source's -i"""
+        return []
+
+    def video_filters(self, offset: float) -> List[str]:
+        """
+        Filters for the video chain
+
+        Args:
+            offset: Seconds cut from the start of the source; frames reach
+                the chain with timestamps starting at 0
+        """
+        return []
+
+    async def prepare(self, work_dir: str):
+        """Fetch anything the step needs before the render"""
+
+    def cleanup(self):
+        """Remove what prepare() fetched"""
+
+
+class TrimStep(EditStep):
+    kind = "trim"
+
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+
+    def describe(self) -> str:
+        return f"✂️ Cut {format_seconds_to_time(self.start)} → {format_seconds_to_time(self.end)}"
+
+    def key(self) -> Dict[str, Any]:
+        return {"start": self.start, "end": self.end}
+
+    def input_options(self) -> List[str]:
+        return ["-ss", str(self.start), "-t", str(self.end - self.start)]
+
+
+class CropStep(EditStep):
+    kind = "crop"
+
+    def __init__(self, ratio: str):
+        self.ratio = ratio
+
+    def describe(self) -> str:
+        return f"📐 Crop to {self.ratio}"
+
+    def key(self) -> Dict[str, Any]:
+        return {"ratio": self.ratio}
+
+    def video_filters(self, offset: float) -> List[str]:
+        w, h = CROP_RATIOS[self.ratio]
+        # Largest centred window of the ratio, even sized for yuv420p
+        return [
+            f"crop=w='trunc(min(iw,ih*{w}/{h})/2)*2':h='trunc(min(ih,iw*{h}/{w})/2)*2'"
+        ]
+
+
+class ScaleStep(EditStep):
+    kind = "scale"
+
+    def __init__(self, height: int):
+        self.height = height
+
+    def describe(self) -> str:
+        return f"📏 Scale to {self.height}p"
+
+    def key(self) -> Dict[str, Any]:
+        return {"height": self.height}
+
+    def video_filters(self, offset: float) -> List[str]:
+        return [f"scale=-2:{self.height}"]
+
+
+class SubtitleStep(EditStep):
+    """Burn in a subtitle file sent as a document"""
+
+    kind = "subtitles"
+
+    def __init__(self, message):
+        self.message = message
+        self.path = None
+
+    @property
+    def file_name(self) -> str:
+        return self.message.document.file_name or "subtitle"
+
+    def describe(self) -> str:
+        return f"📝 Burn in {self.file_name}"
+
+    def key(self) -> Dict[str, Any]:
+        return {"file": self.message.document.file_unique_id}
+
+    async def prepare(self, work_dir: str):
+        # Our own file name, so the path needs no filtergraph escaping
+        ext = os.path.splitext(self.file_name)[1].lower()
+        name = f"sub_{self.message.document.file_unique_id}{ext}"
+        self.path = await download_media(self.message, file_name=os.path.join(work_dir, name))
+
+    def video_filters(self, offset: float) -> List[str]:
+        subtitles = f"subtitles=filename='{self.path}'"
+        if not offset:
+            return [subtitles]
+        # Cues are timed against the uncut source
+        return [f"setpts=PTS+{offset}/TB", subtitles, "setpts=PTS-STARTPTS"]
+
+    def cleanup(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+
+
+class WatermarkStep(EditStep):
+    kind = "watermark"
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def describe(self) -> str:
+        return f"💧 Watermark \"{self.text}\""
+
+    def key(self) -> Dict[str, Any]:
+        return {"text": self.text}
+
+    def video_filters(self, offset: float) -> List[str]:
+        return [FFmpegEncoder._drawtext_filter(self.text)]
+
+
+class EditPipeline:
+    """
+    Edits queued on one source, rendered in a single ffmpeg pass
+
+    Every step contributes input options and video filters; compile()
+    chains them into one filtergraph so the result takes one decode and
+    one encode however many edits were requested.
+    """
+
+    def __init__(self, source_id: str, steps: Optional[Dict[str, EditStep]] = None):
+        self.source_id = source_id
+        self.steps = dict(steps or {})
+
+    def add(self, step: EditStep):
+        """Add a step, replacing an earlier one of the same kind"""
+        self.steps[step.kind] = step
+
+    def with_steps(self, *steps: Optional[EditStep]) -> "EditPipeline":
+        """Copy with render-time steps (scale, watermark) added"""
+        pipeline = EditPipeline(self.source_id, self.steps)
+        for step in steps:
+            if step:
+                pipeline.add(step)
+        return pipeline
+
+    def ordered(self) -> List[EditStep]:
+        return [self.steps[kind] for kind in STEP_ORDER if kind in self.steps]
+
+    def describe(self) -> str:
+        return "\n".join(f"• {step.describe()}" for step in self.ordered())
+
+    def key(self) -> List[Dict[str, Any]]:
+        """Canonical description for result caching"""
+        return [{"step": step.kind, **step.key()} for step in self.ordered()]
+
+    async def prepare(self, work_dir: str):
+        for step in self.ordered():
+            await step.prepare(work_dir)
+
+    def cleanup(self):
+        for step in self.ordered():
+            step.cleanup()
+
+    def compile(
+        self,
+        input_file: str,
+        output_file: str,
+        codec: str = "libx264",
+        preset: str = "medium",
+        crf: int = 23,
+        audio_bitrate: str = "128k",
+        rate: Optional[RateProfile] = None,
+        fragmented: bool = False
+    ) -> FFmpegCommand:
+        """Build the ffmpeg command rendering every step"""
+        steps = self.ordered()
+        trim = self.steps.get("trim")
+        offset = trim.start if trim else 0
+
+        command = FFmpegCommand().progress()
+        source = command.add_input(input_file)
+        for step in steps:
+            options = step.input_options()
+            for flag, value in zip(options[::2], options[1::2]):
+                source.set(flag, value)
+        output = command.add_output(output_file)
+
+        chain = []
+        for step in steps:
+            chain.extend(Filter.parse(text) for text in step.video_filters(offset))
+        if chain:
+            command.graph.chain(["0:v:0"], chain, ["v"])
+            output.map("[v]")
+        else:
+            output.map("0:v:0")
+        output.map("0:a:0?")
+
+        apply_rate_control(output, codec, preset, crf, rate)
+        output.audio_codec("aac", bitrate=audio_bitrate, sample_rate=48000)
+        output.set("-movflags", FFmpegEncoder._movflags(fragmented))
+        return command
+
+    async def render(
+        self,
+        input_file: Optional[str],
+        output_file: str,
+        input_stream: Optional[GrowingFile] = None,
+        progress_callback: Optional[Callable[[ProgressSnapshot], Awaitable[None]]] = None,
+        duration: float = 0,
+        **options
+    ) -> bool:
+        """
+        Run compile()'s command; input_stream pipes in a running download
+
+        duration is the source's, progress is measured against the
+        trimmed length when a trim is queued.
+        """
+        trim = self.steps.get("trim")
+        if trim and duration:
+            duration = max(min(trim.end, duration) - trim.start, 0)
+        try:
+            command = self.compile("pipe:0" if input_stream else input_file, output_file, **options)
+            parser = progress_parser(duration, progress_callback)
+            return await FFmpegEncoder._run(command, "Pipeline", parser.feed, input_stream)
+        except Exception as e:
+            logger.error(f"Pipeline error: {e}")
+            return False
+
+
+class PipelineStore:
+    """
+    Edits each user has queued, rendered by their next encode of the video
+
+    Only one source per user is tracked; queueing an edit on another video
+    starts over. Like pending subtitles, this lives in memory.
+    """
+
+    def __init__(self):
+        self.pipelines = {}
+
+    def add(self, user_id: int, video_message, step: EditStep) -> EditPipeline:
+        media = video_message.video or video_message.document
+        pipeline = self.pipelines.get(user_id)
+        if not pipeline or pipeline.source_id != media.file_unique_id:
+            pipeline = EditPipeline(media.file_unique_id)
+            self.pipelines[user_id] = pipeline
+        pipeline.add(step)
+        return pipeline
+
+    def get(self, user_id: int, video_message) -> Optional[EditPipeline]:
+        media = video_message.video or video_message.document
+        pipeline = self.pipelines.get(user_id)
+        if pipeline and pipeline.source_id == media.file_unique_id:
+            return pipeline
+        return None
+
+    def clear(self, user_id: int):
+        self.pipelines.pop(user_id, None)
+
+
+# Queued edits of every user
+edit_pipelines = PipelineStore()
+
+
+def pipeline_text(pipeline: EditPipeline) -> str:
+    """Reply shown after an edit is queued"""
+    return (
+        f"🧩 **Edit added**\n\n"
+        f"**Queued edits:**\n{pipeline.describe()}\n\n"
+        f"Add more with /cut, /crop or /hsub, then reply to the video with "
+        f"/process (source size) or a quality like /720p. "
+        f"Everything is rendered in a single encode."
+    )
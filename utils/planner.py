@@ -0,0 +1,160 @@
+from typing import Any, Dict, Optional
+from utils.ffmpeg_command import parse_bitrate
+
+# Encoder name -> codec_name ffprobe reports for what it produces
+ENCODER_CODECS = {
+    "libx264": "h264",
+    "libx265": "hevc",
+    "libvpx-vp9": "vp9",
+    "libaom-av1": "av1",
+    "libsvtav1": "av1"
+}
+
+# Pixel formats every player handles; anything else is re-encoded
+PLAYABLE_PIX_FMTS = {"yuv420p", "yuvj420p"}
+
+# A source averaging up to this much of the rendition's bitrate cap counts
+# as matching it; above the cap its peaks would stall streaming playback
+BITRATE_TOLERANCE = 1.0
+
+# Share of a size target kept free for MP4 boxes and muxing overhead
+CONTAINER_OVERHEAD = 0.02
+
+# Below this a size target gives an unwatchable video
+MIN_VIDEO_BITRATE = 64_000
+
+
+class EncodePlan:
+    """How a source is turned into the requested output"""
+
+    def __init__(self, copy_video: bool, copy_audio: bool, reason: str):
+        self.copy_video = copy_video
+        self.copy_audio = copy_audio
+        self.reason = reason
+
+    @property
+    def remux(self) -> bool:
+        return self.copy_video
+
+    @property
+    def summary(self) -> str:
+        """One line for the caption"""
+        if not self.copy_video:
+            return f"Re-encoded ({self.reason})"
+        if self.copy_audio:
+            return f"Remuxed, no re-encode ({self.reason})"
+        return f"Video copied, audio converted ({self.reason})"
+
+
+def _streams(info: Dict[str, Any], kind: str) -> list:
+    return [s for s in info.get("streams", []) if s.get("codec_type") == kind]
+
+
+def _video_bitrate(info: Dict[str, Any], video: dict, file_size: int, duration: float) -> int:
+    """Video bitrate from the stream, else estimated from the container"""
+    try:
+        return int(video["bit_rate"])
+    except (KeyError, TypeError, ValueError):
+        pass
+
+    audio_bits = 0
+    for audio in _streams(info, "audio"):
+        try:
+            audio_bits += int(audio["bit_rate"])
+        except (KeyError, TypeError, ValueError):
+            audio_bits += 128000
+
+    try:
+        total = int(info["format"]["bit_rate"])
+    except (KeyError, TypeError, ValueError):
+        if not (file_size and duration):
+            return 0
+        total = int(file_size * 8 / duration)
+    return max(total - audio_bits, 0)
+
+
+def plan_encode(
+    info: Optional[Dict[str, Any]],
+    height: int,
+    video_bitrate: str,
+    codec: str,
+    watermark: Optional[str] = None,
+    file_size: int = 0,
+    duration: float = 0
+) -> EncodePlan:
+    """
+    Decide between re-encoding and stream-copying a source
+
+    The video is copied when re-encoding would produce the same thing:
+    no watermark to burn in, the target codec and height already, a
+    playable pixel format and an average bitrate within the rendition's
+    cap (times BITRATE_TOLERANCE). AAC audio is copied along with it,
+    other audio is converted, which is cheap next to a video encode.
+
+    Args:
+        info: ffprobe -show_format -show_streams JSON of the source
+        height: Requested output height
+        video_bitrate: Bitrate cap of the target rendition ("3M")
+        codec: Target encoder ("libx264")
+        file_size, duration: Used to estimate the bitrate when the
+            container doesn't report one
+    """
+    if not info:
+        return EncodePlan(False, False, "source could not be probed")
+    if watermark:
+        return EncodePlan(False, False, "watermark")
+
+    videos = _streams(info, "video")
+    videos = [v for v in videos if not (v.get("disposition") or {}).get("attached_pic")]
+    if not videos:
+        return EncodePlan(False, False, "no video stream found")
+    video = videos[0]
+
+    source_codec = video.get("codec_name", "")
+    if source_codec != ENCODER_CODECS.get(codec, codec):
+        return EncodePlan(False, False, f"source is {source_codec.upper() or 'unknown codec'}")
+    source_height = video.get("height") or 0
+    if source_height != height:
+        return EncodePlan(False, False, f"source is {source_height}p")
+    if video.get("pix_fmt") not in PLAYABLE_PIX_FMTS:
+        return EncodePlan(False, False, f"source pixel format is {video.get('pix_fmt')}")
+
+    source_bitrate = _video_bitrate(info, video, file_size, duration)
+    target_bitrate = parse_bitrate(video_bitrate)
+    if not source_bitrate:
+        return EncodePlan(False, False, "source bitrate unknown")
+    if target_bitrate and source_bitrate > target_bitrate * BITRATE_TOLERANCE:
+        return EncodePlan(False, False, f"source bitrate is {source_bitrate / 1_000_000:.1f} Mbps")
+
+    audios = _streams(info, "audio")
+    copy_audio = not audios or audios[0].get("codec_name") == "aac"
+    audio_name = audios[0].get("codec_name", "").upper() if audios else "no audio"
+    reason = (
+        f"source is already {source_height}p {source_codec.upper()}/{audio_name} "
+        f"at {source_bitrate / 1_000_000:.1f} Mbps"
+    )
+    return EncodePlan(True, copy_audio, reason)
+
+
+def size_budget(target_size: int, duration: float, audio_bitrate: str) -> int:
+    """
+    Video bitrate (bits/s) for a duration-long encode to fit target_size bytes
+
+    The audio bitrate and container overhead are taken off the budget
+    first; the result may be below MIN_VIDEO_BITRATE, callers reject that.
+    """
+    if duration <= 0:
+        return 0
+    total = target_size * 8 * (1 - CONTAINER_OVERHEAD) / duration
+    return int(total - parse_bitrate(audio_bitrate))
+
+
+def retarget_bitrate(video_bitrate: int, output_size: int, target_size: int, duration: float) -> int:
+    """
+    Correct a size-targeted bitrate after an encode missed
+
+    Audio and container overhead don't change between attempts, so the
+    whole miss is taken off (or added to) the video bitrate.
+    """
+    miss = (output_size - target_size) * 8 / duration
+    return int(video_bitrate - miss)
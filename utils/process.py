@@ -0,0 +1,158 @@
+import asyncio
+import logging
+from typing import Optional, List, Callable, Awaitable, AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+# Only the tail of stderr is kept; ffmpeg can print megabytes of warnings
+STDERR_LIMIT = 64 * 1024
+
+# Grace period between SIGTERM and SIGKILL
+KILL_GRACE = 5
+
+
+class ProcessResult:
+    """Outcome of a supervised process"""
+
+    def __init__(self, returncode: int, stdout: bytes, stderr: bytes, timed_out: bool = False):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timed_out = timed_out
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0 and not self.timed_out
+
+    @property
+    def stdout_text(self) -> str:
+        return self.stdout.decode("utf-8", errors="replace")
+
+    @property
+    def stderr_text(self) -> str:
+        return self.stderr.decode("utf-8", errors="replace")
+
+
+class ProcessSupervisor:
+    """Run ffmpeg/ffprobe as asyncio subprocesses so the event loop never blocks"""
+
+    def __init__(self, stderr_limit: int = STDERR_LIMIT):
+        self.stderr_limit = stderr_limit
+        self.running = set()
+
+    async def run(
+        self,
+        cmd: List[str],
+        timeout: Optional[float] = None,
+        on_stdout_line: Optional[Callable[[str], Awaitable[None]]] = None,
+        stdin_feed: Optional[AsyncIterator[bytes]] = None
+    ) -> ProcessResult:
+        """
+        Run a command to completion
+
+        Args:
+            cmd: Command and arguments
+            timeout: Seconds before the process is killed (None = no limit)
+            on_stdout_line: Async callback for each stdout line; when set,
+                stdout is streamed to it instead of being collected
+            stdin_feed: Async iterator of bytes written to the process's
+                stdin (e.g. for `-i pipe:0`); stdin is closed when it ends
+
+        Returns:
+            ProcessResult with the exit code, stdout and the stderr tail.
+            If the calling task is cancelled, or stdin_feed raises, the
+            process is killed and the exception propagates.
+        """
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE if stdin_feed else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        self.running.add(process)
+
+        stdout = bytearray()
+        stderr = bytearray()
+
+        async def read_stdout():
+            if on_stdout_line:
+                while True:
+                    line = await process.stdout.readline()
+                    if not line:
+                        break
+                    try:
+                        await on_stdout_line(line.decode("utf-8", errors="replace").strip())
+                    except Exception as e:
+                        logger.error(f"stdout handler error: {e}")
+            else:
+                while True:
+                    chunk = await process.stdout.read(65536)
+                    if not chunk:
+                        break
+                    stdout.extend(chunk)
+
+        async def read_stderr():
+            while True:
+                chunk = await process.stderr.read(65536)
+                if not chunk:
+                    break
+                stderr.extend(chunk)
+                if len(stderr) > self.stderr_limit:
+                    del stderr[:len(stderr) - self.stderr_limit]
+
+        async def write_stdin():
+            try:
+                async for chunk in stdin_feed:
+                    process.stdin.write(chunk)
+                    await process.stdin.drain()
+                process.stdin.close()
+            except (BrokenPipeError, ConnectionResetError):
+                # The process stopped reading, its exit code tells why
+                pass
+
+        streams = [read_stdout(), read_stderr()]
+        if stdin_feed:
+            streams.append(write_stdin())
+        readers = asyncio.gather(*streams)
+        timed_out = False
+
+        try:
+            await asyncio.wait_for(asyncio.shield(readers), timeout)
+            await process.wait()
+        except asyncio.TimeoutError:
+            timed_out = True
+            logger.warning(f"Process timed out after {timeout}s: {cmd[0]}")
+            await self._kill(process)
+        except BaseException:
+            await self._kill(process)
+            raise
+        finally:
+            if not readers.done():
+                readers.cancel()
+            self.running.discard(process)
+
+        return ProcessResult(process.returncode, bytes(stdout), bytes(stderr), timed_out)
+
+    async def _kill(self, process):
+        """Terminate a process, escalating to SIGKILL after a grace period"""
+        if process.returncode is not None:
+            return
+        try:
+            process.terminate()
+            await asyncio.wait_for(process.wait(), KILL_GRACE)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+        except ProcessLookupError:
+            pass
+
+    async def terminate_all(self):
+        """Kill every running child (used on shutdown)"""
+        await asyncio.gather(
+            *(self._kill(p) for p in list(self.running)),
+            return_exceptions=True
+        )
+
+
+# Shared supervisor for all ffmpeg/ffprobe calls
+supervisor = ProcessSupervisor()
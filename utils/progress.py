@@ -1,53 +1,94 @@
 import time
 import asyncio
+import threading
+from typing import Callable, Optional
 from utils.helpers import human_readable_size, format_time, format_progress_bar
+from utils.status import status_updater
 
-try:
-    main_loop = asyncio.get_running_loop()
-except RuntimeError:
-    main_loop = None
+# Minimum seconds between two renders of the same transfer
+TRANSFER_INTERVAL = 1.0
 
-def sync_progress_callback(current, total, status_message, start_time, action="Processing"):
-    """Synchronous wrapper to call the async progress callback"""
-    if main_loop:
-        asyncio.run_coroutine_threadsafe(
-            progress_callback(current, total, status_message, start_time, action),
-            main_loop
-        )
+def transfer_text(current, total, elapsed_time, action="Processing"):
+    """Default upload/download progress text"""
+    percentage = (current / total) * 100 if total else 0
+    speed = current / elapsed_time if elapsed_time > 0 else 0
+    eta = (total - current) / speed if speed > 0 else 0
+    
+    return (
+        f"📊 **{action}...**\n\n"
+        f"{format_progress_bar(percentage)}\n\n"
+        f"**Progress:** {human_readable_size(current)} / {human_readable_size(total)}\n"
+        f"**Speed:** {human_readable_size(speed)}/s\n"
+        f"**ETA:** {format_time(eta)}\n"
+        f"**Elapsed:** {format_time(elapsed_time)}"
+    )
 
-async def progress_callback(current, total, status_message, start_time, action="Processing"):
-    """Progress callback for upload/download"""
-    try:
-        # Calculate progress
-        percentage = (current / total) * 100
+class TransferProgress:
+    """
+    Progress adapter for pyrogram downloads and uploads
+    
+    Pyrogram calls the progress callback for every chunk. Between renders
+    a call costs one clock read and a comparison; a render formats the text
+    and hands it to the status updater, which coalesces and rate limits
+    the actual edits.
+    
+    Pass `callback` to pyrogram: it is a coroutine function, so pyrogram
+    awaits it on the event loop instead of hopping to its executor thread
+    for every chunk. `report` can be called from any thread; from a worker
+    thread the render is scheduled onto the loop thread-safely.
+    """
+    
+    __slots__ = ("status_message", "action", "render", "render_args",
+                 "interval", "start_time", "next_render", "loop", "loop_thread")
+    
+    def __init__(
+        self,
+        status_message,
+        action: str = "Processing",
+        render: Optional[Callable[..., str]] = None,
+        render_args: tuple = (),
+        interval: float = TRANSFER_INTERVAL
+    ):
+        self.status_message = status_message
+        self.action = action
+        # render(current, total, *render_args) -> text; default transfer_text
+        self.render = render
+        self.render_args = render_args
+        self.interval = interval
+        self.start_time = time.time()
+        self.next_render = 0.0
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+    
+    async def callback(self, current, total):
+        """Coroutine callback for pyrogram's progress= argument"""
+        self.report(current, total)
+    
+    def report(self, current, total):
+        """Record progress from the loop thread or any worker thread"""
+        now = time.monotonic()
+        if now < self.next_render and current < total:
+            return
+        self.next_render = now + self.interval
         
-        # Calculate speed
-        elapsed_time = time.time() - start_time
-        if elapsed_time > 0:
-            speed = current / elapsed_time
-            eta = (total - current) / speed if speed > 0 else 0
+        if threading.get_ident() == self.loop_thread:
+            self._show(current, total)
         else:
-            speed = 0
-            eta = 0
-        
-        # Format progress text
-        progress_text = (
-            f"📊 **{action}...**\n\n"
-            f"{format_progress_bar(percentage)}\n\n"
-            f"**Progress:** {human_readable_size(current)} / {human_readable_size(total)}\n"
-            f"**Speed:** {human_readable_size(speed)}/s\n"
-            f"**ETA:** {format_time(eta)}\n"
-            f"**Elapsed:** {format_time(elapsed_time)}"
-        )
-        
-        # Update message every 3 seconds
-        if int(percentage) % 5 == 0:
-            try:
-                await status_message.edit_text(progress_text)
-            except:
-                pass
-    except:
-        pass
+            self.loop.call_soon_threadsafe(self._show, current, total)
+    
+    def _show(self, current, total):
+        try:
+            if self.render:
+                text = self.render(current, total, *self.render_args)
+            else:
+                text = transfer_text(current, total, time.time() - self.start_time, self.action)
+            status_updater.update(self.status_message, text)
+        except Exception:
+            pass
+
+def transfer_progress(status_message, action="Processing", render=None, render_args=()):
+    """Pyrogram progress callback showing a transfer on a status message"""
+    return TransferProgress(status_message, action, render, render_args).callback
 
 class ProgressTracker:
     """Track encoding progress"""
@@ -90,9 +131,6 @@ class ProgressTracker:
                     f"**Elapsed:** {format_time(elapsed)}"
                 )
                 
-                try:
-                    await status_message.edit_text(progress_text)
-                except:
-                    pass
+                status_updater.update(status_message, progress_text)
         except:
             pass
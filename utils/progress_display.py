@@ -1,6 +1,7 @@
 import time
 import asyncio
 from utils.helpers import human_readable_size, format_time
+from utils.status import status_updater
 
 # Store active tasks for cancellation
 active_tasks = {}
@@ -59,10 +60,7 @@ class ProfessionalProgress:
                 f"`/stop{self.task_id}`"
             )
             
-            try:
-                await status_msg.edit_text(text)
-            except:
-                pass
+            status_updater.update(status_msg, text)
                 
         except asyncio.CancelledError:
             raise
@@ -109,10 +107,7 @@ class ProfessionalProgress:
                 f"`/stop{self.task_id}`"
             )
             
-            try:
-                await status_msg.edit_text(text)
-            except:
-                pass
+            status_updater.update(status_msg, text)
                 
         except asyncio.CancelledError:
             raise
@@ -153,10 +148,7 @@ class ProfessionalProgress:
                 f"`/stop{self.task_id}`"
             )
             
-            try:
-                await status_msg.edit_text(text)
-            except:
-                pass
+            status_updater.update(status_msg, text)
                 
         except asyncio.CancelledError:
             raise
@@ -0,0 +1,125 @@
+from typing import Any, Dict, List, Optional
+from utils.ffmpeg_command import CONSTRAINED_QUALITY_CODECS, Output, parse_bitrate
+
+# Profile picked when the admin never chose one
+DEFAULT_RATE_PROFILE = "balanced"
+
+
+class RateProfile:
+    """
+    Capped CRF settings for one rendition
+
+    CRF sets the quality, maxrate/bufsize bound the bitrate over any
+    bufsize-long window so playback doesn't stall on complex scenes, and
+    a keyframe every gop seconds keeps seeking cheap. crf None uses the
+    /crf bot setting.
+    """
+
+    def __init__(self, crf: Optional[int], maxrate: str, bufsize: str, gop: float = 2):
+        self.crf = crf
+        self.maxrate = maxrate
+        self.bufsize = bufsize
+        self.gop = gop
+
+    def validate(self):
+        if self.crf is not None and not 0 <= self.crf <= 51:
+            raise ValueError("CRF must be between 0-51")
+        if not parse_bitrate(self.maxrate) or not parse_bitrate(self.bufsize):
+            raise ValueError("Invalid maxrate or bufsize")
+        if not 0.5 <= self.gop <= 20:
+            raise ValueError("GOP must be between 0.5 and 20 seconds")
+
+    def args(self, codec: str, default_crf: int) -> List[str]:
+        """Rate control options for the video encoder"""
+        crf = self.crf if self.crf is not None else default_crf
+        if codec in CONSTRAINED_QUALITY_CODECS:
+            # libvpx/libaom treat -b:v next to -crf as the cap
+            args = ["-crf", str(crf), "-b:v", self.maxrate]
+        else:
+            args = ["-crf", str(crf), "-maxrate", self.maxrate, "-bufsize", self.bufsize]
+        return args + ["-force_key_frames", f"expr:gte(t,n_forced*{self.gop:g})"]
+
+    def with_crf(self, crf: int) -> "RateProfile":
+        """Same caps with another CRF"""
+        return RateProfile(crf, self.maxrate, self.bufsize, self.gop)
+
+    def describe(self) -> str:
+        crf = "global CRF" if self.crf is None else f"CRF {self.crf}"
+        return f"{crf}, max {self.maxrate} (buffer {self.bufsize}), keyframe every {self.gop:g}s"
+
+    def to_doc(self) -> Dict[str, Any]:
+        return {"crf": self.crf, "maxrate": self.maxrate, "bufsize": self.bufsize, "gop": self.gop}
+
+    @classmethod
+    def from_doc(cls, doc: Dict[str, Any]) -> "RateProfile":
+        return cls(doc.get("crf"), doc["maxrate"], doc["bufsize"], doc.get("gop", 2))
+
+
+def _ladder(crf: Optional[int], maxrates: Dict[int, str], buffer: float, gop: float) -> Dict[int, RateProfile]:
+    """One profile per height with bufsize = buffer x maxrate"""
+    return {
+        height: RateProfile(crf, maxrate, f"{parse_bitrate(maxrate) * buffer / 1000:g}k", gop)
+        for height, maxrate in maxrates.items()
+    }
+
+
+# Built-in profiles; admins can override renditions or add profiles
+BUILTIN_RATE_PROFILES = {
+    # Global CRF, caps well above typical content so only spikes are cut
+    "balanced": _ladder(None, {
+        144: "200k", 240: "400k", 360: "800k", 480: "1500k",
+        720: "3M", 1080: "6M", 2160: "16M"
+    }, buffer=2, gop=2),
+    # Tight one-second buffer for smooth playback on slow connections
+    "streaming": _ladder(None, {
+        144: "128k", 240: "256k", 360: "512k", 480: "1M",
+        720: "2M", 1080: "4M", 2160: "8M"
+    }, buffer=1, gop=2),
+    "quality": _ladder(20, {
+        144: "300k", 240: "600k", 360: "1200k", 480: "2M",
+        720: "4500k", 1080: "8M", 2160: "24M"
+    }, buffer=2, gop=4),
+    "compact": _ladder(27, {
+        144: "100k", 240: "200k", 360: "400k", 480: "750k",
+        720: "1500k", 1080: "3M", 2160: "6M"
+    }, buffer=2, gop=4)
+}
+
+
+def rate_profiles(custom: Optional[Dict[str, Dict[str, dict]]] = None) -> Dict[str, Dict[int, RateProfile]]:
+    """
+    Built-in profiles with the admin's overrides applied
+
+    Args:
+        custom: The rate_profiles bot setting, {name: {"720": doc}}
+            (MongoDB keys are strings)
+    """
+    profiles = {name: dict(ladder) for name, ladder in BUILTIN_RATE_PROFILES.items()}
+    for name, renditions in (custom or {}).items():
+        ladder = profiles.setdefault(name, dict(BUILTIN_RATE_PROFILES[DEFAULT_RATE_PROFILE]))
+        for height, doc in renditions.items():
+            ladder[int(height)] = RateProfile.from_doc(doc)
+    return profiles
+
+
+def rendition_profile(ladder: Dict[int, RateProfile], height: int) -> RateProfile:
+    """The profile for height, else the closest smaller one (smallest if none)"""
+    if height in ladder:
+        return ladder[height]
+    smaller = [h for h in ladder if h < height]
+    return ladder[max(smaller)] if smaller else ladder[min(ladder)]
+
+
+async def load_rate_ladder(db, name: str) -> Dict[int, RateProfile]:
+    """Renditions of a named profile, the default one if it doesn't exist"""
+    profiles = rate_profiles(await db.get_bot_setting("rate_profiles", {}))
+    return profiles.get(name) or profiles[DEFAULT_RATE_PROFILE]
+
+
+def apply_rate_control(output: Output, codec: str, preset: str, crf: int, rate: Optional[RateProfile] = None):
+    """Video encoder settings of an output, plain CRF without a profile"""
+    output.video_codec(codec, preset=preset, crf=None if rate else crf)
+    if rate:
+        args = rate.args(codec, crf)
+        for flag, value in zip(args[::2], args[1::2]):
+            output.set(flag, value)
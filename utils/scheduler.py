@@ -0,0 +1,158 @@
+import asyncio
+import itertools
+import logging
+from typing import Optional
+from config import Config
+from utils.jobs import set_stage, set_premium
+from utils.status import status_updater
+
+logger = logging.getLogger(__name__)
+
+
+class QueueCleared(Exception):
+    """Raised in waiting handlers when an admin clears the queue"""
+
+    def __init__(self):
+        super().__init__("Queue cleared by admin")
+
+
+class Ticket:
+    """A handler's place in the scheduler"""
+
+    def __init__(self, user_id: int, premium: bool, seq: int, status=None):
+        self.user_id = user_id
+        self.premium = premium
+        self.seq = seq
+        self.status = status
+        self.position = 0
+        self.granted = asyncio.get_running_loop().create_future()
+
+    @property
+    def sort_key(self):
+        # Premium lane first, FIFO within a lane
+        return (not self.premium, self.seq)
+
+
+class JobScheduler:
+    """
+    Admission control for heavy jobs (download + ffmpeg + upload)
+
+    At most max_concurrent jobs run at once and each user may only run a
+    limited number of them. Waiting jobs are started premium first, then in
+    arrival order, skipping users who are at their cap. Waiting handlers
+    get their status message updated whenever their position changes.
+    """
+
+    def __init__(self, max_concurrent: int, user_limit: int, premium_user_limit: int):
+        self.max_concurrent = max_concurrent
+        self.user_limit = user_limit
+        self.premium_user_limit = premium_user_limit
+        self.waiting = []
+        self.running = []
+        self.counter = itertools.count()
+
+    def _user_limit(self, ticket: Ticket) -> int:
+        return self.premium_user_limit if ticket.premium else self.user_limit
+
+    def _user_running(self, user_id: int) -> int:
+        return sum(1 for t in self.running if t.user_id == user_id)
+
+    async def acquire(self, user_id: int, premium: bool = False, status=None) -> Ticket:
+        """Wait until the job may start; pair with release()"""
+        ticket = Ticket(user_id, premium, next(self.counter), status)
+        self.waiting.append(ticket)
+        self.waiting.sort(key=lambda t: t.sort_key)
+        self._dispatch()
+
+        if ticket.granted.done():
+            return ticket
+
+        original_text = status.text if status else None
+        try:
+            await ticket.granted
+        except BaseException:
+            if ticket in self.waiting:
+                self.waiting.remove(ticket)
+                self._dispatch()
+            elif ticket in self.running:
+                self.release(ticket)
+            raise
+
+        # Put the status message back, superseding any queued position notice
+        if original_text:
+            await status_updater.edit(status, original_text)
+        return ticket
+
+    def release(self, ticket: Ticket):
+        """Free the slot held by a finished job"""
+        if ticket in self.running:
+            self.running.remove(ticket)
+            self._dispatch()
+
+    def _dispatch(self):
+        """Start every waiting job that fits, then refresh queue positions"""
+        for ticket in list(self.waiting):
+            if len(self.running) >= self.max_concurrent:
+                break
+            if self._user_running(ticket.user_id) >= self._user_limit(ticket):
+                continue
+            self.waiting.remove(ticket)
+            self.running.append(ticket)
+            if not ticket.granted.done():
+                ticket.granted.set_result(True)
+
+        for position, ticket in enumerate(self.waiting, 1):
+            if ticket.position != position:
+                ticket.position = position
+                if ticket.status:
+                    self._show_position(ticket, position)
+
+    def _show_position(self, ticket: Ticket, position: int):
+        """Tell a waiting user where they are in the queue"""
+        lane = "💎 Premium" if ticket.premium else "Free"
+        status_updater.update(
+            ticket.status,
+            f"⏳ **Queued**\n\n"
+            f"**Position:** {position} of {len(self.waiting)}\n"
+            f"**Lane:** {lane}\n"
+            f"**Running:** {len(self.running)}/{self.max_concurrent}\n\n"
+            f"Your task will start automatically."
+        )
+
+    def clear_waiting(self) -> int:
+        """Fail every waiting job, returns how many were dropped"""
+        dropped = self.waiting
+        self.waiting = []
+        for ticket in dropped:
+            if not ticket.granted.done():
+                ticket.granted.set_exception(QueueCleared())
+        return len(dropped)
+
+    def stats(self) -> dict:
+        """Current scheduler load"""
+        return {
+            "running": len(self.running),
+            "max_concurrent": self.max_concurrent,
+            "waiting": len(self.waiting),
+            "waiting_premium": sum(1 for t in self.waiting if t.premium),
+            "waiting_free": sum(1 for t in self.waiting if not t.premium)
+        }
+
+
+# Shared scheduler for every heavy operation
+scheduler = JobScheduler(
+    Config.MAX_CONCURRENT_TASKS,
+    Config.MAX_TASKS_PER_USER,
+    Config.MAX_TASKS_PER_USER_PREMIUM
+)
+
+
+async def acquire_slot(client, user_id: int, status=None, premium: Optional[bool] = None) -> Ticket:
+    """Wait for a scheduler slot, using the premium lane for premium users"""
+    if premium is None:
+        premium = await client.db.is_premium_user(user_id)
+    await set_premium(premium)
+    ticket = await scheduler.acquire(user_id, premium, status)
+    # Every slot holder starts by fetching its source
+    await set_stage("downloading")
+    return ticket
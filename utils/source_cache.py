@@ -0,0 +1,249 @@
+import os
+import shutil
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+from config import Config
+from utils.helpers import clean_filename
+from utils.transfer import GrowingFile, download_media
+
+logger = logging.getLogger(__name__)
+
+
+class CacheEntry:
+    """A downloaded source file"""
+
+    def __init__(self, path: str, size: int, refs: int = 0):
+        self.path = path
+        self.size = size
+        self.refs = refs
+
+
+class SourceCache:
+    """
+    Disk cache of downloaded Telegram files keyed by file_unique_id
+
+    Handlers acquire a source instead of downloading it and release it when
+    done. Files stay on disk after release and are evicted least recently
+    used first once the cache grows past its byte budget; files that are
+    still acquired are never evicted.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._load()
+
+    def _load(self):
+        """Rebuild the index from disk, oldest first"""
+        os.makedirs(self.root, exist_ok=True)
+        found = []
+        for key in os.listdir(self.root):
+            entry_dir = os.path.join(self.root, key)
+            if not os.path.isdir(entry_dir):
+                continue
+            # Pyrogram leaves *.temp behind for interrupted downloads
+            files = [f for f in os.listdir(entry_dir) if not f.endswith(".temp")]
+            if len(files) != 1:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+            path = os.path.join(entry_dir, files[0])
+            found.append((os.path.getmtime(path), key, path))
+
+        for _, key, path in sorted(found):
+            size = os.path.getsize(path)
+            self.entries[key] = CacheEntry(path, size)
+            self.total_bytes += size
+
+        if self.entries:
+            logger.info(f"Source cache: {len(self.entries)} files loaded from {self.root}")
+        self._evict()
+
+    @staticmethod
+    def _media(message):
+        return message.video or message.document or message.audio
+
+    def source_path(self, message) -> str:
+        """Where the media in a message is (or will be) stored"""
+        media = self._media(message)
+        entry = self.entries.get(media.file_unique_id)
+        if entry:
+            return entry.path
+        file_name = clean_filename(getattr(media, "file_name", None) or f"{media.file_unique_id}.mp4")
+        return os.path.join(self.root, media.file_unique_id, file_name)
+
+    async def acquire(
+        self,
+        message,
+        progress: Optional[Callable] = None,
+        progress_args: tuple = (),
+        growing: Optional[GrowingFile] = None
+    ) -> str:
+        """
+        Get a local path for the media in a message, downloading it on a miss
+
+        Concurrent requests for the same file share one download. Every
+        successful acquire must be paired with release(). `growing` is
+        passed on to download_media() so the file can be read early.
+        """
+        media = self._media(message)
+        key = media.file_unique_id
+
+        while True:
+            entry = self.entries.get(key)
+            if entry and os.path.exists(entry.path):
+                if growing:
+                    growing.finish(entry.path)
+                entry.refs += 1
+                self.entries.move_to_end(key)
+                self.hits += 1
+                try:
+                    os.utime(entry.path)
+                except OSError:
+                    pass
+                return entry.path
+            if entry:
+                self._remove(key)
+
+            pending = self.pending.get(key)
+            if pending is None:
+                break
+            # Another handler is downloading this file; wait and re-check
+            await asyncio.shield(pending)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = future
+
+        try:
+            path = self.source_path(message)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            path = await download_media(
+                message,
+                file_name=path,
+                progress=progress,
+                progress_args=progress_args,
+                growing=growing
+            )
+            if not path or not os.path.exists(path):
+                raise RuntimeError("Download failed")
+
+            entry = CacheEntry(path, os.path.getsize(path), refs=1)
+            self.entries[key] = entry
+            self.total_bytes += entry.size
+        except BaseException:
+            shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+            raise
+        finally:
+            del self.pending[key]
+            future.set_result(None)
+
+        self._evict()
+        return path
+
+    def start(
+        self,
+        message,
+        progress: Optional[Callable] = None,
+        progress_args: tuple = ()
+    ) -> "SourceDownload":
+        """
+        Acquire a source in the background
+
+        On a miss with Config.OVERLAP_DOWNLOAD the download can be consumed
+        while it runs, see SourceDownload.consume().
+        """
+        media = self._media(message)
+        growing = None
+        if Config.OVERLAP_DOWNLOAD and media.file_unique_id not in self.entries:
+            growing = GrowingFile(media.file_size)
+        task = asyncio.create_task(self.acquire(message, progress, progress_args, growing))
+        return SourceDownload(self, message, task, growing)
+
+    def release(self, message):
+        """Drop a reference taken by acquire()"""
+        media = self._media(message)
+        entry = self.entries.get(media.file_unique_id)
+        if entry and entry.refs > 0:
+            entry.refs -= 1
+        self._evict()
+
+    def _remove(self, key: str):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry.size
+        shutil.rmtree(os.path.dirname(entry.path), ignore_errors=True)
+
+    def _evict(self):
+        """Evict unreferenced files, least recently used first, until under budget"""
+        for key in list(self.entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if self.entries[key].refs == 0:
+                self._remove(key)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        """Cache statistics"""
+        lookups = self.hits + self.misses
+        return {
+            "files": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "in_use": sum(1 for e in self.entries.values() if e.refs),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / lookups * 100) if lookups else 0.0
+        }
+
+
+class SourceDownload:
+    """A source being acquired by SourceCache.start()"""
+
+    def __init__(self, cache: SourceCache, message, task: asyncio.Task, growing: Optional[GrowingFile]):
+        self.cache = cache
+        self.message = message
+        self.task = task
+        self.growing = growing
+        self.path = cache.source_path(message)
+
+    async def wait(self) -> str:
+        """Local path once the download is complete"""
+        return await asyncio.shield(self.task)
+
+    async def consume(self, process: Callable[[Optional[str], Optional[GrowingFile]], Awaitable[bool]]) -> bool:
+        """
+        Run process(input_file, input_stream) overlapped with the download
+
+        Files a demuxer can read front to back (faststart MP4, MKV) are
+        handed over as the download's GrowingFile while it is still being
+        fetched. Anything else, or an overlapped run that fails, is
+        processed from the complete file instead.
+        """
+        if self.growing and not self.task.done() and await self.growing.streamable():
+            success = await process(None, self.growing)
+            path = await self.wait()
+            if success:
+                return True
+            logger.info(f"Overlapped processing of {path} failed, retrying from the complete file")
+        return await process(await self.wait(), None)
+
+    async def close(self):
+        """Release the source, or stop its download if it's still running"""
+        if not self.task.done():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        elif not self.task.cancelled() and self.task.exception() is None:
+            self.cache.release(self.message)
+
+
+# Shared source cache for all handlers
+source_cache = SourceCache(Config.SOURCE_CACHE_DIR, Config.SOURCE_CACHE_SIZE)
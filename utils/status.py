@@ -0,0 +1,159 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from pyrogram.errors import FloodWait, MessageNotModified
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Last text sent is remembered for this many messages
+TEXT_MEMORY = 1000
+
+
+class StatusUpdater:
+    """
+    Single path for editing status messages
+
+    Progress producers call update(), which only records the latest text
+    for a message; a background worker sends it when the chat's edit
+    budget allows (one edit per chat every chat_interval seconds, and at
+    most global_rate edits per second overall). Stale intermediate states
+    are never sent, text identical to what is already shown is skipped,
+    and a FloodWait pauses that chat for the time Telegram asks for.
+
+    Stage changes and results go through edit(), which is sent right away
+    and supersedes any progress still queued for the message, so a late
+    progress edit can't overwrite it.
+    """
+
+    def __init__(self, chat_interval: float, global_rate: float):
+        self.chat_interval = chat_interval
+        self.global_interval = 1 / global_rate if global_rate > 0 else 0
+        self.pending = OrderedDict()
+        self.last_text = OrderedDict()
+        self.chat_ready = {}
+        self.flood_until = {}
+        self.next_global = 0.0
+        self.wakeup = None
+        self.worker = None
+        self.sent = 0
+        self.skipped = 0
+        self.flood_waits = 0
+
+    @staticmethod
+    def _key(message) -> tuple:
+        return (message.chat.id, message.id)
+
+    def update(self, message, text: str):
+        """Queue the latest text for a message, replacing anything queued before"""
+        key = self._key(message)
+        if self.last_text.get(key) == text:
+            # Already on screen, an older queued state is now stale
+            if self.pending.pop(key, None):
+                self.skipped += 1
+            return
+        if key in self.pending:
+            self.skipped += 1
+        self.pending[key] = (message, text)
+
+        if self.worker is None or self.worker.done():
+            self.wakeup = asyncio.Event()
+            self.worker = asyncio.create_task(self._run())
+        self.wakeup.set()
+
+    async def edit(self, message, text: str):
+        """Show a stage change or result now, dropping queued progress"""
+        key = self._key(message)
+        self.pending.pop(key, None)
+        if self.last_text.get(key) == text:
+            return
+        if self.flood_until.get(key[0], 0) > time.monotonic():
+            # The chat is flood limited; send as soon as it may edit again
+            self.update(message, text)
+            return
+        if not await self._send(key, message, text):
+            self.update(message, text)
+
+    async def _run(self):
+        while True:
+            if not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            ready = None
+            soonest = None
+            for key in self.pending:
+                at = max(self.chat_ready.get(key[0], 0), self.flood_until.get(key[0], 0))
+                if at <= now:
+                    ready = key
+                    break
+                soonest = at if soonest is None else min(soonest, at)
+
+            if ready is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), soonest - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            if self.next_global > now:
+                await asyncio.sleep(self.next_global - now)
+            if ready not in self.pending:
+                continue
+
+            message, text = self.pending.pop(ready)
+            if not await self._send(ready, message, text):
+                # Keep it unless a newer state arrived meanwhile
+                self.pending.setdefault(ready, (message, text))
+
+    async def _send(self, key: tuple, message, text: str) -> bool:
+        """Edit a message, returns False when it should be retried later"""
+        chat_id = key[0]
+        now = time.monotonic()
+        self.chat_ready[chat_id] = now + self.chat_interval
+        self.next_global = max(self.next_global, now) + self.global_interval
+
+        try:
+            await message.edit_text(text)
+            self.sent += 1
+        except FloodWait as e:
+            self.flood_waits += 1
+            self.flood_until[chat_id] = time.monotonic() + e.value
+            logger.warning(f"FloodWait in chat {chat_id}: pausing status edits for {e.value}s")
+            return False
+        except MessageNotModified:
+            pass
+        except Exception as e:
+            # Deleted message, chat gone, ...: nothing to retry
+            logger.debug(f"Status edit failed in chat {chat_id}: {e}")
+
+        self._remember(key, text)
+        return True
+
+    def _remember(self, key: tuple, text: str):
+        self.last_text[key] = text
+        self.last_text.move_to_end(key)
+        while len(self.last_text) > TEXT_MEMORY:
+            self.last_text.popitem(last=False)
+
+        now = time.monotonic()
+        if len(self.chat_ready) > TEXT_MEMORY:
+            self.chat_ready = {c: t for c, t in self.chat_ready.items() if t > now}
+            self.flood_until = {c: t for c, t in self.flood_until.items() if t > now}
+
+    def stats(self) -> dict:
+        """Edit counters"""
+        return {
+            "sent": self.sent,
+            "skipped": self.skipped,
+            "pending": len(self.pending),
+            "flood_waits": self.flood_waits
+        }
+
+
+# Shared updater for every status message
+status_updater = StatusUpdater(Config.STATUS_EDIT_INTERVAL, Config.STATUS_EDITS_PER_SECOND)
@@ -0,0 +1,533 @@
+import os
+import mmap
+import asyncio
+import inspect
+import logging
+from typing import Awaitable, Callable, Optional
+from pyrogram import raw
+from pyrogram.errors import AuthBytesInvalid
+from pyrogram.file_id import FileId, FileType
+from pyrogram.session import Auth, Session
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# upload.GetFile wants offsets that are multiples of the limit; 1MB is its maximum
+CHUNK_SIZE = 1024 * 1024
+
+# Largest upload part Telegram accepts; files above BIG_FILE_SIZE go up as big file parts
+UPLOAD_PART_SIZE = 512 * 1024
+BIG_FILE_SIZE = 10 * 1024 * 1024
+
+
+class SessionPool:
+    """
+    Extra MTProto media sessions, a few per datacenter
+
+    Pyrogram fetches a file over one media session, one 1MB request at a
+    time, so a download is bound by the round trip to the file's DC. The
+    pool keeps up to `size` sessions per DC (authorized on foreign DCs via
+    an exported authorization) which transfers spread their requests over.
+    Sessions are created on first use and reused until stop().
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.sessions = {}
+        self.locks = {}
+
+    async def get(self, client, dc_id: int) -> list:
+        """Sessions connected to a DC, creating them if needed"""
+        lock = self.locks.setdefault(dc_id, asyncio.Lock())
+        async with lock:
+            sessions = self.sessions.setdefault(dc_id, [])
+            while len(sessions) < self.size:
+                sessions.append(await self._connect(client, dc_id))
+            return sessions
+
+    async def _connect(self, client, dc_id: int) -> Session:
+        test_mode = await client.storage.test_mode()
+        if dc_id == await client.storage.dc_id():
+            session = Session(client, dc_id, await client.storage.auth_key(), test_mode, is_media=True)
+            await session.start()
+            return session
+
+        session = Session(client, dc_id, await Auth(client, dc_id, test_mode).create(), test_mode, is_media=True)
+        await session.start()
+        try:
+            for _ in range(3):
+                exported = await client.invoke(raw.functions.auth.ExportAuthorization(dc_id=dc_id))
+                try:
+                    await session.invoke(
+                        raw.functions.auth.ImportAuthorization(id=exported.id, bytes=exported.bytes)
+                    )
+                    return session
+                except AuthBytesInvalid:
+                    continue
+            raise AuthBytesInvalid
+        except BaseException:
+            await session.stop()
+            raise
+
+    async def stop(self):
+        """Close every pooled session"""
+        sessions = [s for dc in self.sessions.values() for s in dc]
+        self.sessions = {}
+        for session in sessions:
+            try:
+                await session.stop()
+            except Exception:
+                pass
+
+
+# Shared sessions for parallel transfers
+session_pool = SessionPool(Config.TRANSFER_SESSIONS)
+
+# Matroska/WebM files start with an EBML header
+EBML_MAGIC = b"\x1a\x45\xdf\xa3"
+
+
+class GrowingFile:
+    """
+    A download that can be read while it is still being written
+
+    The downloader reports how long the contiguous prefix written so far
+    is; readers block on bytes that haven't arrived yet. If the download
+    can't provide that (single stream fallback, errors) it fails the file
+    and readers raise, the download itself carrying on as usual.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.path = None
+        self.available = 0
+        self.error = None
+        self.changed = asyncio.Event()
+
+    def extend(self, path: str, available: int):
+        self.path = path
+        self.available = available
+        self.changed.set()
+
+    def finish(self, path: str):
+        self.extend(path, self.size)
+
+    def fail(self, error: Exception):
+        if self.available < self.size:
+            self.error = error
+            self.changed.set()
+
+    async def _wait_for(self, end: int):
+        end = min(end, self.size)
+        while self.available < end:
+            if self.error:
+                raise self.error
+            self.changed.clear()
+            await self.changed.wait()
+
+    async def read(self, offset: int, length: int) -> bytes:
+        await self._wait_for(offset + length)
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    async def chunks(self, block: int = CHUNK_SIZE):
+        """Yield the whole file in order, waiting for the download as needed"""
+        loop = asyncio.get_running_loop()
+        await self._wait_for(1)
+        with open(self.path, "rb") as f:
+            position = 0
+            while position < self.size:
+                await self._wait_for(position + 1)
+                length = min(block, self.available - position)
+                data = await loop.run_in_executor(None, f.read, length)
+                if not data:
+                    raise RuntimeError(f"Unexpected end of {self.path} at {position}")
+                position += len(data)
+                yield data
+
+    async def streamable(self) -> bool:
+        """
+        Whether a demuxer can read the file front to back
+
+        True for Matroska/WebM and for MP4/MOV with the moov index before
+        the media data (faststart). Other files need seeking to the end.
+        """
+        try:
+            head = await self.read(0, 16)
+            if head.startswith(EBML_MAGIC):
+                return True
+            if head[4:8] != b"ftyp":
+                return False
+
+            offset = 0
+            while offset + 8 <= self.size:
+                header = await self.read(offset, 16)
+                box_size = int.from_bytes(header[:4], "big")
+                box_type = header[4:8]
+                if box_type == b"moov":
+                    return True
+                if box_type == b"mdat":
+                    return False
+                if box_size == 1:
+                    box_size = int.from_bytes(header[8:16], "big")
+                if box_size < 8:
+                    return False
+                offset += box_size
+            return False
+        except Exception:
+            return False
+
+
+def _media(message):
+    return (
+        message.video or message.document or message.audio
+        or message.animation or message.voice or message.video_note
+    )
+
+
+def _target_path(file_name: str, media) -> str:
+    """Resolve a download path the way message.download() does"""
+    directory, name = os.path.split(file_name)
+    name = name or getattr(media, "file_name", None) or f"{media.file_unique_id}"
+    directory = directory or Config.DOWNLOAD_DIR
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+async def _report(progress: Optional[Callable], current: int, total: int, progress_args: tuple):
+    if not progress:
+        return
+    try:
+        if inspect.iscoroutinefunction(progress):
+            await progress(current, total, *progress_args)
+        else:
+            progress(current, total, *progress_args)
+    except Exception as e:
+        logger.debug(f"Progress callback error: {e}")
+
+
+async def download_media(
+    message,
+    file_name: str = "",
+    progress: Optional[Callable] = None,
+    progress_args: tuple = (),
+    growing: Optional[GrowingFile] = None
+) -> str:
+    """
+    Download a message's media, fetching byte ranges in parallel
+
+    Drop-in for message.download(). Files of at least
+    Config.PARALLEL_DOWNLOAD_MIN_SIZE are split into 1MB chunks that
+    Config.TRANSFER_SESSIONS sessions fetch concurrently and write at their
+    offsets into a preallocated file. Smaller files, a parallelism of 1 and
+    any failure of the parallel path (CDN redirects, expired file
+    references, ...) use pyrogram's single stream instead.
+
+    A GrowingFile passed as `growing` is extended as the parallel download
+    progresses, so it can be read before the download is complete.
+    """
+    media = _media(message)
+    if (
+        not media
+        or session_pool.size < 2
+        or media.file_size < Config.PARALLEL_DOWNLOAD_MIN_SIZE
+    ):
+        if growing:
+            growing.fail(RuntimeError("Single stream downloads can't be followed"))
+        return await message.download(file_name=file_name, progress=progress, progress_args=progress_args)
+
+    path = _target_path(file_name, media)
+    try:
+        await _download_parallel(message._client, media, path, progress, progress_args, growing)
+        return path
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.warning(f"Parallel download failed ({e}), falling back to a single stream")
+        if growing:
+            growing.fail(e)
+
+    return await message.download(file_name=path, progress=progress, progress_args=progress_args)
+
+
+async def _download_parallel(
+    client,
+    media,
+    path: str,
+    progress,
+    progress_args: tuple,
+    growing: Optional[GrowingFile] = None
+):
+    file_id = FileId.decode(media.file_id)
+    if file_id.file_type in (FileType.PHOTO, FileType.CHAT_PHOTO, FileType.THUMBNAIL):
+        raise ValueError("Photos are downloaded with a single stream")
+
+    location = raw.types.InputDocumentFileLocation(
+        id=file_id.media_id,
+        access_hash=file_id.access_hash,
+        file_reference=file_id.file_reference,
+        thumb_size=file_id.thumbnail_size
+    )
+    size = media.file_size
+    chunks = (size + CHUNK_SIZE - 1) // CHUNK_SIZE
+    sessions = await session_pool.get(client, file_id.dc_id)
+    loop = asyncio.get_running_loop()
+
+    temp_path = path + ".temp"
+    fd = os.open(temp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+    next_chunk = 0
+    done = 0
+    # Chunks finish out of order; followers only see the contiguous prefix
+    finished = set()
+    contiguous = 0
+
+    async def worker(session: Session):
+        nonlocal next_chunk, done, contiguous
+        while next_chunk < chunks:
+            index = next_chunk
+            next_chunk += 1
+            offset = index * CHUNK_SIZE
+            result = await session.invoke(
+                raw.functions.upload.GetFile(location=location, offset=offset, limit=CHUNK_SIZE)
+            )
+            if not isinstance(result, raw.types.upload.File):
+                raise RuntimeError(f"Unexpected {type(result).__name__} for chunk {index}")
+            expected = min(CHUNK_SIZE, size - offset)
+            if len(result.bytes) != expected:
+                raise RuntimeError(f"Short read for chunk {index}: {len(result.bytes)}/{expected}")
+            await loop.run_in_executor(None, os.pwrite, fd, result.bytes, offset)
+            done += len(result.bytes)
+            if growing:
+                finished.add(index)
+                while contiguous in finished:
+                    finished.discard(contiguous)
+                    contiguous += 1
+                growing.extend(temp_path, min(contiguous * CHUNK_SIZE, size))
+            await _report(progress, done, size, progress_args)
+
+    try:
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except (AttributeError, OSError):
+            os.ftruncate(fd, size)
+
+        tasks = [asyncio.create_task(worker(s)) for s in sessions[:chunks]]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+    except BaseException:
+        os.close(fd)
+        os.remove(temp_path)
+        raise
+
+    os.close(fd)
+    os.replace(temp_path, path)
+    if growing:
+        growing.finish(path)
+
+
+def can_upload_parallel(path) -> bool:
+    """Whether upload_file() should be used for a file given to save_file()"""
+    return (
+        session_pool.size >= 2
+        and isinstance(path, str)
+        and os.path.isfile(path)
+        and os.path.getsize(path) > BIG_FILE_SIZE
+    )
+
+
+async def upload_file(
+    client,
+    path: str,
+    progress: Optional[Callable] = None,
+    progress_args: tuple = ()
+) -> raw.types.InputFileBig:
+    """
+    Upload a local file as big file parts sent concurrently
+
+    At most Config.UPLOAD_PARTS_IN_FLIGHT parts are in flight at once,
+    spread over the pooled sessions to the bot's own DC. Parts are read
+    from an mmap of the file, so only the parts in flight (serialized
+    into their requests by pyrogram) are held in memory.
+    """
+    size = os.path.getsize(path)
+    parts = (size + UPLOAD_PART_SIZE - 1) // UPLOAD_PART_SIZE
+    file_id = client.rnd_id()
+    sessions = await session_pool.get(client, await client.storage.dc_id())
+    next_part = 0
+    done = 0
+
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mm)
+
+        async def worker(session: Session):
+            nonlocal next_part, done
+            while next_part < parts:
+                index = next_part
+                next_part += 1
+                offset = index * UPLOAD_PART_SIZE
+                end = min(offset + UPLOAD_PART_SIZE, size)
+                saved = await session.invoke(
+                    raw.functions.upload.SaveBigFilePart(
+                        file_id=file_id,
+                        file_part=index,
+                        file_total_parts=parts,
+                        bytes=view[offset:end]
+                    )
+                )
+                if not saved:
+                    raise RuntimeError(f"Part {index} of {path} was not saved")
+                done += end - offset
+                await _report(progress, done, size, progress_args)
+
+        tasks = [
+            asyncio.create_task(worker(sessions[i % len(sessions)]))
+            for i in range(min(Config.UPLOAD_PARTS_IN_FLIGHT, parts))
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            view.release()
+            try:
+                mm.close()
+            except BufferError:
+                # A failed part still referenced from a traceback; closed when collected
+                pass
+
+    return raw.types.InputFileBig(id=file_id, parts=parts, name=os.path.basename(path))
+
+
+# Outputs uploaded while they were written, picked up by Bot.save_file
+prepared_uploads = {}
+
+# How often a file being written is checked for new parts
+FOLLOW_INTERVAL = 0.5
+
+
+async def upload_while_writing(client, path: str, write: Callable[[], Awaitable[bool]]) -> bool:
+    """
+    Run write() and upload `path` as it grows
+
+    For writers that only ever append (fragmented MP4). Complete 512KB
+    parts are sent as soon as they are on disk, with the total part count
+    left open (-1) as Telegram allows for streamed uploads; the rest go
+    once write() succeeds, the last one carrying the total. The result is
+    stored in prepared_uploads so the next upload of `path` only sends the
+    media message. Outputs below BIG_FILE_SIZE, or any upload error, leave
+    the file to be uploaded normally.
+
+    Returns write()'s result.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    prepared_uploads.pop(path, None)
+
+    file_id = client.rnd_id()
+    sessions = await session_pool.get(client, await client.storage.dc_id())
+    queue = asyncio.Queue(Config.UPLOAD_PARTS_IN_FLIGHT)
+    loop = asyncio.get_running_loop()
+    total = -1
+    writing = True
+    error = None
+
+    async def send(session: Session, fd: int, index: int):
+        data = await loop.run_in_executor(
+            None, os.pread, fd, UPLOAD_PART_SIZE, index * UPLOAD_PART_SIZE
+        )
+        saved = await session.invoke(
+            raw.functions.upload.SaveBigFilePart(
+                file_id=file_id,
+                file_part=index,
+                file_total_parts=total,
+                bytes=data
+            )
+        )
+        if not saved:
+            raise RuntimeError(f"Part {index} of {path} was not saved")
+
+    async def worker(session: Session, fd: int):
+        nonlocal error
+        while True:
+            index = await queue.get()
+            try:
+                # After a failure the rest of the queue is only drained
+                if not error:
+                    await send(session, fd, index)
+            except Exception as e:
+                error = e
+            finally:
+                queue.task_done()
+
+    async def follow() -> Optional[raw.types.InputFileBig]:
+        nonlocal total
+        while not os.path.exists(path):
+            if not writing:
+                return None
+            await asyncio.sleep(FOLLOW_INTERVAL)
+
+        fd = os.open(path, os.O_RDONLY)
+        workers = [
+            asyncio.create_task(worker(sessions[i % len(sessions)], fd))
+            for i in range(Config.UPLOAD_PARTS_IN_FLIGHT)
+        ]
+        try:
+            next_part = 0
+            while writing:
+                # Only parts with data after them, the last part is sent at the end
+                size = os.fstat(fd).st_size
+                while (next_part + 1) * UPLOAD_PART_SIZE < size:
+                    await queue.put(next_part)
+                    next_part += 1
+                await asyncio.sleep(FOLLOW_INTERVAL)
+
+            size = os.fstat(fd).st_size
+            if size <= BIG_FILE_SIZE:
+                return None
+            total = (size + UPLOAD_PART_SIZE - 1) // UPLOAD_PART_SIZE
+            while next_part < total - 1:
+                await queue.put(next_part)
+                next_part += 1
+            await queue.join()
+            if error:
+                raise error
+            await send(sessions[0], fd, total - 1)
+            return raw.types.InputFileBig(id=file_id, parts=total, name=os.path.basename(path))
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            os.close(fd)
+
+    follower = asyncio.create_task(follow())
+    try:
+        success = await write()
+    except BaseException:
+        follower.cancel()
+        await asyncio.gather(follower, return_exceptions=True)
+        raise
+
+    writing = False
+    if not success:
+        follower.cancel()
+        await asyncio.gather(follower, return_exceptions=True)
+        return False
+
+    try:
+        uploaded = await follower
+        if uploaded:
+            prepared_uploads[path] = uploaded
+    except Exception as e:
+        logger.warning(f"Streamed upload of {path} failed ({e}), it will be uploaded normally")
+    return True
+